@@ -0,0 +1,908 @@
+'''Software Written by Nicholas Guilbeault 2018'''
+
+# Import libraries.
+import numpy as np
+import cv2
+import os
+import sys
+import time
+import json
+import platform
+import tempfile
+import shutil
+import types
+import subprocess
+import multiprocessing as mp
+import free_swimming_tail_tracking_UT as ut
+import free_swimming_tail_tracking_KIN as kin
+
+# The resource module is only available on Unix. The peak resident set size is not reported when it is not available.
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Modules that the tracking library and the command line interface must not import. Only the GUI and PLOT import them, when they are needed.
+heavy_modules = ['PyQt5', 'matplotlib']
+
+# Maximum time in milliseconds taken to import each module, including the modules that it imports. The tracking library is dominated by importing numpy and OpenCV.
+import_time_budgets = { 'free_swimming_tail_tracking_UT' : 400,
+                        'free_swimming_tail_tracking_KIN' : 250,
+                        'free_swimming_tail_tracking_CL' : 50
+                    }
+
+def calculate_next_coords_reference(init_coords, radius, frame, angle = 0, n_angles = 20, range_angles = np.pi * 2.0 / 3.0, tail_calculation = True):
+    '''
+    Reference implementation of calculate_next_coords that searches the entire frame for the brightest pixels.
+    Used to check that the results of calculate_next_coords have not changed.
+    '''
+    # Calculate list of angles.
+    angles = np.linspace(angle - range_angles / 2, angle + range_angles / 2, n_angles)
+    # Calculate list of all potential next coordinates.
+    next_coords = [[int(round(init_coords[0] + (radius * np.sin(angles[i])))), int(round(init_coords[1] + (radius * np.cos(angles[i]))))] for i in range(len(angles))]
+    # Remove duplicate coordinates.
+    next_coords = [next_coords[i] for i in range(len(next_coords)) if next_coords[i][0] != next_coords[i - 1][0] or next_coords[i][1] != next_coords[i - 1][1]]
+    # Get the list of coordinates where the potential next coordinates are the brightest pixels in the frame.
+    coords = np.transpose(np.where(frame == np.max([frame[i[0]][i[1]] for i in next_coords])))
+    # Get only the coordinates that were in the original list.
+    next_coords = [[coords[j] for i in range(len(next_coords)) if coords[j][0] == next_coords[i][0] and coords[j][1] == next_coords[i][1]] for j in range(len(coords))]
+    # Convert the coordinates to lists.
+    next_coords = [next_coords[i][0].tolist() for i in range(len(next_coords)) if len(next_coords[i]) > 0]
+    # Checks if more than one set of coordinates was found. This can occur if there are multiple pixels with the same (maximum) value.
+    if len(next_coords) > 1:
+        if tail_calculation:
+            # Take the set of coordinates whose angle is most similar to the previous angle.
+            min_value = np.min([abs(angle - np.arctan2(next_coords[i][0] - init_coords[0], next_coords[i][1] - init_coords[1])) for i in range(len(next_coords))])
+            next_coords = [next_coords[i] for i in range(len(next_coords)) if abs(angle - np.arctan2(next_coords[i][0] - init_coords[0], next_coords[i][1] - init_coords[1])) == min_value]
+        else:
+            # Take the set of coordinates whose length to the initial coordinates is the shortest.
+            min_value = np.min([np.hypot(next_coords[i][0] - init_coords[0], next_coords[i][1] - init_coords[1]) for i in range(len(next_coords))])
+            next_coords = [next_coords[i] for i in range(len(next_coords)) if np.hypot(next_coords[i][0] - init_coords[0], next_coords[i][1] - init_coords[1]) == min_value]
+    # Return the first set of coordinates.
+    return np.array(next_coords[0])
+
+def create_next_coords_corpus(n_cases = 2000, frame_size = (120, 160), seed = 0):
+    '''
+    Creates a corpus of inputs to calculate_next_coords.
+
+    Steps:
+        Creates random frames with few grey levels so that ties between the brightest pixels are common.
+        Creates random initial coordinates, including non-integer coordinates and coordinates close to the edge of the frame.
+        Alternates between the tail search and the eyes and swim bladder search.
+
+    Optional Arguments:
+        n_cases (int) - Number of inputs. Default = 2000.
+        frame_size (frame height, frame width) - Size of the frames. Default = (120, 160).
+        seed (int) - Seed of the random number generator. Default = 0.
+
+    Returns:
+        corpus (list) - List of dictionaries of keyword arguments to calculate_next_coords.
+    '''
+    random_state = np.random.RandomState(seed)
+    corpus = []
+    for i in range(n_cases):
+        # Use few grey levels so that multiple coordinates often share the brightest value.
+        frame = (random_state.randint(0, 4, frame_size) * 60).astype(np.uint8)
+        radius = float(random_state.choice([3, 4.5, 5, 7.5, 10, 12]))
+        init_coords = [random_state.randint(0, frame_size[0]), random_state.randint(0, frame_size[1])]
+        if i % 3 == 0:
+            # Use half pixel coordinates, like the heading coordinates.
+            init_coords = [init_coords[0] + 0.5, init_coords[1] + 0.5]
+        if i % 2 == 0:
+            corpus.append({'init_coords' : init_coords, 'radius' : radius, 'frame' : frame, 'angle' : random_state.uniform(-np.pi, np.pi)})
+        else:
+            corpus.append({'init_coords' : init_coords, 'radius' : radius, 'frame' : frame, 'n_angles' : 100, 'range_angles' : 2 * np.pi, 'tail_calculation' : False})
+    return corpus
+
+def check_next_coords_regression(corpus = None):
+    '''
+    Checks that calculate_next_coords returns exactly the same results as the reference implementation.
+
+    Optional Arguments:
+        corpus (list) - List of dictionaries of keyword arguments to calculate_next_coords. Default = None.
+            ** When corpus is None, a corpus is created with create_next_coords_corpus.
+
+    Returns:
+        n_mismatches (int) - Number of inputs where the results are different.
+            ** Inputs where both implementations raise the same type of error count as matches.
+    '''
+    if corpus is None:
+        corpus = create_next_coords_corpus()
+    n_mismatches = 0
+    for kwargs in corpus:
+        results = []
+        for function in [calculate_next_coords_reference, ut.calculate_next_coords]:
+            try:
+                next_coords = function(**kwargs)
+                results.append((next_coords.dtype, next_coords.tolist()))
+            except Exception as error:
+                results.append(type(error))
+        if results[0] != results[1]:
+            n_mismatches += 1
+    print('Checked calculate_next_coords on {0} inputs. Mismatches: {1}.'.format(len(corpus), n_mismatches))
+    return n_mismatches
+
+def create_fish_frame(frame_size, n_tail_points = 7, dist_tail_points = 5, dist_eyes = 6, dist_swim_bladder = 8):
+    # Draw a background subtracted frame that contains a single bright fish in the centre of the frame.
+    frame = np.zeros(frame_size, dtype = np.uint8)
+    centre = np.array(frame_size) / 2
+    frame[int(centre[0]), int(centre[1]) - dist_eyes // 2] = 255
+    frame[int(centre[0]), int(centre[1]) + dist_eyes // 2] = 250
+    for m in range(n_tail_points + 1):
+        frame[int(centre[0]) + dist_swim_bladder + m * dist_tail_points, int(centre[1])] = 200 - m
+    return frame
+
+def track_tail_in_frame_reference(frame, n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, pixel_threshold = 100, calculate_next_coords = calculate_next_coords_reference):
+    # Track a single background subtracted frame with the per-frame algorithm, using the given implementation of calculate_next_coords for each search. Returns the swim bladder and tail point coordinates or None if the frame is not tracked.
+    if np.max(frame) <= pixel_threshold:
+        return None
+    # Return the coordinate of the brightest pixel.
+    first_eye_coords = [np.where(frame == np.max(frame))[0][0], np.where(frame == np.max(frame))[1][0]]
+    second_eye_coords = calculate_next_coords(first_eye_coords, dist_eyes, frame, n_angles = 100, range_angles = 2 * np.pi, tail_calculation = False)
+    heading_coords = [(first_eye_coords[0] + second_eye_coords[0]) / 2, (first_eye_coords[1] + second_eye_coords[1]) / 2]
+    swim_bladder_coords = calculate_next_coords(heading_coords, dist_swim_bladder, frame, n_angles = 100, range_angles = 2 * np.pi, tail_calculation = False)
+    body_coords = [int(round((swim_bladder_coords[0] + first_eye_coords[0] + second_eye_coords[0]) / 3)), int(round((swim_bladder_coords[1] + first_eye_coords[1] + second_eye_coords[1]) / 3))]
+    heading_angle = np.arctan2(heading_coords[0] - body_coords[0], heading_coords[1] - body_coords[1])
+    tail_angle = heading_angle - np.pi if heading_angle > 0 else heading_angle + np.pi
+    tail_points = [swim_bladder_coords]
+    for m in range(n_tail_points):
+        if m > 0:
+            tail_angle = np.arctan2(tail_points[m][0] - tail_points[m - 1][0], tail_points[m][1] - tail_points[m - 1][1])
+        tail_points.append(calculate_next_coords(tail_points[m], dist_tail_points, frame, angle = tail_angle))
+    return np.array(tail_points)
+
+def benchmark_track_tail_in_frame(frame_sizes = [(120, 160), (240, 320), (480, 640), (960, 1280)], n_repeats = 50, n_tail_points = 7, dist_tail_points = 5, dist_eyes = 6, dist_swim_bladder = 8):
+    '''
+    Measures the time taken to track a single frame at different frame sizes.
+
+    Steps:
+        The per-frame algorithm is timed with the reference implementation of calculate_next_coords and with calculate_next_coords.
+        track_tail_in_frame, which tracks the frame with the batched searches of track_tail_in_frames, is timed.
+
+    Optional Arguments:
+        frame_sizes (list) - List of frame sizes given as (frame height, frame width). Default = [(120, 160), (240, 320), (480, 640), (960, 1280)].
+        n_repeats (int) - Number of times each frame is tracked. Default = 50.
+
+    Returns:
+        benchmark_results (list) - List of dictionaries that contain the frame size and the mean time per frame in milliseconds of each implementation.
+    '''
+    benchmark_results = []
+    for frame_size in frame_sizes:
+        frame = create_fish_frame(frame_size, n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder)
+        tracking_params = [frame, True, n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, 100, False, None]
+        result = {'frame_size' : frame_size}
+        for name, function in [('reference', lambda: track_tail_in_frame_reference(frame, n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder)), ('vectorized', lambda: track_tail_in_frame_reference(frame, n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, calculate_next_coords = ut.calculate_next_coords)), ('batched', lambda: ut.track_tail_in_frame(tracking_params))]:
+            t0 = time.time()
+            for i in range(n_repeats):
+                function()
+            result[name] = (time.time() - t0) / n_repeats * 1000
+        print('Frame size: {0} x {1}. Reference: {2:.3f} ms per frame. Vectorized: {3:.3f} ms per frame. Batched: {4:.3f} ms per frame.'.format(frame_size[1], frame_size[0], result['reference'], result['vectorized'], result['batched']))
+        benchmark_results.append(result)
+    return benchmark_results
+
+def calculate_eye_angles_in_frame_reference(frame, first_eye_coords, second_eye_coords, eyes_threshold):
+    # Contour based eye angle calculation used before the binary regions were labelled with connected components. Every contour in the frame is tested against both eye coordinates.
+    thresh = cv2.threshold(frame, eyes_threshold, 255, cv2.THRESH_BINARY)[1]
+    contours = cv2.findContours(thresh, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)[-2]
+    first_eye_angle = np.nan
+    second_eye_angle = np.nan
+    for i in range(len(contours)):
+        if cv2.pointPolygonTest(contours[i], (int(first_eye_coords[1]), int(first_eye_coords[0])), False) == 1:
+            M = cv2.moments(contours[i])
+            first_eye_coords = [int(round(M['m01']/M['m00'])), int(round(M['m10']/M['m00']))]
+            first_eye_angle = cv2.fitEllipse(contours[i])[2] * np.pi / 180
+        if cv2.pointPolygonTest(contours[i], (int(second_eye_coords[1]), int(second_eye_coords[0])), False) == 1:
+            M = cv2.moments(contours[i])
+            second_eye_coords = [int(round(M['m01']/M['m00'])), int(round(M['m10']/M['m00']))]
+            second_eye_angle = cv2.fitEllipse(contours[i])[2] * np.pi / 180
+    return first_eye_coords, second_eye_coords, first_eye_angle, second_eye_angle
+
+def create_eye_frame(frame_size = (240, 320), dist_eyes = 12, eye_axes = (5, 3), n_noise_regions = 0, random_state = None):
+    # Create a background subtracted frame with two bright elliptical eyes at random orientations and small bright regions of noise. Returns the frame and the coordinates of the brightest pixel in each eye.
+    if random_state is None:
+        random_state = np.random.RandomState(0)
+    frame = np.zeros(frame_size, dtype = np.uint8)
+    for i in range(n_noise_regions):
+        cv2.circle(frame, (int(random_state.randint(0, frame_size[1])), int(random_state.randint(0, frame_size[0]))), int(random_state.randint(1, 3)), int(random_state.randint(120, 200)), -1)
+    centre = random_state.uniform([dist_eyes * 3, dist_eyes * 3], [frame_size[0] - dist_eyes * 3, frame_size[1] - dist_eyes * 3])
+    heading_angle = random_state.uniform(-np.pi, np.pi)
+    eye_coords = []
+    for side in [-1, 1]:
+        coords = centre + side * dist_eyes / 2 * np.array([np.cos(heading_angle), -np.sin(heading_angle)])
+        cv2.ellipse(frame, (int(round(coords[1])), int(round(coords[0]))), eye_axes, np.degrees(heading_angle) + random_state.uniform(-40, 40), 0, 360, 230, -1)
+        eye_coords.append([int(round(coords[0])), int(round(coords[1]))])
+    frame = cv2.GaussianBlur(frame, (3, 3), 0)
+    return frame, eye_coords
+
+def check_eye_angles_regression(n_cases = 500, eyes_threshold = 100, seed = 0, coords_tolerance = 0, angle_tolerance = 1e-6):
+    '''
+    Checks that the eye angles calculated from connected components match the contour based reference.
+
+    Optional Arguments:
+        n_cases (int) - Number of frames to compare. Default = 500.
+        eyes_threshold (int) - Threshold used to find the binary regions that contain the eyes. Default = 100.
+        seed (int) - Seed of the random number generator. Default = 0.
+        coords_tolerance (float) - Maximum allowed difference in eye coordinates in pixels. Default = 0.
+        angle_tolerance (float) - Maximum allowed difference in eye angles in radians. Default = 1e-6.
+
+    Returns:
+        errors (dict) - Maximum difference in eye coordinates in pixels, median and maximum difference in eye angles in radians, and the number of eyes found by only one method.
+            ** Raises an AssertionError if a difference is larger than its tolerance or an eye is found by only one method.
+    '''
+    random_state = np.random.RandomState(seed)
+    max_coords_error = 0
+    angle_errors = []
+    n_mismatches = 0
+    for i in range(n_cases):
+        frame, eye_coords = create_eye_frame(n_noise_regions = random_state.randint(0, 200), random_state = random_state)
+        reference_results = calculate_eye_angles_in_frame_reference(frame, eye_coords[0], eye_coords[1], eyes_threshold)
+        results = ut.calculate_eye_angles_in_frame(frame, eye_coords[0], eye_coords[1], eyes_threshold)
+        for j in range(2):
+            if np.isnan(reference_results[2 + j]) != np.isnan(results[2 + j]):
+                n_mismatches += 1
+                continue
+            max_coords_error = max(max_coords_error, np.max(np.abs(np.subtract(reference_results[j], results[j]))))
+            if not np.isnan(results[2 + j]):
+                # Eye angles are orientations between 0 and pi, so angles near 0 and pi are equal.
+                angle_error = np.abs(reference_results[2 + j] - results[2 + j]) % np.pi
+                angle_errors.append(min(angle_error, np.pi - angle_error))
+    errors = {'max_coords_error' : float(max_coords_error), 'median_angle_error' : float(np.median(angle_errors)) if len(angle_errors) > 0 else 0.0, 'max_angle_error' : float(np.max(angle_errors)) if len(angle_errors) > 0 else 0.0, 'n_mismatches' : n_mismatches}
+    print('Checked eye angles in {0} frames. Maximum coordinate difference: {1} pixels. Median angle difference: {2:.4f} radians. Maximum angle difference: {3:.4f} radians. Eyes found by only one method: {4}.'.format(n_cases, errors['max_coords_error'], errors['median_angle_error'], errors['max_angle_error'], errors['n_mismatches']))
+    if errors['max_coords_error'] > coords_tolerance or errors['max_angle_error'] > angle_tolerance or errors['n_mismatches'] > 0:
+        raise AssertionError('The eye coordinates and angles differ from the contour based reference by more than the tolerance.')
+    return errors
+
+def benchmark_calculate_eye_angles(n_noise_regions_list = [0, 100, 1000], frame_size = (960, 1280), n_repeats = 50, eyes_threshold = 100):
+    # Time the contour based reference and the connected components eye angle calculation as the number of bright regions of noise in the frame increases.
+    random_state = np.random.RandomState(0)
+    for n_noise_regions in n_noise_regions_list:
+        frame, eye_coords = create_eye_frame(frame_size = frame_size, n_noise_regions = n_noise_regions, random_state = random_state)
+        timings = []
+        for function in [calculate_eye_angles_in_frame_reference, ut.calculate_eye_angles_in_frame]:
+            t0 = time.time()
+            for i in range(n_repeats):
+                function(frame, eye_coords[0], eye_coords[1], eyes_threshold)
+            timings.append((time.time() - t0) / n_repeats * 1000)
+        print('Eye angles with {0} regions of noise in a {1} x {2} frame. Contours: {3:.3f} ms. Connected components: {4:.3f} ms.'.format(n_noise_regions, frame_size[1], frame_size[0], timings[0], timings[1]))
+
+def calculate_kinematics_reference(tail_coord_array, body_coord_array, heading_angle_array, eye_angle_array, smoothing_factor = 3, stuck_frame_window = 2, fill_stuck_frame_gaps = True, zero_stuck_tail_angles = True):
+    '''
+    Reference implementation of calculate_kinematics that uses the loops from DataPlot.calculate_variables and free_swimming_tail_tracking_PLOT.py.
+    Used to check that the results of calculate_kinematics have not changed.
+    '''
+    heading_angle_array = np.array(heading_angle_array, dtype = np.float64)
+    tail_angles = [[np.arctan2(tail_coord_array[j][i + 1][0] - tail_coord_array[j][i][0], tail_coord_array[j][i + 1][1] - tail_coord_array[j][i][1]) for i in range(len(tail_coord_array[0]) - 1)] for j in range(len(tail_coord_array))]
+    body_tail_angles = [np.arctan2(tail_coord_array[j][0][0] - body_coord_array[j][0], tail_coord_array[j][0][1] - body_coord_array[j][1]) for j in range(len(tail_coord_array))]
+    tail_angles = [[tail_angles[j][i] - body_tail_angles[j] for i in range(len(tail_angles[0]))] for j in range(len(tail_angles))]
+    tail_angles = [[tail_angles[i][j] for i in range(len(tail_angles))] for j in range(len(tail_angles[0]))]
+    for i in range(len(tail_angles)):
+        for j in range(1, len(tail_angles[i])):
+            if tail_angles[i][j] >= 0.9 * np.pi:
+                tail_angles[i][j] -= np.pi * 2
+            elif tail_angles[i][j] <= 0.9 * -np.pi:
+                tail_angles[i][j] += np.pi * 2
+    sum_tail_angles = [np.sum([abs(tail_angles[i][j]) for i in range(len(tail_angles))]) for j in range(len(tail_angles[0]))]
+    if stuck_frame_window == 3:
+        tail_angle_frames = np.where([sum_tail_angles[i] == sum_tail_angles[i + 1] == sum_tail_angles[i + 2] for i in range(len(sum_tail_angles) - 2)])[0]
+    else:
+        tail_angle_frames = np.where([sum_tail_angles[i] == sum_tail_angles[i + 1] for i in range(len(sum_tail_angles) - 1)])[0]
+    if fill_stuck_frame_gaps:
+        for i in range(1, len(tail_angle_frames)):
+            if tail_angle_frames[i] - tail_angle_frames[i - 1] == 2:
+                tail_angle_frames = np.append(tail_angle_frames, tail_angle_frames[i - 1] + 1)
+            elif tail_angle_frames[i] - tail_angle_frames[i - 1] == 3:
+                tail_angle_frames = np.append(tail_angle_frames, tail_angle_frames[i - 1] + 1)
+                tail_angle_frames = np.append(tail_angle_frames, tail_angle_frames[i - 1] + 2)
+    if zero_stuck_tail_angles:
+        for i in range(len(tail_angles)):
+            for j in tail_angle_frames:
+                tail_angles[i][j] = 0.0
+    smoothed_tail_angles = [np.convolve(tail_angles[i], np.ones(smoothing_factor)/smoothing_factor, mode = 'same') for i in range(len(tail_angles))]
+    j = 0
+    if np.isnan(heading_angle_array[0]):
+        while np.isnan(heading_angle_array[0]):
+            if not np.isnan(heading_angle_array[j]):
+                heading_angle_array[0] = heading_angle_array[j]
+            j += 1
+    heading_angles = np.array([heading_angle_array[i] - heading_angle_array[0] for i in range(len(heading_angle_array))])
+    i = 0
+    for j in range(len(heading_angles)):
+        if j not in tail_angle_frames:
+            i = j
+        else:
+            heading_angles[j] = heading_angles[i]
+    for i in range(1, len(heading_angles)):
+        if heading_angles[i] - heading_angles[i - 1] > np.pi:
+            heading_angles[i:] -= np.pi * 2
+        elif heading_angles[i] - heading_angles[i - 1] < -np.pi:
+            heading_angles[i:] += np.pi * 2
+    smoothed_heading_angles = np.convolve(heading_angles, np.ones(smoothing_factor)/smoothing_factor, mode = 'same')
+    eye_angles = [[eye_angle_array[i][j] - heading_angle_array[i] for i in range(len(eye_angle_array))] for j in range(len(eye_angle_array[0]))]
+    i = 0
+    for k in range(len(eye_angles)):
+        for j in range(len(eye_angles[k])):
+            if j not in tail_angle_frames:
+                i = j
+            else:
+                eye_angles[k][j] = eye_angles[k][i]
+    for j in range(len(eye_angles)):
+        for i in range(1, len(eye_angles[j])):
+            if eye_angles[j][i] - eye_angles[j][i - 1] > np.pi * 0.9:
+                eye_angles[j][i] -= np.pi * 2
+            elif eye_angles[j][i] - eye_angles[j][i - 1] < -np.pi * 0.9:
+                eye_angles[j][i] += np.pi * 2
+    for j in range(len(eye_angles)):
+        for i in range(1, len(eye_angles[j])):
+            if eye_angles[j][i] > np.pi:
+                eye_angles[j][i] -= np.pi * 2
+            elif eye_angles[j][i] < -np.pi:
+                eye_angles[j][i] += np.pi * 2
+    smoothed_eye_angles = [np.convolve(eye_angles[i], np.ones(smoothing_factor)/smoothing_factor, mode = 'same') for i in range(len(eye_angles))]
+    return {'tail_angles' : tail_angles, 'smoothed_tail_angles' : smoothed_tail_angles, 'sum_tail_angles' : sum_tail_angles, 'tail_angle_frames' : tail_angle_frames, 'heading_angles' : heading_angles, 'smoothed_heading_angles' : smoothed_heading_angles, 'eye_angles' : eye_angles, 'smoothed_eye_angles' : smoothed_eye_angles}
+
+def create_tracking_results(n_frames = 2000, n_tail_points = 7, stuck_probability = 0.2, nan_probability = 0.02, seed = 0):
+    '''
+    Creates random tracking results that contain stuck frames, where the tail points do not change, and frames that were not tracked.
+
+    Optional Arguments:
+        n_frames (int) - Number of frames. Default = 2000.
+        n_tail_points (int) - Number of tail points. Default = 7.
+        stuck_probability (float) - Probability that the tail points of a frame are the same as the previous frame. Default = 0.2.
+        nan_probability (float) - Probability that a frame was not tracked. Default = 0.02.
+        seed (int) - Seed of the random number generator. Default = 0.
+
+    Returns:
+        results (dict) - Dictionary that contains the tail coordinates, body coordinates, heading angles, and eye angles.
+    '''
+    random_state = np.random.RandomState(seed)
+    tail_coord_array = np.round(np.cumsum(random_state.normal(0, 3, (n_frames, n_tail_points + 1, 2)), axis = 1) + 100)
+    body_coord_array = np.round(random_state.uniform(80, 120, (n_frames, 2)))
+    # Heading angles drift and wrap around so that the heading angles need to be unwrapped.
+    heading_angle_array = np.angle(np.exp(1j * np.cumsum(random_state.normal(0, 0.5, n_frames))))
+    eye_angle_array = random_state.uniform(-np.pi, np.pi, (n_frames, 2))
+    stuck_frames = np.flatnonzero(random_state.uniform(size = n_frames) < stuck_probability)
+    for i in stuck_frames[stuck_frames > 0]:
+        tail_coord_array[i] = tail_coord_array[i - 1]
+        body_coord_array[i] = body_coord_array[i - 1]
+    nan_frames = random_state.uniform(size = n_frames) < nan_probability
+    tail_coord_array[nan_frames] = np.nan
+    body_coord_array[nan_frames] = np.nan
+    heading_angle_array[nan_frames] = np.nan
+    eye_angle_array[nan_frames] = np.nan
+    return {'tail_coord_array' : tail_coord_array, 'body_coord_array' : body_coord_array, 'heading_angle_array' : heading_angle_array, 'eye_angle_array' : eye_angle_array}
+
+def check_kinematics_regression(results = None, kinematics_params = [{}, {'smoothing_factor' : 5, 'stuck_frame_window' : 3, 'fill_stuck_frame_gaps' : False, 'zero_stuck_tail_angles' : False}]):
+    '''
+    Checks that calculate_kinematics returns the same results as the reference implementation.
+
+    Optional Arguments:
+        results (dict) - Dictionary that contains the tail coordinates, body coordinates, heading angles, and eye angles. Default = None.
+            ** When results is None, random tracking results are created with create_tracking_results.
+        kinematics_params (list) - List of dictionaries of keyword arguments to calculate_kinematics. Default = the parameters used by the GUI and by free_swimming_tail_tracking_PLOT.py.
+
+    Returns:
+        max_differences (list) - List of dictionaries that contain the largest absolute difference of each result.
+            ** Stuck frames are compared as sets and the difference is the number of frames that are not in both sets.
+    '''
+    if results is None:
+        results = create_tracking_results()
+    max_differences = []
+    for params in kinematics_params:
+        reference_kinematics = calculate_kinematics_reference(results['tail_coord_array'], results['body_coord_array'], results['heading_angle_array'], results['eye_angle_array'], **params)
+        kinematics = kin.calculate_kinematics(results['tail_coord_array'], results['body_coord_array'], results['heading_angle_array'], results['eye_angle_array'], **params)
+        differences = {}
+        for key in reference_kinematics:
+            if key == 'tail_angle_frames':
+                differences[key] = len(set(reference_kinematics[key].tolist()) ^ set(kinematics[key].tolist()))
+            else:
+                x = np.asarray(reference_kinematics[key], dtype = np.float64)
+                y = np.asarray(kinematics[key], dtype = np.float64)
+                if x.shape != y.shape or not np.array_equal(np.isnan(x), np.isnan(y)):
+                    differences[key] = np.inf
+                else:
+                    differences[key] = float(np.max(np.abs(x - y)[~np.isnan(x)], initial = 0))
+        print('Checked calculate_kinematics with parameters {0}. Largest differences: {1}.'.format(params, differences))
+        max_differences.append(differences)
+    return max_differences
+
+def benchmark_kinematics(n_frames = 1000000, n_tail_points = 7):
+    # Measure the time taken to calculate the kinematics of a long session.
+    results = create_tracking_results(n_frames = n_frames, n_tail_points = n_tail_points)
+    t0 = time.time()
+    kin.calculate_kinematics(results['tail_coord_array'], results['body_coord_array'], results['heading_angle_array'], results['eye_angle_array'])
+    processing_time = time.time() - t0
+    print('Calculated kinematics of {0} frames in {1:.3f} seconds.'.format(n_frames, processing_time))
+    return processing_time
+
+def get_synthetic_fish_poses(n_frames, frame_size, n_tail_points = 7, dist_tail_points = 5, dist_eyes = 6, dist_swim_bladder = 8, tail_beat_amplitude = 0.5, tail_beat_period = 20, seed = 0):
+    '''
+    Calculates the ground truth pose of a synthetic fish that swims around the frame while beating its tail.
+
+    Steps:
+        The heading coordinates move along an ellipse centered in the frame and the heading angle follows the direction of the ellipse.
+        The eyes lie on either side of the heading coordinates and the swim bladder lies behind the heading coordinates.
+        Each tail point lies behind the previous point. The angle of each tail segment follows a travelling wave whose amplitude increases along the tail.
+
+    Required Arguments:
+        n_frames (int) - Number of frames.
+        frame_size (frame height, frame width) - Size of the frames.
+
+    Optional Arguments:
+        n_tail_points (int) - Number of tail points. Default = 7.
+        dist_tail_points (float) - Distance between tail points. Default = 5.
+        dist_eyes (float) - Distance between the eyes. Default = 6.
+        dist_swim_bladder (float) - Distance between the heading coordinates and the swim bladder. Default = 8.
+        tail_beat_amplitude (float) - Maximum angle of the last tail segment relative to the body, in radians. Default = 0.5.
+        tail_beat_period (float) - Number of frames in each tail beat. Default = 20.
+        seed (int) - Seed of the random number generator used to offset the phase of the tail beats. Default = 0.
+
+    Returns:
+        ground_truth (dict) - Dictionary that contains the eye coordinates (n_frames, 2, 2), heading coordinates (n_frames, 2), heading angles (n_frames) and tail coordinates (n_frames, n_tail_points + 1, 2) of the fish.
+            ** Coordinates are given as [y, x] and the tail coordinates start with the swim bladder, like the tracking results.
+    '''
+    random_state = np.random.RandomState(seed)
+    frame_height, frame_width = frame_size
+    time_points = np.arange(n_frames)
+    # Move the heading coordinates along an ellipse that stays away from the edges of the frame.
+    fish_length = dist_swim_bladder + n_tail_points * dist_tail_points
+    radius_y, radius_x = max(frame_height / 2 - fish_length - 4, 1), max(frame_width / 2 - fish_length - 4, 1)
+    path_angles = 2 * np.pi * time_points / max(n_frames, 1)
+    heading_coords = np.stack([frame_height / 2 + radius_y * np.sin(path_angles), frame_width / 2 + radius_x * np.cos(path_angles)], axis = 1)
+    # Point the heading angle along the direction of movement.
+    heading_angles = np.arctan2(radius_y * np.cos(path_angles), -radius_x * np.sin(path_angles))
+    heading_vectors = np.stack([np.sin(heading_angles), np.cos(heading_angles)], axis = 1)
+    perpendicular_vectors = np.stack([np.cos(heading_angles), -np.sin(heading_angles)], axis = 1)
+    eye_coords = np.stack([heading_coords + perpendicular_vectors * dist_eyes / 2, heading_coords - perpendicular_vectors * dist_eyes / 2], axis = 1)
+    tail_coords = np.zeros((n_frames, n_tail_points + 1, 2))
+    tail_coords[:, 0] = heading_coords - heading_vectors * dist_swim_bladder
+    # Bend the tail with a travelling wave.
+    phase = random_state.uniform(0, 2 * np.pi)
+    for m in range(1, n_tail_points + 1):
+        segment_angles = heading_angles + np.pi + tail_beat_amplitude * m / n_tail_points * np.sin(2 * np.pi * time_points / tail_beat_period - m * 0.5 + phase)
+        tail_coords[:, m] = tail_coords[:, m - 1] + np.stack([np.sin(segment_angles), np.cos(segment_angles)], axis = 1) * dist_tail_points
+    return {'eye_coord_array' : eye_coords, 'heading_coord_array' : heading_coords, 'heading_angle_array' : heading_angles, 'tail_coord_array' : tail_coords}
+
+def draw_synthetic_fish(frame, eye_coords, tail_coords, eye_radius = 2, shift = 4):
+    # Draw a dark fish onto a bright frame. The eyes are the darkest, followed by the swim bladder, and the tail gets lighter towards the tip. The centre line of the tail is darker than its edges so that the tail points are found on the centre line.
+    scale = 2 ** shift
+    to_point = lambda coords: (int(round(coords[1] * scale)), int(round(coords[0] * scale)))
+    n_tail_points = len(tail_coords) - 1
+    for m in range(n_tail_points, 0, -1):
+        tail_value = int(90 + 60 * m / n_tail_points)
+        cv2.line(frame, to_point(tail_coords[m - 1]), to_point(tail_coords[m]), tail_value + 15, 3, cv2.LINE_8, shift)
+        cv2.line(frame, to_point(tail_coords[m - 1]), to_point(tail_coords[m]), tail_value, 1, cv2.LINE_8, shift)
+    cv2.circle(frame, to_point(tail_coords[0]), (eye_radius + 1) * scale, 60, -1, cv2.LINE_8, shift)
+    for coords in eye_coords:
+        cv2.circle(frame, to_point(coords), eye_radius * scale, 20, -1, cv2.LINE_8, shift)
+    return frame
+
+def create_synthetic_video(video_path, frame_size = (480, 640), n_frames = 200, codec = 'MJPG', video_fps = 100, noise_level = 2, seed = 0, **fish_params):
+    '''
+    Writes a synthetic video of a single fish and returns the ground truth pose of the fish.
+
+    Steps:
+        A bright background with a smooth gradient is created.
+        The pose of the fish in each frame is calculated with get_synthetic_fish_poses.
+        The fish is drawn onto the background, noise is added, and the frame is written to the video.
+
+    Required Arguments:
+        video_path (str) - Path to the video.
+
+    Optional Arguments:
+        frame_size (frame height, frame width) - Size of the frames. Default = (480, 640).
+        n_frames (int) - Number of frames. Default = 200.
+        codec (str) - Four character code of the codec used to write the video. Default = MJPG.
+            ** Use FFV1 for a lossless video.
+        video_fps (float) - FPS of the video. Default = 100.
+        noise_level (float) - Standard deviation of the noise added to each frame. Default = 2.
+        seed (int) - Seed of the random number generator. Default = 0.
+        fish_params - Keyword arguments passed to get_synthetic_fish_poses.
+
+    Returns:
+        ground_truth (dict) - Ground truth pose of the fish. See get_synthetic_fish_poses.
+            ** Returns None if the video could not be written.
+    '''
+    random_state = np.random.RandomState(seed)
+    frame_height, frame_width = frame_size
+    ground_truth = get_synthetic_fish_poses(n_frames, frame_size, seed = seed, **fish_params)
+    # Create a bright background with a smooth gradient.
+    background = (180 + 20 * np.sin(np.linspace(0, np.pi, frame_width))[np.newaxis] * np.cos(np.linspace(0, np.pi / 2, frame_height))[:, np.newaxis]).astype(np.float32)
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*codec), video_fps, (frame_width, frame_height))
+    if not writer.isOpened():
+        print('Error: the video could not be written with the codec {0}.'.format(codec))
+        return None
+    for i in range(n_frames):
+        frame = np.clip(background + random_state.normal(0, noise_level, frame_size), 0, 255).astype(np.uint8)
+        frame = draw_synthetic_fish(frame, ground_truth['eye_coord_array'][i], ground_truth['tail_coord_array'][i])
+        writer.write(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+    writer.release()
+    return ground_truth
+
+def calculate_tracking_error(results, ground_truth):
+    '''
+    Compares tracking results to the ground truth pose of a synthetic fish.
+
+    Required Arguments:
+        results (dict) - Tracking results that contain the eye coordinates, tail coordinates, and heading angles.
+        ground_truth (dict) - Ground truth pose of the fish. See get_synthetic_fish_poses.
+
+    Returns:
+        tracking_error (dict) - Dictionary that contains the fraction of frames tracked and the mean and 90th percentile error of the tracked frames.
+            ** Eye and tail errors are distances in pixels. The eyes are matched to the ground truth in whichever order is closer. Heading angle errors are in radians.
+    '''
+    n_frames = len(ground_truth['tail_coord_array'])
+    tail_coord_array = np.asarray(results['tail_coord_array'], dtype = np.float64)[:n_frames]
+    eye_coord_array = np.asarray(results['eye_coord_array'], dtype = np.float64)[:n_frames]
+    heading_angle_array = np.asarray(results['heading_angle_array'], dtype = np.float64)[:n_frames]
+    tracked_frames = ~np.isnan(tail_coord_array).reshape(len(tail_coord_array), -1).any(axis = 1)
+    tracking_error = {'tracked_fraction' : float(np.mean(tracked_frames)) if n_frames > 0 else 0.0}
+    if not np.any(tracked_frames):
+        return tracking_error
+    eye_error = np.hypot(*np.moveaxis(eye_coord_array[tracked_frames] - ground_truth['eye_coord_array'][tracked_frames], -1, 0)).mean(axis = 1)
+    swapped_eye_error = np.hypot(*np.moveaxis(eye_coord_array[tracked_frames][:, ::-1] - ground_truth['eye_coord_array'][tracked_frames], -1, 0)).mean(axis = 1)
+    tail_error = np.hypot(*np.moveaxis(tail_coord_array[tracked_frames] - ground_truth['tail_coord_array'][tracked_frames], -1, 0))
+    heading_angle_error = np.abs(np.angle(np.exp(1j * (heading_angle_array[tracked_frames] - ground_truth['heading_angle_array'][tracked_frames]))))
+    for name, error in [('eye_error', np.minimum(eye_error, swapped_eye_error)), ('swim_bladder_error', tail_error[:, 0]), ('tail_error', tail_error.mean(axis = 1)), ('tail_tip_error', tail_error[:, -1]), ('heading_angle_error', heading_angle_error)]:
+        tracking_error[name] = {'mean' : float(np.mean(error)), 'p90' : float(np.percentile(error, 90))}
+    return tracking_error
+
+def check_tracking_paths_consistency(frame_size = (240, 320), n_frames = 150, eyes_thresholds = [130, 150], n_tail_points = 7, dist_tail_points = 5, dist_eyes = 6, dist_swim_bladder = 8, pixel_threshold = 100, frame_batch_size = 16, n_processes = 2, n_shards = 4, video_folder = None):
+    '''
+    Checks that every way of tracking a video returns exactly the same results when the extended eyes calculation is used.
+
+    Steps:
+        A synthetic video is written with create_synthetic_video.
+        The video is tracked with track_video, track_tail_in_video_without_multiprocessing, track_tail_in_video_with_multiprocessing (with and without a checkpoint), and track_tail_in_video_with_sharding, for each eyes threshold.
+        Small batches and several shards are used so that the order of the eyes has to be kept the same across batch, chunk, and shard boundaries.
+        The results of each path are compared to the results of track_video.
+
+    Optional Arguments:
+        frame_size (frame height, frame width) - Size of the frames. Default = (240, 320).
+        n_frames (int) - Number of frames. Default = 150.
+        eyes_thresholds (list) - List of eyes thresholds. Default = [130, 150].
+        pixel_threshold (int) - Pixel threshold used for tracking. Default = 100.
+        frame_batch_size (int) - Number of frames in each batch. Default = 16.
+        n_processes (int) - Number of worker processes. Default = 2.
+        n_shards (int) - Number of shards. Default = 4.
+        video_folder (str) - Folder where the synthetic video and tracking results are written. Default = None.
+            ** When video_folder is None, a temporary folder is used and removed at the end.
+
+    Returns:
+        n_mismatches (int) - Number of frames, summed over every path and eyes threshold, where the results are different from the results of track_video.
+            ** The motion gate of track_video is disabled, since the other paths track every frame.
+    '''
+    tracking_params = [n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder]
+    colours = [(0, 0, 255)] * (n_tail_points + 4)
+    temporary_folder = None
+    if video_folder is None:
+        temporary_folder = tempfile.mkdtemp()
+        video_folder = temporary_folder
+    n_mismatches = 0
+    try:
+        video_path = os.path.join(video_folder, 'synthetic_eyes.avi')
+        if create_synthetic_video(video_path, frame_size = frame_size, n_frames = n_frames, codec = 'FFV1', n_tail_points = n_tail_points, dist_tail_points = dist_tail_points, dist_eyes = dist_eyes, dist_swim_bladder = dist_swim_bladder) is None:
+            return None
+        background_path = os.path.join(video_folder, 'synthetic_eyes_background.tif')
+        cv2.imwrite(background_path, ut.calculate_background(video_path, use_cache = False)[0])
+        for eyes_threshold in eyes_thresholds:
+            tracking_kwargs = {'background_path' : background_path, 'pixel_threshold' : pixel_threshold, 'extended_eyes_calculation' : True, 'eyes_threshold' : eyes_threshold}
+            ut.track_video(video_path, colours, *tracking_params, save_video = False, save_path = video_folder, frame_change_threshold = -1, **tracking_kwargs)
+            reference_results = ut.load_tracking_results(os.path.join(video_folder, 'synthetic_eyes_results'), mmap_mode = None)
+            paths = [   ('track_tail_in_video_without_multiprocessing', lambda: ut.track_tail_in_video_without_multiprocessing(video_path, colours, *tracking_params, init_frame_batch_size = frame_batch_size, **tracking_kwargs)),
+                        ('track_tail_in_video_with_multiprocessing', lambda: ut.track_tail_in_video_with_multiprocessing(video_path, colours, *tracking_params, init_frame_batch_size = frame_batch_size, n_processes = n_processes, **tracking_kwargs)),
+                        ('track_tail_in_video_with_multiprocessing (checkpoint)', lambda: ut.track_tail_in_video_with_multiprocessing(video_path, colours, *tracking_params, init_frame_batch_size = frame_batch_size, n_processes = n_processes, save_path = video_folder, checkpoint_frames = frame_batch_size * 2, **tracking_kwargs)),
+                        ('track_tail_in_video_with_sharding', lambda: ut.track_tail_in_video_with_sharding(video_path, colours, *tracking_params, init_frame_batch_size = frame_batch_size, n_processes = n_processes, n_shards = n_shards, save_path = video_folder, **tracking_kwargs))
+                        ]
+            for name, track in paths:
+                results = track()
+                # The saved results of track_video are float32, so the results of each path are compared at the same precision.
+                mismatched_frames = np.zeros(n_frames, dtype = bool)
+                for array_name in ut.tracking_results_array_names:
+                    reference_array = reference_results[array_name].reshape(n_frames, -1)
+                    array = np.asarray(results[array_name], dtype = np.float32).reshape(n_frames, -1)
+                    mismatched_frames |= ~np.all((reference_array == array) | (np.isnan(reference_array) & np.isnan(array)), axis = 1)
+                print('Eyes threshold: {0}. {1}: {2} / {3} frames differ from track_video.'.format(eyes_threshold, name, np.count_nonzero(mismatched_frames), n_frames))
+                n_mismatches += int(np.count_nonzero(mismatched_frames))
+    finally:
+        if temporary_folder is not None:
+            shutil.rmtree(temporary_folder, ignore_errors = True)
+    return n_mismatches
+
+def get_peak_rss():
+    # Return the peak resident set size in megabytes of this process and of its finished child processes. Returns None when the resource module is not available.
+    if resource is None:
+        return None
+    # The peak resident set size is reported in kilobytes on Linux and in bytes on macOS.
+    units = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return {'self' : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / units, 'children' : resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / units}
+
+def summarize_latencies(latencies, n_frames = None):
+    # Summarize a list of latencies in seconds into the mean and percentiles in milliseconds. The number of frames processed in each repeat is used to calculate the frames per second.
+    latencies = np.asarray(latencies, dtype = np.float64)
+    summary = {'n_repeats' : len(latencies), 'mean_ms' : float(np.mean(latencies) * 1000)}
+    for percentile in [50, 90, 99]:
+        summary['p{0}_ms'.format(percentile)] = float(np.percentile(latencies, percentile) * 1000)
+    if n_frames is not None:
+        summary['frames_per_second'] = float(n_frames / np.median(latencies)) if np.median(latencies) > 0 else None
+    summary['peak_rss_mb'] = get_peak_rss()
+    return summary
+
+def time_stage(function, n_repeats = 1):
+    # Call a function several times and return the time taken by each call in seconds and the value returned by the last call.
+    latencies = []
+    value = None
+    for i in range(n_repeats):
+        t0 = time.perf_counter()
+        value = function()
+        latencies.append(time.perf_counter() - t0)
+    return latencies, value
+
+def calculate_variables(results, video_fps):
+    # Calculate the plotted variables with DataPlot.calculate_variables when the GUI can be imported, otherwise with the kinematics function that it calls.
+    try:
+        import free_swimming_tail_tracking_GUI as gui
+    except ImportError:
+        gui = None
+    data_plot = types.SimpleNamespace(tail_coord_array = results['tail_coord_array'], body_coord_array = results['body_coord_array'], heading_angle_array = results['heading_angle_array'], eye_angle_array = results['eye_angle_array'], video_n_frames = len(results['tail_coord_array']), video_fps = video_fps)
+    if gui is not None:
+        gui.DataPlot.calculate_variables(data_plot)
+    else:
+        kin.calculate_kinematics(data_plot.tail_coord_array, data_plot.body_coord_array, data_plot.heading_angle_array, data_plot.eye_angle_array, smoothing_factor = 3)
+    return data_plot
+
+def benchmark_tracking_pipeline(results_path = 'benchmark_results.json', frame_sizes = [(240, 320), (480, 640), (960, 1280)], n_frames_list = [200], codecs = ['MJPG', 'FFV1'], n_repeats = 3, n_tail_points = 7, dist_tail_points = 5, dist_eyes = 6, dist_swim_bladder = 8, pixel_threshold = 100, stages = None, video_folder = None):
+    '''
+    Benchmarks each stage of the tracking pipeline on synthetic videos and saves the results to a JSON file.
+
+    Steps:
+        A synthetic video is written for each combination of frame size, number of frames, and codec.
+        Each stage is timed with n_repeats repeats: calculate_background (without the background cache), track_tail_in_frame (timed for every frame), track_video, track_tail_in_video_with_multiprocessing, track_tail_in_video_without_multiprocessing, and DataPlot.calculate_variables.
+        The tracking results of each tracking stage are compared to the ground truth.
+        The frames per second, latency percentiles, peak resident set size, and tracking error of each stage are saved.
+
+    Optional Arguments:
+        results_path (str) - Path to the JSON file that the results are saved to. Default = benchmark_results.json.
+            ** When results_path is None, the results are not saved.
+        frame_sizes (list) - List of frame sizes given as (frame height, frame width). Default = [(240, 320), (480, 640), (960, 1280)].
+        n_frames_list (list) - List of numbers of frames. Default = [200].
+        codecs (list) - List of four character codes of the codecs used to write the videos. Default = [MJPG, FFV1].
+        n_repeats (int) - Number of times each stage is repeated. Default = 3.
+        pixel_threshold (int) - Pixel threshold used for tracking. Default = 100.
+        stages (list) - Names of the stages to run. Default = None.
+            ** When stages is None, every stage is run.
+        video_folder (str) - Folder where the synthetic videos and tracking results are written. Default = None.
+            ** When video_folder is None, a temporary folder is used and removed at the end.
+
+    Returns:
+        benchmark_results (dict) - Dictionary that contains information about the system and a list of results for each video.
+            ** Use compare_benchmark_results to compare two JSON files.
+            ** The peak resident set size only increases during a run, so it reports the largest memory used up to and including each stage.
+    '''
+    all_stages = ['calculate_background', 'track_tail_in_frame', 'track_video', 'track_tail_in_video_with_multiprocessing', 'track_tail_in_video_without_multiprocessing', 'calculate_variables']
+    if stages is None:
+        stages = all_stages
+    tracking_params = [n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder]
+    colours = [(0, 0, 255)] * (n_tail_points + 3)
+    benchmark_results = {'created' : time.strftime('%Y-%m-%d %H:%M:%S'), 'platform' : platform.platform(), 'python_version' : platform.python_version(), 'numpy_version' : np.__version__, 'opencv_version' : cv2.__version__, 'cpu_count' : os.cpu_count(), 'videos' : []}
+    temporary_folder = None
+    if video_folder is None:
+        temporary_folder = tempfile.mkdtemp()
+        video_folder = temporary_folder
+    try:
+        for frame_size in frame_sizes:
+            for n_frames in n_frames_list:
+                for codec in codecs:
+                    video_path = os.path.join(video_folder, 'synthetic_{0}x{1}_{2}_{3}.avi'.format(frame_size[1], frame_size[0], n_frames, codec))
+                    ground_truth = create_synthetic_video(video_path, frame_size = frame_size, n_frames = n_frames, codec = codec, n_tail_points = n_tail_points, dist_tail_points = dist_tail_points, dist_eyes = dist_eyes, dist_swim_bladder = dist_swim_bladder)
+                    if ground_truth is None:
+                        continue
+                    print('Benchmarking {0}.'.format(os.path.basename(video_path)))
+                    video_results = {'frame_size' : list(frame_size), 'n_frames' : n_frames, 'codec' : codec, 'video_size_mb' : os.path.getsize(video_path) / (1024 * 1024), 'stages' : {}}
+                    background_path = os.path.join(video_folder, '{0}_background.tif'.format(os.path.splitext(os.path.basename(video_path))[0]))
+                    background = ut.calculate_background(video_path, use_cache = False)[0]
+                    cv2.imwrite(background_path, background)
+                    tracked_results = None
+                    for stage in stages:
+                        if stage == 'calculate_background':
+                            latencies, value = time_stage(lambda: ut.calculate_background(video_path, use_cache = False), n_repeats)
+                            video_results['stages'][stage] = summarize_latencies(latencies, n_frames)
+                        elif stage == 'track_tail_in_frame':
+                            # Time every frame separately so that the percentiles describe the latency of a single frame.
+                            latencies = []
+                            frame_results = ut.create_tracking_records(n_frames, n_tail_points)
+                            with ut.FrameReader(video_path, background = background) as frame_reader:
+                                for i, (success, frame) in enumerate(frame_reader):
+                                    t0 = time.perf_counter()
+                                    tracking_results = ut.track_tail_in_frame([frame, success] + tracking_params + [pixel_threshold, False, None])
+                                    latencies.append(time.perf_counter() - t0)
+                                    if tracking_results is not None:
+                                        frame_results[i]['first_eye_coords'], frame_results[i]['second_eye_coords'], frame_results[i]['heading_angle'], frame_results[i]['tail_point_coords'] = tracking_results[0], tracking_results[1], tracking_results[6], tracking_results[7]
+                            video_results['stages'][stage] = summarize_latencies(latencies, 1)
+                            video_results['stages'][stage]['tracking_error'] = calculate_tracking_error(ut.convert_tracking_records_to_results(frame_results), ground_truth)
+                        elif stage == 'track_video':
+                            results_folder = os.path.join(video_folder, '{0}_results'.format(os.path.splitext(os.path.basename(video_path))[0]))
+                            latencies, value = time_stage(lambda: ut.track_video(video_path, colours, *tracking_params, save_video = False, save_path = video_folder, background_path = background_path, pixel_threshold = pixel_threshold), n_repeats)
+                            video_results['stages'][stage] = summarize_latencies(latencies, n_frames)
+                            video_results['stages'][stage]['tracking_error'] = calculate_tracking_error(ut.load_tracking_results(results_folder, mmap_mode = None), ground_truth)
+                        elif stage in ['track_tail_in_video_with_multiprocessing', 'track_tail_in_video_without_multiprocessing']:
+                            latencies, tracked_results = time_stage(lambda: getattr(ut, stage)(video_path, colours, *tracking_params, background_path = background_path, pixel_threshold = pixel_threshold), n_repeats)
+                            video_results['stages'][stage] = summarize_latencies(latencies, n_frames)
+                            video_results['stages'][stage]['tracking_error'] = calculate_tracking_error(tracked_results, ground_truth)
+                        elif stage == 'calculate_variables':
+                            if tracked_results is None:
+                                tracked_results = ut.track_tail_in_video_without_multiprocessing(video_path, colours, *tracking_params, background_path = background_path, pixel_threshold = pixel_threshold)
+                            latencies, value = time_stage(lambda: calculate_variables(tracked_results, 100), n_repeats)
+                            video_results['stages'][stage] = summarize_latencies(latencies, n_frames)
+                        else:
+                            print('Error: {0} is not a stage of the tracking pipeline. Stages: {1}.'.format(stage, ', '.join(all_stages)))
+                    benchmark_results['videos'].append(video_results)
+    finally:
+        if temporary_folder is not None:
+            shutil.rmtree(temporary_folder, ignore_errors = True)
+    for video_results in benchmark_results['videos']:
+        print('Video: {0} x {1}, {2} frames, {3}.'.format(video_results['frame_size'][1], video_results['frame_size'][0], video_results['n_frames'], video_results['codec']))
+        for stage, stage_results in video_results['stages'].items():
+            error = stage_results.get('tracking_error', {}).get('tail_error', {}).get('mean')
+            print('    {0}: {1:.3f} ms median. {2} frames per second.{3}'.format(stage, stage_results['p50_ms'], None if stage_results.get('frames_per_second') is None else round(stage_results['frames_per_second'], 1), '' if error is None else ' Mean tail error: {0:.2f} pixels.'.format(error)))
+    if results_path is not None:
+        with open(results_path, 'w') as f:
+            json.dump(benchmark_results, f, indent = 4)
+        print('Benchmark results saved to {0}.'.format(results_path))
+    return benchmark_results
+
+def measure_import_time(module_name):
+    # Import a module in a new interpreter with -X importtime and return the cumulative import time in milliseconds and the names of every module that was imported.
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {0}'.format(module_name)], cwd = os.path.dirname(os.path.abspath(__file__)), stdout = subprocess.PIPE, stderr = subprocess.PIPE, universal_newlines = True)
+    if output.returncode != 0:
+        print('Error: {0} could not be imported.'.format(module_name))
+        print(output.stderr.strip().splitlines()[-1] if output.stderr.strip() else '')
+        return None, []
+    import_time = None
+    imported_modules = []
+    # Each line has the format: import time: self [us] | cumulative [us] | module name, where the module name is indented by the depth of the import.
+    for line in output.stderr.splitlines():
+        if not line.startswith('import time:') or line.count('|') != 2:
+            continue
+        self_time, cumulative_time, name = line[len('import time:'):].split('|')
+        if not cumulative_time.strip().isdigit():
+            continue
+        imported_modules.append(name.strip())
+        if name.strip() == module_name:
+            import_time = int(cumulative_time) / 1000
+    return import_time, imported_modules
+
+def check_import_budget(budgets = None, n_repeats = 3):
+    '''
+    Checks that the tracking library and command line interface do not import the GUI dependencies and are imported within their time budgets.
+
+    Optional Arguments:
+        budgets (dict) - Dictionary of module names and the maximum import time in milliseconds. Default = None.
+            ** When budgets is None, budgets = import_time_budgets.
+        n_repeats (int) - Number of times each module is imported. The fastest import is compared to the budget. Default = 3.
+
+    Returns:
+        violations (list) - List of messages that describe each module that imports a heavy module or exceeds its budget.
+    '''
+    if budgets is None:
+        budgets = import_time_budgets
+    violations = []
+    for module_name, budget in budgets.items():
+        import_times = []
+        imported_heavy_modules = set()
+        for i in range(n_repeats):
+            import_time, imported_modules = measure_import_time(module_name)
+            if import_time is None:
+                break
+            import_times.append(import_time)
+            imported_heavy_modules.update([name for name in imported_modules if name.split('.')[0] in heavy_modules])
+        if len(import_times) == 0:
+            violations.append('{0} could not be imported.'.format(module_name))
+            continue
+        if len(imported_heavy_modules) > 0:
+            violations.append('{0} imports {1}.'.format(module_name, ', '.join(sorted(imported_heavy_modules))))
+        if min(import_times) > budget:
+            violations.append('{0} took {1:.1f} ms to import. Budget: {2} ms.'.format(module_name, min(import_times), budget))
+        print('Imported {0} in {1:.1f} ms. Budget: {2} ms.'.format(module_name, min(import_times), budget))
+    for violation in violations:
+        print('Error: {0}'.format(violation))
+    print('Checked import budgets of {0} modules. Violations: {1}.'.format(len(budgets), len(violations)))
+    return violations
+
+def get_imported_heavy_modules(task = None):
+    # Return the heavy modules that have been imported by this process. Used as a task to check the modules imported by worker processes.
+    return sorted([name for name in sys.modules if name.split('.')[0] in heavy_modules])
+
+def benchmark_worker_startup(n_processes = 2, start_method = 'spawn', n_repeats = 3):
+    '''
+    Measures the time taken to start a pool of worker processes and to run the first task, which imports the tracking library in each worker.
+
+    Optional Arguments:
+        n_processes (int) - Number of worker processes. Default = 2.
+        start_method (str) - Method used to start the worker processes. Default = 'spawn'.
+            ** spawn is the default on Windows and macOS and imports the main module and the tracking library again in every worker.
+        n_repeats (int) - Number of pools that are started. Default = 3.
+
+    Returns:
+        summary (dict) - Dictionary that contains the latencies of starting a pool and the heavy modules imported by the workers.
+    '''
+    context = mp.get_context(start_method)
+    latencies = []
+    imported_heavy_modules = set()
+    for i in range(n_repeats):
+        t0 = time.perf_counter()
+        pool = context.Pool(n_processes)
+        try:
+            # Wait until the workers have run one task each, so that the workers have imported the main module and the tracking library.
+            for worker_heavy_modules in pool.map(get_imported_heavy_modules, range(n_processes), chunksize = 1):
+                imported_heavy_modules.update(worker_heavy_modules)
+            latencies.append(time.perf_counter() - t0)
+        finally:
+            pool.close()
+            pool.join()
+    summary = summarize_latencies(latencies)
+    summary['start_method'] = start_method
+    summary['n_processes'] = n_processes
+    summary['imported_heavy_modules'] = sorted(imported_heavy_modules)
+    print('Started {0} {1} workers in {2:.1f} ms.'.format(n_processes, start_method, summary['p50_ms']))
+    if len(imported_heavy_modules) > 0:
+        print('Error: the workers imported {0}.'.format(', '.join(sorted(imported_heavy_modules))))
+    return summary
+
+def compare_benchmark_results(previous_results_path, results_path, tolerance = 0.1):
+    '''
+    Compares two JSON files of benchmark results and reports the stages that became slower or less accurate.
+
+    Required Arguments:
+        previous_results_path (str) - Path to the JSON file of the previous benchmark results.
+        results_path (str) - Path to the JSON file of the new benchmark results.
+
+    Optional Arguments:
+        tolerance (float) - Relative increase in the median latency or mean tail error that counts as a regression. Default = 0.1.
+
+    Returns:
+        regressions (list) - List of dictionaries that describe each regression.
+    '''
+    with open(previous_results_path, 'r') as f:
+        previous_results = json.load(f)
+    with open(results_path, 'r') as f:
+        results = json.load(f)
+    get_video_key = lambda video_results: (tuple(video_results['frame_size']), video_results['n_frames'], video_results['codec'])
+    previous_videos = {get_video_key(video_results) : video_results for video_results in previous_results['videos']}
+    regressions = []
+    for video_results in results['videos']:
+        previous_video_results = previous_videos.get(get_video_key(video_results))
+        if previous_video_results is None:
+            continue
+        for stage, stage_results in video_results['stages'].items():
+            previous_stage_results = previous_video_results['stages'].get(stage)
+            if previous_stage_results is None:
+                continue
+            comparisons = [('p50_ms', previous_stage_results['p50_ms'], stage_results['p50_ms'])]
+            if 'tracking_error' in stage_results and 'tail_error' in stage_results['tracking_error'] and 'tail_error' in previous_stage_results.get('tracking_error', {}):
+                comparisons.append(('tail_error', previous_stage_results['tracking_error']['tail_error']['mean'], stage_results['tracking_error']['tail_error']['mean']))
+            for name, previous_value, value in comparisons:
+                if value > previous_value * (1 + tolerance) and value - previous_value > 1e-9:
+                    regressions.append({'video' : get_video_key(video_results), 'stage' : stage, 'measure' : name, 'previous' : previous_value, 'current' : value})
+                    print('Regression: {0} {1} {2} changed from {3:.3f} to {4:.3f}.'.format(get_video_key(video_results), stage, name, previous_value, value))
+    print('Compared benchmark results. Regressions: {0}.'.format(len(regressions)))
+    return regressions
+
+if __name__ == '__main__':
+    # Check that the tracking library does not import the GUI dependencies and stays within its import time budget before running the benchmarks. Exit with a non-zero status as soon as the check fails.
+    # Use python free_swimming_tail_tracking_BENCH.py imports to only run the import budget check.
+    if len(sys.argv) > 1 and sys.argv[1] != 'imports':
+        print('Error: {0} is not a check. Use imports to only check the import budgets, or no argument to run every check and benchmark.'.format(sys.argv[1]))
+        sys.exit(2)
+    if len(check_import_budget()) > 0:
+        sys.exit(1)
+    if len(sys.argv) > 1:
+        sys.exit(0)
+    benchmark_worker_startup()
+    check_next_coords_regression()
+    benchmark_track_tail_in_frame()
+    check_eye_angles_regression()
+    benchmark_calculate_eye_angles()
+    check_kinematics_regression()
+    check_tracking_paths_consistency()
+    benchmark_kinematics()
+    benchmark_tracking_pipeline()
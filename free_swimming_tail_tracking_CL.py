@@ -1,53 +1,365 @@
 '''Software Written by Nicholas Guilbeault 2018'''
 
-import free_swimming_tail_tracking_UT as ut
-import numpy as np
-
-# Create the video path.
-video_path = "C:\\Users\\User1\\Desktop\\Video1.avi"
-
-# Create the background path.
-background_path = "C:\\Users\\User1\\Desktop\\Video1_background.tif"
-
-# Set the colours to be used for drawing values of interest on the final utacked videos.
-colours =    [  (0, 0, 255),     (0, 127, 255),  (0, 255, 255),  (0, 255, 127),  (0, 255, 0),
-                (255, 255, 0),  (255, 0, 0),    (255, 0, 127),  (147, 20, 255), (139, 139, 0),
-                (49, 191, 114)
-            ]
-# If utacking parameters were saved using GUI, load utacking parameters.
-tracking_parameters = np.load('tracking_parameters.npy').item()
-n_tail_points = tracking_parameters['n_tail_points']
-dist_tail_points = tracking_parameters['dist_tail_points']
-dist_eyes = tracking_parameters['dist_eyes']
-dist_swim_bladder = tracking_parameters['dist_swim_bladder']
-frame_batch_size = tracking_parameters['frame_batch_size']
-starting_frame = tracking_parameters['starting_frame']
-n_frames = tracking_parameters['n_frames']
-line_length = tracking_parameters['line_length']
-pixel_threshold = tracking_parameters['pixel_threshold']
-frame_change_threshold = tracking_parameters['frame_change_threshold']
-
-# Set the number of tail points to calculate.
-n_tail_points = 7
-# Set the distance between tail points.
-dist_tail_points = 5
-# Set the interpupillary distance.
-dist_eyes = 4
-# Set the distance between the eyes and the swim bladder.
-dist_swim_bladder = 12
-# Set the threshold at which to determine whether or not to process the frame (there must be a pixel in the frame that is greater than the threshold in order for the algorithm to process the frame).
-pixel_threshold = 40
-# Set the line length that will be used for drawing the heading angle and eye angles.
-line_length = 4
-
-# Preview the results of the utacking parameters.
-ut.preview_utacking_results(video_path, colours, n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, background_path = background_path, pixel_threshold = pixel_threshold, line_length = line_length)
-
-# utack the video. This function will perform tail utacking, annotate the results onto video, and save the results to a .npz file.
-ut.utack_video(video_path, colours, n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, background_path = background_path, pixel_threshold = pixel_threshold, line_length = line_length)
-
-# utack the video using multiprocessing and return the results.
-results = ut.utack_tail_in_video_with_multiprocessing(video_path, colours, n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, background_path = background_path, pixel_threshold = pixel_threshold, line_length = line_length)
-
-# utack the video without using multiprocessing.
-results = ut.utack_tail_in_video_without_multiprocessing(video_path, colours, n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, background_path = background_path, pixel_threshold = pixel_threshold, line_length = line_length)
+# Command line interface for tracking videos without the user interface.
+#
+# Usage:
+#   python free_swimming_tail_tracking_CL.py background Video1.avi --method brightest --n-processes 4
+#   python free_swimming_tail_tracking_CL.py track Video1.avi --parameters tracking_parameters.json --chunk-size 10000
+#   python free_swimming_tail_tracking_CL.py batch "C:\Users\User1\Desktop\Videos" --parameters tracking_parameters.toml --n-processes 4
+#   python free_swimming_tail_tracking_CL.py preview Video1.avi --parameters tracking_parameters.npy --frame 100 --output preview.png
+#   python free_swimming_tail_tracking_CL.py kinematics Video1_results --output Video1_kinematics.npz
+#   python free_swimming_tail_tracking_CL.py convert-parameters tracking_parameters.npy tracking_parameters.json
+#
+# Progress and results are written to stdout as JSON lines, one event per line. Every event contains the event type, the command, and the time elapsed since the command started.
+#   {"event": "progress", "command": "track", "stage": "tracking", "n_completed": 500, "n_total": 2000, "fraction": 0.25, "elapsed": 2.1, "throughput": 238.1}
+#   {"event": "done", "command": "track", "elapsed": 8.4, ...}
+#   {"event": "error", "command": "track", "message": "...", "elapsed": 0.1}
+# Messages printed by the tracking functions are written to stderr so that stdout can be parsed.
+# The tracking functions are imported when a command runs, and PyQt5 and matplotlib are never imported, so that the interface starts quickly.
+
+# Import libraries.
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+
+# Tracking parameters that the preview and track commands require.
+required_tracking_parameters = ['n_tail_points', 'dist_tail_points', 'dist_eyes', 'dist_swim_bladder']
+
+class ProgressReporter():
+    '''
+    Writes the progress of a command to a stream as JSON lines.
+
+    Optional Arguments:
+        command (str) - Name of the command that is reported in every event. Default = None.
+        stream (file) - Stream that the events are written to. Default = None.
+            ** When stream is None, the events are written to stdout.
+        progress_interval (float) - Minimum number of seconds between progress events of the same stage. Default = 1.
+            ** The first and last progress events of a stage are always written.
+
+    Usage:
+        reporter = ProgressReporter('track')
+        ut.track_video(video_path, colours, progress_callback = reporter, **tracking_params)
+        reporter.done(results_path = results_path)
+    '''
+    def __init__(self, command = None, stream = None, progress_interval = 1):
+        self.command = command
+        # Keep a reference to the real stdout, since stdout is redirected to stderr while a command runs.
+        self.stream = stream if stream is not None else sys.stdout
+        self.progress_interval = progress_interval
+        self.t0 = time.perf_counter()
+        # The time and number of completed items when each stage started, and the time of the last progress event of each stage.
+        self.stage_starts = {}
+        self.last_report_times = {}
+    def write_event(self, event, **values):
+        # Write a single event as a line of JSON and flush it so that other programs receive it immediately.
+        record = {'event' : event, 'command' : self.command}
+        record.update(values)
+        record['elapsed'] = round(time.perf_counter() - self.t0, 3)
+        self.stream.write(json.dumps(record, default = lambda value: value.tolist() if hasattr(value, 'tolist') else str(value)) + '\n')
+        self.stream.flush()
+    def __call__(self, progress):
+        # Receive the progress from the progress_callback of a tracking function and write a progress event with the throughput of the stage.
+        t = time.perf_counter()
+        stage = progress.get('stage')
+        n_completed = progress['n_completed']
+        n_total = progress['n_total']
+        if stage not in self.stage_starts:
+            self.stage_starts[stage] = (t, n_completed)
+            self.last_report_times[stage] = None
+        # Skip progress events that are closer together than the progress interval, except for the first and last events of the stage.
+        last_report_time = self.last_report_times[stage]
+        if last_report_time is not None and n_completed < n_total and t - last_report_time < self.progress_interval:
+            return
+        self.last_report_times[stage] = t
+        stage_t0, stage_n0 = self.stage_starts[stage]
+        throughput = (n_completed - stage_n0) / (t - stage_t0) if t > stage_t0 and n_completed > stage_n0 else None
+        fraction = n_completed / n_total if n_total else None
+        self.write_event('progress', stage = stage, n_completed = n_completed, n_total = n_total, fraction = None if fraction is None else round(fraction, 4), throughput = None if throughput is None else round(throughput, 2))
+    def done(self, **values):
+        # Write the event that marks the end of the command.
+        self.write_event('done', **values)
+    def error(self, message):
+        # Write the event that marks that the command failed.
+        self.write_event('error', message = message)
+
+def load_parameters(args, reporter):
+    # Load the tracking parameters from the parameter file and replace them with the values given on the command line. Returns None if the parameters could not be loaded.
+    import free_swimming_tail_tracking_UT as ut
+    tracking_parameters = {}
+    if args.parameters is not None:
+        if not os.path.isfile(args.parameters):
+            reporter.error('The parameter file does not exist: {0}.'.format(args.parameters))
+            return
+        try:
+            tracking_parameters = ut.load_tracking_parameters(args.parameters)
+        except Exception as error:
+            reporter.error('The parameter file could not be loaded: {0}.'.format(error))
+            return
+        if not isinstance(tracking_parameters, dict):
+            reporter.error('The parameter file must contain a dictionary of tracking parameters: {0}.'.format(args.parameters))
+            return
+    tracking_parameters = dict(tracking_parameters)
+    # Parameters given with --set key=value are parsed as JSON when possible, otherwise they are kept as strings.
+    for parameter in args.set:
+        if '=' not in parameter:
+            reporter.error('Parameters must be given as key=value: {0}.'.format(parameter))
+            return
+        key, value = parameter.split('=', 1)
+        try:
+            tracking_parameters[key.strip()] = json.loads(value)
+        except ValueError:
+            tracking_parameters[key.strip()] = value
+    return tracking_parameters
+
+def get_colours(tracking_parameters):
+    # Return the colours in the tracking parameters, or the default colours.
+    import free_swimming_tail_tracking_UT as ut
+    colours = tracking_parameters.get('colours')
+    if colours is None:
+        return ut.default_colours
+    return [tuple(int(value) for value in colour) for colour in colours]
+
+def check_tracking_parameters(tracking_parameters, reporter):
+    # Check that the tracking parameters contain the parameters required for tracking. Returns False and reports an error if a parameter is missing.
+    missing_parameters = [key for key in required_tracking_parameters if key not in tracking_parameters]
+    if len(missing_parameters) > 0:
+        reporter.error('The tracking parameters must contain {0}. Use --parameters or --set.'.format(', '.join(missing_parameters)))
+        return False
+    return True
+
+def run_background(args, reporter):
+    # Calculate the background of a video and save it as a TIFF file.
+    import free_swimming_tail_tracking_UT as ut
+    if not os.path.isfile(args.video):
+        reporter.error('The video does not exist: {0}.'.format(args.video))
+        return 1
+    output_path = args.output if args.output is not None else os.path.join(os.path.dirname(os.path.abspath(args.video)), '{0}_background.tif'.format(os.path.splitext(os.path.basename(args.video))[0]))
+    backgrounds = ut.calculate_background(args.video, method = args.method, num_backgrounds = args.num_backgrounds, frame_stride = args.frame_stride, n_processes = args.n_processes, use_cache = not args.no_cache, progress_callback = reporter)
+    if backgrounds is None or len(backgrounds) == 0 or backgrounds[0] is None:
+        reporter.error('The background could not be calculated.')
+        return 1
+    # Save each background. Additional backgrounds are saved with the index of the background.
+    background_paths = []
+    for i, background in enumerate(backgrounds):
+        background_path = output_path if i == 0 else '{0}_{1}{2}'.format(os.path.splitext(output_path)[0], i, os.path.splitext(output_path)[1])
+        ut.save_background_to_file(background, background_path)
+        background_paths.append(background_path)
+    reporter.done(video_path = args.video, background_paths = background_paths)
+    return 0
+
+def run_track(args, reporter):
+    # Track a video with the tracking parameters and save the results.
+    import free_swimming_tail_tracking_UT as ut
+    if not os.path.isfile(args.video):
+        reporter.error('The video does not exist: {0}.'.format(args.video))
+        return 1
+    tracking_parameters = load_parameters(args, reporter)
+    if tracking_parameters is None or not check_tracking_parameters(tracking_parameters, reporter):
+        return 1
+    # Replace the tracking parameters with the values given on the command line.
+    command_line_parameters = {'background_path' : args.background, 'starting_frame' : args.starting_frame, 'n_frames' : args.n_frames, 'checkpoint_frames' : args.chunk_size}
+    tracking_parameters.update({key : value for key, value in command_line_parameters.items() if value is not None})
+    if args.no_video:
+        tracking_parameters['save_video'] = False
+    if args.resume:
+        tracking_parameters['resume'] = True
+    tracking_params = ut.get_track_video_arguments(tracking_parameters)
+    save_path = args.save_path if args.save_path is not None else os.path.dirname(os.path.abspath(args.video))
+    if not os.path.isdir(save_path):
+        os.makedirs(save_path)
+    # Calculate the background here, so that the number of processes can be chosen and the background is saved for later runs.
+    if tracking_params.get('background_path') is None:
+        tracking_params['background_path'] = os.path.join(save_path, '{0}_background.tif'.format(os.path.splitext(os.path.basename(args.video))[0]))
+        background = ut.calculate_background(args.video, n_processes = args.n_processes, progress_callback = reporter)[0]
+        if background is None:
+            reporter.error('The background could not be calculated.')
+            return 1
+        ut.save_background_to_file(background, tracking_params['background_path'])
+    profiler = ut.TrackingProfiler() if args.profile else None
+    t0 = time.perf_counter()
+    ut.track_video(args.video, get_colours(tracking_parameters), save_path = save_path, progress_callback = reporter, profiler = profiler, **tracking_params)
+    processing_time = time.perf_counter() - t0
+    # Report the number of tracked frames and the throughput of the whole run.
+    results_path = os.path.join(save_path, '{0}_results'.format(os.path.splitext(os.path.basename(args.video))[0]))
+    if not os.path.exists(results_path):
+        reporter.error('The video was not tracked. See stderr for details.')
+        return 1
+    # Count the frames in the saved results, since fewer frames than requested are tracked when the video is shorter.
+    n_frames = len(ut.load_tracking_results(results_path)['heading_angle_array'])
+    profile_values = {} if profiler is None else {'profile_path' : os.path.join(results_path, 'tracking_profile.json'), 'profile' : profiler.get_summary()}
+    reporter.done(video_path = args.video, results_path = results_path, background_path = tracking_params['background_path'], n_frames = n_frames, processing_time = round(processing_time, 3), frames_per_second = round(n_frames / processing_time, 2) if processing_time > 0 else None, **profile_values)
+    return 0
+
+def run_batch(args, reporter):
+    # Track a batch of videos in parallel and save a manifest with the status of each video.
+    import free_swimming_tail_tracking_UT as ut
+    tracking_parameters = load_parameters(args, reporter)
+    if tracking_parameters is None or not check_tracking_parameters(tracking_parameters, reporter):
+        return 1
+    if args.chunk_size is not None:
+        tracking_parameters['checkpoint_frames'] = args.chunk_size
+    if args.no_video:
+        tracking_parameters['save_video'] = False
+    video_paths = ut.find_videos(args.videos)
+    if len(video_paths) == 0:
+        reporter.error('No videos were found.')
+        return 1
+    manifest = ut.track_videos(video_paths, tracking_parameters, colours = get_colours(tracking_parameters), save_path = args.save_path, n_processes = args.n_processes, memory_fraction = args.memory_fraction, manifest_path = args.manifest, skip_completed = not args.no_skip_completed, progress_callback = reporter)
+    if manifest is None:
+        reporter.error('The videos could not be tracked. See stderr for details.')
+        return 1
+    # Summarize the status of the videos. The manifest contains the details of each video.
+    video_statuses = {}
+    for video_summary in manifest['videos']:
+        video_statuses[video_summary['status']] = video_statuses.get(video_summary['status'], 0) + 1
+    n_tracked_frames = sum([video_summary.get('n_frames', 0) for video_summary in manifest['videos'] if video_summary['status'] == 'completed'])
+    processing_time = manifest.get('processing_time', 0)
+    reporter.done(n_videos = len(manifest['videos']), statuses = video_statuses, n_frames = n_tracked_frames, processing_time = round(processing_time, 3), frames_per_second = round(n_tracked_frames / processing_time, 2) if processing_time > 0 else None, videos = [{key : video_summary.get(key) for key in ['video_path', 'status', 'results_path', 'frames_per_second', 'log_path']} for video_summary in manifest['videos']])
+    return 0 if video_statuses.get('failed', 0) == 0 else 1
+
+def run_preview(args, reporter):
+    # Track a single frame and save the frame annotated with the tracking results as an image.
+    import free_swimming_tail_tracking_UT as ut
+    if not os.path.isfile(args.video):
+        reporter.error('The video does not exist: {0}.'.format(args.video))
+        return 1
+    tracking_parameters = load_parameters(args, reporter)
+    if tracking_parameters is None or not check_tracking_parameters(tracking_parameters, reporter):
+        return 1
+    if args.background is not None:
+        tracking_parameters['background_path'] = args.background
+    preview_arguments = ['n_tail_points', 'dist_tail_points', 'dist_eyes', 'dist_swim_bladder', 'background_path', 'extended_eyes_calculation', 'eyes_threshold', 'line_length', 'pixel_threshold']
+    preview_params = {key : tracking_parameters[key] for key in preview_arguments if key in tracking_parameters}
+    output_path = args.output if args.output is not None else os.path.join(os.path.dirname(os.path.abspath(args.video)), '{0}_preview_{1}.png'.format(os.path.splitext(os.path.basename(args.video))[0], args.frame))
+    results = ut.preview_tracking_results(args.video, get_colours(tracking_parameters), frame_number = args.frame, output_path = output_path, **preview_params)
+    if not os.path.isfile(output_path):
+        reporter.error('The preview could not be saved. See stderr for details.')
+        return 1
+    reporter.done(video_path = args.video, frame_number = args.frame, output_path = output_path, tracked = results is not None)
+    return 0
+
+def run_kinematics(args, reporter):
+    # Calculate the tail angles, heading angles, and eye angles from the results of tracking a video and save them to a .npz file.
+    import numpy as np
+    import free_swimming_tail_tracking_UT as ut
+    import free_swimming_tail_tracking_KIN as kin
+    if not os.path.exists(args.results):
+        reporter.error('The results do not exist: {0}.'.format(args.results))
+        return 1
+    results = ut.load_tracking_results(args.results)
+    for key in ['tail_coord_array', 'body_coord_array', 'heading_angle_array']:
+        if key not in results:
+            reporter.error('The results must contain {0}.'.format(key))
+            return 1
+    eye_angle_array = results.get('eye_angle_array') if not args.no_eyes else None
+    t0 = time.perf_counter()
+    kinematics = kin.calculate_kinematics(results['tail_coord_array'], results['body_coord_array'], results['heading_angle_array'], eye_angle_array = eye_angle_array, smoothing_factor = args.smoothing_factor)
+    processing_time = time.perf_counter() - t0
+    results_path = args.results.rstrip('/\\')
+    if os.path.basename(results_path) == 'metadata.json':
+        results_path = os.path.dirname(results_path)
+    output_path = args.output if args.output is not None else '{0}_kinematics.npz'.format(os.path.splitext(results_path)[0])
+    np.savez(output_path, **kinematics)
+    n_frames = len(results['heading_angle_array'])
+    reporter.done(results_path = args.results, output_path = output_path, n_frames = n_frames, processing_time = round(processing_time, 3), frames_per_second = round(n_frames / processing_time, 2) if processing_time > 0 else None, arrays = sorted(kinematics.keys()))
+    return 0
+
+def run_convert_parameters(args, reporter):
+    # Convert a parameter file, such as the tracking_parameters.npy file saved by the GUI, to a JSON file or a .npy file.
+    import free_swimming_tail_tracking_UT as ut
+    tracking_parameters = load_parameters(args, reporter)
+    if tracking_parameters is None:
+        return 1
+    ut.save_tracking_parameters(tracking_parameters, args.output)
+    reporter.done(parameters_path = args.parameters, output_path = args.output, tracking_parameters = tracking_parameters)
+    return 0
+
+def add_parameter_arguments(parser, required = False):
+    # Add the arguments used to load and change the tracking parameters.
+    parser.add_argument('--parameters', '-p', required = required, help = 'Parameter file (.json, .toml, or the .npy file saved by the GUI).')
+    parser.add_argument('--set', action = 'append', default = [], metavar = 'KEY=VALUE', help = 'Replace a tracking parameter. Values are parsed as JSON. Can be used more than once.')
+
+def create_parser():
+    # Create the parser for the command line arguments.
+    parser = argparse.ArgumentParser(description = 'Track the tail and eyes of free swimming larval zebrafish without the user interface. Progress is written to stdout as JSON lines.')
+    parser.add_argument('--progress-interval', type = float, default = 1, help = 'Minimum number of seconds between progress events. Default = 1.')
+    subparsers = parser.add_subparsers(dest = 'command', metavar = 'command')
+    subparsers.required = True
+
+    background_parser = subparsers.add_parser('background', help = 'Calculate the background of a video.')
+    background_parser.add_argument('video', help = 'Path to the video.')
+    background_parser.add_argument('--method', default = 'brightest', choices = ['brightest', 'darkest', 'mode', 'median'], help = 'Method used to calculate the background. Default = brightest.')
+    background_parser.add_argument('--num-backgrounds', type = int, default = 1, help = 'Number of backgrounds calculated from consecutive parts of the video. Default = 1.')
+    background_parser.add_argument('--frame-stride', type = int, default = 1, help = 'Use every nth frame. Default = 1.')
+    background_parser.add_argument('--n-processes', '-j', type = int, default = None, help = 'Number of worker processes. Default = number of CPUs.')
+    background_parser.add_argument('--no-cache', action = 'store_true', help = 'Do not use the background cache.')
+    background_parser.add_argument('--output', '-o', default = None, help = 'Path to the background TIFF file. Default = {video}_background.tif next to the video.')
+    background_parser.set_defaults(function = run_background)
+
+    track_parser = subparsers.add_parser('track', help = 'Track a video.')
+    track_parser.add_argument('video', help = 'Path to the video.')
+    add_parameter_arguments(track_parser)
+    track_parser.add_argument('--background', '-b', default = None, help = 'Path to the background. Default = calculate the background.')
+    track_parser.add_argument('--save-path', '-o', default = None, help = 'Folder to save the results and tracked video. Default = folder of the video.')
+    track_parser.add_argument('--starting-frame', type = int, default = None, help = 'First frame to track.')
+    track_parser.add_argument('--n-frames', type = int, default = None, help = 'Number of frames to track.')
+    track_parser.add_argument('--chunk-size', type = int, default = None, help = 'Number of frames whose results are kept in memory before they are written to the results. Enables --resume.')
+    track_parser.add_argument('--resume', action = 'store_true', help = 'Resume tracking from the last chunk of results that was written.')
+    track_parser.add_argument('--no-video', action = 'store_true', help = 'Do not save the tracked video.')
+    track_parser.add_argument('--n-processes', '-j', type = int, default = None, help = 'Number of worker processes used to calculate the background. Default = number of CPUs.')
+    track_parser.add_argument('--profile', action = 'store_true', help = 'Time each stage of tracking, print a summary table to stderr, and save tracking_profile.json and frame_time_array.npy with the results.')
+    track_parser.set_defaults(function = run_track)
+
+    batch_parser = subparsers.add_parser('batch', help = 'Track a batch of videos in parallel.')
+    batch_parser.add_argument('videos', nargs = '+', help = 'Folders of videos, glob patterns, or paths to videos. Tracked videos (*_tracked, *_tracked_from_N) in folders and glob patterns are skipped.')
+    add_parameter_arguments(batch_parser)
+    batch_parser.add_argument('--save-path', '-o', default = None, help = 'Folder to save the results of every video. Default = folder of each video.')
+    batch_parser.add_argument('--n-processes', '-j', type = int, default = None, help = 'Maximum number of videos tracked at the same time. Default = number of CPUs.')
+    batch_parser.add_argument('--memory-fraction', type = float, default = 0.75, help = 'Fraction of the available memory that the workers may use. Default = 0.75.')
+    batch_parser.add_argument('--chunk-size', type = int, default = None, help = 'Number of frames whose results are kept in memory before they are written to the results.')
+    batch_parser.add_argument('--manifest', default = None, help = 'Path to the manifest JSON file. Default = batch_manifest.json in the save path.')
+    batch_parser.add_argument('--no-skip-completed', action = 'store_true', help = 'Track videos that were completed in a previous run with the same manifest.')
+    batch_parser.add_argument('--no-video', action = 'store_true', help = 'Do not save the tracked videos.')
+    batch_parser.set_defaults(function = run_batch)
+
+    preview_parser = subparsers.add_parser('preview', help = 'Save a frame annotated with the tracking results as an image.')
+    preview_parser.add_argument('video', help = 'Path to the video.')
+    add_parameter_arguments(preview_parser)
+    preview_parser.add_argument('--frame', '-f', type = int, default = 0, help = 'Frame number to preview. Default = 0.')
+    preview_parser.add_argument('--background', '-b', default = None, help = 'Path to the background. Default = calculate the background.')
+    preview_parser.add_argument('--output', '-o', default = None, help = 'Path to the image. Default = {video}_preview_{frame}.png next to the video.')
+    preview_parser.set_defaults(function = run_preview)
+
+    kinematics_parser = subparsers.add_parser('kinematics', help = 'Calculate the tail, heading, and eye angles from tracking results.')
+    kinematics_parser.add_argument('results', help = 'Path to the folder of results, or a .npy file of results.')
+    kinematics_parser.add_argument('--smoothing-factor', type = int, default = 3, help = 'Number of frames used by the moving average. Default = 3.')
+    kinematics_parser.add_argument('--no-eyes', action = 'store_true', help = 'Do not calculate the eye angles.')
+    kinematics_parser.add_argument('--output', '-o', default = None, help = 'Path to the .npz file. Default = {results}_kinematics.npz.')
+    kinematics_parser.set_defaults(function = run_kinematics)
+
+    convert_parser = subparsers.add_parser('convert-parameters', help = 'Convert a parameter file, such as the .npy file saved by the GUI, to JSON.')
+    convert_parser.add_argument('parameters', help = 'Parameter file (.json, .toml, or .npy).')
+    convert_parser.add_argument('output', help = 'Path to the new parameter file (.json or .npy).')
+    convert_parser.set_defaults(function = run_convert_parameters, set = [])
+    return parser
+
+def main(argv = None):
+    # Parse the command line arguments and run the command. Returns the exit status.
+    args = create_parser().parse_args(argv)
+    reporter = ProgressReporter(args.command, stream = sys.stdout, progress_interval = args.progress_interval)
+    # Write messages printed by the tracking functions to stderr, so that stdout only contains JSON lines.
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            return args.function(args, reporter)
+        except KeyboardInterrupt:
+            reporter.error('Interrupted.')
+            return 130
+        except Exception as error:
+            reporter.error('{0}: {1}'.format(type(error).__name__, error))
+            return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
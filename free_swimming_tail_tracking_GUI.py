@@ -6,17 +6,32 @@ import os
 import cv2
 import numpy as np
 import free_swimming_tail_tracking_UT as ut
-import matplotlib.cm as cm
+import free_swimming_tail_tracking_KIN as kin
 import time
+import threading
 from functools import partial
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_qt5agg import FigureCanvas, NavigationToolbar2QT as NavigationToolbar
-import matplotlib.pyplot as plt
+# matplotlib is imported by the functions that use it, since importing matplotlib and its Qt backend is slow and processes that are spawned from the GUI import this module again.
 
 from PyQt5.QtWidgets import *
 from PyQt5.QtGui import *
 from PyQt5.QtCore import *
 
+# Playback speeds of the play video buttons, as multiples of the fps of the video.
+playback_speeds = {'slow' : 0.25, 'medium' : 1, 'max' : 10}
+# Number of milliseconds between checks for the next frame to show during playback.
+playback_timer_interval = 5
+
+def create_preview_image(frame, frame_width, frame_height, scaled_width, grayscale = True):
+    # Resize a frame to the width of the preview frame window, rounded down to a multiple of 100 pixels, and convert it into an image. The image owns a copy of the frame so that it can be passed between threads.
+    if grayscale:
+        format = QImage.Format_Indexed8
+    else:
+        format = QImage.Format_RGB888
+    scaled_width = int(scaled_width / 100) * 100
+    preview_frame = QImage(frame.data, frame_width, frame_height, frame.strides[0], format).scaledToWidth(scaled_width)
+    frame = np.ascontiguousarray(cv2.resize(frame, dsize=(preview_frame.width(), preview_frame.height()), interpolation=cv2.INTER_CUBIC))
+    return QImage(frame.data, preview_frame.width(), preview_frame.height(), frame.strides[0], format).copy()
+
 class MainWindow(QMainWindow):
 
     def __init__(self, parent = None):
@@ -71,6 +86,11 @@ class MainWindow(QMainWindow):
         self.save_background_action.triggered.connect(self.trigger_save_background)
         self.tracking_options_menu.addAction(self.save_background_action)
 
+        self.build_frame_cache_action = QAction('&Build Frame Cache', self)
+        self.build_frame_cache_action.setStatusTip('Decode Every Frame Of The Video Into A Frame Cache For Fast Scrubbing')
+        self.build_frame_cache_action.triggered.connect(self.trigger_build_frame_cache)
+        self.tracking_options_menu.addAction(self.build_frame_cache_action)
+
         self.unload_all_tracking_action = QAction('&Unload All Tracking', self)
         self.unload_all_tracking_action.setShortcut('Ctrl+U')
         self.unload_all_tracking_action.setStatusTip('Unload All Tracking From Memory')
@@ -103,6 +123,8 @@ class MainWindow(QMainWindow):
         self.main_tab.tracking_window.tracking_content.trigger_select_save_path()
     def trigger_load_background(self):
         self.main_tab.tracking_window.tracking_content.trigger_load_background()
+    def trigger_build_frame_cache(self):
+        self.main_tab.tracking_window.tracking_content.trigger_build_frame_cache()
     def trigger_open_video(self):
         self.main_tab.tracking_window.tracking_content.trigger_open_video()
     def trigger_open_tracked_video(self):
@@ -116,29 +138,44 @@ class MainWindow(QMainWindow):
 
     # Defining Event Functions
     def closeEvent(self, event):
+        self.main_tab.playback_engine.stop()
+        self.main_tab.tracking_window.tracking_content.preview_render_thread.close()
+        self.main_tab.frame_cache.release()
         event.accept()
 
 class MainTab(QTabWidget):
 
     def __init__(self):
         super(MainTab, self).__init__()
-        self.tracking_window = TrackingWindow()
+        # The tracking and plotting tabs share the decoded frames of the videos and the playback engine.
+        self.frame_cache = ut.FrameCache()
+        # Only one video is played at a time.
+        self.playback_engine = ut.PlaybackEngine()
+        self.tracking_window = TrackingWindow(frame_cache = self.frame_cache, playback_engine = self.playback_engine)
         self.addTab(self.tracking_window,"Tracking")
-        self.plotting_window = PlottingWindow()
+        self.plotting_window = PlottingWindow(frame_cache = self.frame_cache, playback_engine = self.playback_engine)
         self.addTab(self.plotting_window, "Plotting")
 
 class TrackingWindow(QScrollArea):
 
-    def __init__(self):
+    def __init__(self, frame_cache = None, playback_engine = None):
         super(TrackingWindow, self).__init__()
-        self.tracking_content = TrackingContent()
+        self.tracking_content = TrackingContent(frame_cache = frame_cache, playback_engine = playback_engine)
         self.setWidget(self.tracking_content)
 
 class TrackingContent(QMainWindow):
 
     # Defining Initialization Functions
-    def __init__(self):
+    def __init__(self, frame_cache = None, playback_engine = None):
         super(TrackingContent, self).__init__()
+        self.frame_cache = frame_cache if frame_cache is not None else ut.FrameCache()
+        self.playback_engine = playback_engine if playback_engine is not None else ut.PlaybackEngine()
+        self.playback_timer = QTimer(self)
+        self.playback_timer.timeout.connect(self.trigger_play_video)
+        # Render the preview frames in a separate thread so that scrubbing through the video does not wait for tracking.
+        self.preview_render_thread = PreviewRenderThread(self.frame_cache)
+        self.preview_render_thread.preview_rendered_signal.connect(self.update_preview_from_thread)
+        self.preview_render_thread.start()
         self.initUI()
     def initUI(self):
         self.get_main_window_attributes()
@@ -329,6 +366,7 @@ class TrackingContent(QMainWindow):
         self.video_frame_height = 0
         self.frame_number = 1
         self.background_path = None
+        self.background = None
         self.background_path_basename = None
         self.background_path_folder = None
         self.save_path = None
@@ -361,6 +399,9 @@ class TrackingContent(QMainWindow):
         self.play_video_slow_speed = False
         self.play_video_medium_speed = False
         self.play_video_max_speed = False
+        self.preview_sequence_number = 0
+        self.preview_request = None
+        self.proxy_width = None
 
     # Defining Get Functions
     def get_main_window_attributes(self):
@@ -551,6 +592,7 @@ class TrackingContent(QMainWindow):
         self.frame_window_slider.setTickInterval(0)
         self.frame_window_slider.setSingleStep(0)
         self.frame_window_slider.sliderMoved.connect(self.check_frame_window_slider_moved)
+        self.frame_window_slider.sliderReleased.connect(self.check_frame_window_slider_released)
         self.update_frame_window_slider(inactivate = True)
     def add_preview_frame_number_textbox(self):
         new_y = self.preview_frame_window_size[1] + ((self.main_window_y_offset + self.main_window_spacing + self.preview_frame_window_slider_height + self.preview_frame_number_textbox_y_spacing) / 1400) * self.main_window_height
@@ -1220,18 +1262,9 @@ class TrackingContent(QMainWindow):
         self.background_path_basename_descriptor.setText('Background Filename: {0}'.format(self.background_path_basename))
         self.save_path_descriptor.setText('Save Path: {0}'.format(self.save_path))
     def update_preview_frame(self, frame, frame_width, frame_height, scaled_width = None, grayscale = True):
-        if grayscale:
-            format = QImage.Format_Indexed8
-        else:
-            format = QImage.Format_RGB888
         if scaled_width is None:
-            scaled_width = int(self.video_frame_width / 100) * 100
-        else:
-            scaled_width = int(scaled_width / 100) * 100
-        self.preview_frame = QImage(frame.data, frame_width, frame_height, format)
-        self.preview_frame = self.preview_frame.scaledToWidth(scaled_width)
-        frame = cv2.resize(frame, dsize=(self.preview_frame.width(), self.preview_frame.height()), interpolation=cv2.INTER_CUBIC).copy()
-        self.preview_frame = QImage(frame.data, self.preview_frame.width(), self.preview_frame.height(), format)
+            scaled_width = self.video_frame_width
+        self.preview_frame = create_preview_image(frame, frame_width, frame_height, scaled_width, grayscale = grayscale)
     def update_preview_frame_window(self, clear = False):
         if not clear:
             self.preview_frame_window_label.setPixmap(QPixmap.fromImage(self.preview_frame))
@@ -1567,6 +1600,21 @@ class TrackingContent(QMainWindow):
         self.update_tracking_parameters_buttons(activate = True)
         self.update_colour_parameters(activate = True)
         self.update_colour_parameters_buttons(activate = True)
+    def update_preview_from_thread(self, sequence_number, preview_frame):
+        # Only show the preview frame of the latest request. Preview frames of requests that were superseded are dropped.
+        if sequence_number != self.preview_sequence_number or self.preview_request is None:
+            return
+        self.preview_frame = preview_frame
+        self.update_preview_frame_window()
+        self.update_frame_window_slider(activate = True)
+        self.update_preview_frame_number_textbox(activate = True)
+        if self.preview_request['preview_eyes_threshold']:
+            self.update_video_playback_buttons(activate = True, activate_pause_video_button = True)
+        else:
+            self.update_video_time_textbox(activate = True)
+            self.update_video_playback_buttons(activate = True)
+        self.update_frame_change_buttons(activate = True)
+        self.update_interactive_frame_buttons(activate = True)
     def update_preview_frame_window_scroll_bars(self):
         if self.preview_frame_window_label_size[0] > self.preview_frame_window_size[0]:
             self.preview_frame_window.horizontalScrollBar().setValue(self.preview_frame_window.horizontalScrollBar().maximum() / 2)
@@ -1662,7 +1710,8 @@ class TrackingContent(QMainWindow):
         if self.video_path:
             self.get_video_attributes()
             self.update_descriptors()
-            success, self.frame = ut.load_frame_into_memory(self.video_path, self.frame_number - 1)
+            self.trigger_build_proxy_video()
+            success, self.frame = self.frame_cache.load_frame(self.video_path, self.frame_number - 1)
             if success and self.frame is not None:
                 self.update_preview_frame(self.frame, self.video_frame_width, self.video_frame_height)
                 self.update_preview_frame_window()
@@ -1679,7 +1728,7 @@ class TrackingContent(QMainWindow):
                     self.update_tracking_parameters_buttons(activate = True)
                     self.update_colour_parameters(activate = True)
                     self.update_colour_parameters_buttons(activate = True)
-    def trigger_update_preview(self, magnify = False, demagnify = False):
+    def trigger_update_preview(self, magnify = False, demagnify = False, frame = None, use_proxy = False):
         if self.preview_background:
             use_grayscale = True
             if magnify:
@@ -1695,54 +1744,16 @@ class TrackingContent(QMainWindow):
             self.update_video_playback_buttons(inactivate = True)
             self.update_frame_change_buttons(inactivate = True)
             self.update_interactive_frame_buttons(activate = True)
-        elif self.preview_eyes_threshold:
-            if self.video_path is not None:
-                success, self.frame = ut.load_frame_into_memory(self.video_path, self.frame_number - 1)
-                if success and self.frame is not None:
-                    use_grayscale = True
-                    self.frame = ut.apply_threshold_to_frame(ut.apply_median_blur_to_frame(ut.subtract_background_from_frame(self.frame, self.background)), self.eyes_threshold)
-                    if magnify:
-                        self.update_preview_frame(self.frame, self.video_frame_width, self.video_frame_height, scaled_width = self.preview_frame_window_label_size[0] + 100, grayscale = use_grayscale)
-                    if demagnify:
-                        self.update_preview_frame(self.frame, self.video_frame_width, self.video_frame_height, scaled_width = self.preview_frame_window_label_size[0] - 100, grayscale = use_grayscale)
-                    if not magnify and not demagnify:
-                        self.update_preview_frame(self.frame, self.video_frame_width, self.video_frame_height, scaled_width = self.preview_frame_window_label_size[0], grayscale = use_grayscale)
-                    self.update_preview_frame_window()
-                    self.update_frame_window_slider(activate = True)
-                    self.update_preview_frame_number_textbox(activate = True)
-                    self.update_video_playback_buttons(activate = True, activate_pause_video_button = True)
-                    self.update_frame_change_buttons(activate = True)
-                    self.update_interactive_frame_buttons(activate = True)
         else:
             if self.video_path is not None:
-                success, self.frame = ut.load_frame_into_memory(self.video_path, self.frame_number - 1)
-                if success and self.frame is not None:
-                    use_grayscale = True
-                    if self.preview_background_subtracted_frame:
-                        self.frame = ut.subtract_background_from_frame(self.frame, self.background)
-                        if self.preview_tracking_results:
-                            results = ut.track_tail_in_frame([ut.apply_median_blur_to_frame(self.frame), success, self.n_tail_points, self.dist_tail_points, self.dist_eyes, self.dist_swim_bladder, self.pixel_threshold, self.extended_eyes_calculation, self.eyes_threshold])
-                            if results is not None:
-                                self.frame = ut.annotate_tracking_results_onto_frame(self.frame, results, self.colours, self.line_length, self.extended_eyes_calculation, self.eyes_line_length)
-                                use_grayscale = False
-                    elif self.preview_tracking_results:
-                        results = ut.track_tail_in_frame([ut.apply_median_blur_to_frame(ut.subtract_background_from_frame(self.frame, self.background)), success, self.n_tail_points, self.dist_tail_points, self.dist_eyes, self.dist_swim_bladder, self.pixel_threshold, self.extended_eyes_calculation, self.eyes_threshold])
-                        if results is not None:
-                            self.frame = ut.annotate_tracking_results_onto_frame(self.frame, results, self.colours, self.line_length, self.extended_eyes_calculation, self.eyes_line_length)
-                            use_grayscale = False
-                    if magnify:
-                        self.update_preview_frame(self.frame, self.video_frame_width, self.video_frame_height, scaled_width = self.preview_frame_window_label_size[0] + 100, grayscale = use_grayscale)
-                    if demagnify:
-                        self.update_preview_frame(self.frame, self.video_frame_width, self.video_frame_height, scaled_width = self.preview_frame_window_label_size[0] - 100, grayscale = use_grayscale)
-                    if not magnify and not demagnify:
-                        self.update_preview_frame(self.frame, self.video_frame_width, self.video_frame_height, scaled_width = self.preview_frame_window_label_size[0], grayscale = use_grayscale)
-                    self.update_preview_frame_window()
-                    self.update_frame_window_slider(activate = True)
-                    self.update_preview_frame_number_textbox(activate = True)
-                    self.update_video_time_textbox(activate = True)
-                    self.update_video_playback_buttons(activate = True)
-                    self.update_frame_change_buttons(activate = True)
-                    self.update_interactive_frame_buttons(activate = True)
+                scaled_width = self.preview_frame_window_label_size[0]
+                if magnify:
+                    scaled_width += 100
+                if demagnify:
+                    scaled_width -= 100
+                # Send the preview request to the render thread. Requests that have not been rendered yet are replaced by the latest request.
+                self.preview_request = {'video_path' : self.video_path, 'frame_number' : self.frame_number, 'frame' : frame, 'proxy_width' : self.proxy_width if use_proxy and self.use_proxy_video() else None, 'scaled_width' : scaled_width, 'background' : self.background, 'preview_eyes_threshold' : self.preview_eyes_threshold, 'preview_background_subtracted_frame' : self.preview_background_subtracted_frame, 'preview_tracking_results' : self.preview_tracking_results, 'n_tail_points' : self.n_tail_points, 'dist_tail_points' : self.dist_tail_points, 'dist_eyes' : self.dist_eyes, 'dist_swim_bladder' : self.dist_swim_bladder, 'pixel_threshold' : self.pixel_threshold, 'extended_eyes_calculation' : self.extended_eyes_calculation, 'eyes_threshold' : self.eyes_threshold, 'colours' : list(self.colours), 'line_length' : self.line_length, 'eyes_line_length' : self.eyes_line_length}
+                self.preview_sequence_number = self.preview_render_thread.request_preview(self.preview_request)
             else:
                 self.update_preview_frame_window(clear = True)
     def trigger_load_default_tracking_parameters(self):
@@ -1797,6 +1808,17 @@ class TrackingContent(QMainWindow):
             'eyes_threshold' : self.eyes_threshold, 'eyes_line_length' : self.eyes_line_length,
             'save_video' : self.save_video, 'extended_eyes_calculation' : self.extended_eyes_calculation}
         np.save('tracking_parameters.npy', tracking_parameters)
+    def trigger_build_frame_cache(self):
+        if self.video_path:
+            self.frame_cache.build_sidecar(self.video_path)
+    def trigger_build_proxy_video(self):
+        # Build a downscaled proxy video in the background for scrubbing and playback when the frames are wider than the proxy video.
+        self.proxy_width = None
+        if self.video_frame_width > ut.default_proxy_width and self.frame_cache.build_sidecar(self.video_path, proxy_width = ut.default_proxy_width):
+            self.proxy_width = ut.default_proxy_width
+    def use_proxy_video(self):
+        # Proxy frames are only shown when the preview does not need the frames at full resolution.
+        return self.proxy_width is not None and not self.preview_background_subtracted_frame and not self.preview_tracking_results and not self.preview_eyes_threshold
     def trigger_track_video(self):
         if self.tracking_video_thread is None:
             # self.status_label.setText('Tracking Video...')
@@ -1843,6 +1865,9 @@ class TrackingContent(QMainWindow):
             self.track_video_thread.start()
             # self.status_label.setText('Video Tracked.')
     def trigger_unload_all_tracking(self):
+        self.trigger_pause_video()
+        if self.video_path:
+            self.frame_cache.release(self.video_path)
         if self.preview_background_checkbox.isChecked():
             self.preview_background_checkbox.setChecked(False)
         if self.preview_background_subtracted_frame_checkbox.isChecked():
@@ -1886,6 +1911,7 @@ class TrackingContent(QMainWindow):
         self.colour_textbox_list[id].setText('{0}'.format(colour))
         self.trigger_update_preview()
     def trigger_load_default_colours(self):
+        from matplotlib import cm
         self.colours = [[] for i in range(self.n_tail_points + 3)]
         colour_map = cm.gnuplot2
         self.colours[-1] = (0, 170, 0)
@@ -1913,47 +1939,48 @@ class TrackingContent(QMainWindow):
         colours = {'colours' : self.colours}
         np.save('colours.npy', colours)
     def trigger_pause_video(self):
-        if self.video_playback_thread:
-            self.video_playback_thread.close()
+        was_playing = self.playback_timer.isActive()
+        self.playback_timer.stop()
+        if self.playback_engine.is_playing(self.video_path):
+            self.playback_engine.stop()
+        self.statusBar().clearMessage()
         if self.play_video_slow_speed:
             self.play_video_slow_speed = False
         if self.play_video_medium_speed:
             self.play_video_medium_speed = False
         if self.play_video_max_speed:
             self.play_video_max_speed = False
-    def trigger_play_video_slow_speed(self):
-        if self.play_video_slow_speed:
-            self.frame_number += 1
-            if self.frame_number <= self.video_n_frames:
-                self.trigger_update_preview()
-            else:
-                self.video_playback_thread.close()
-                self.frame_number = 1
-                self.trigger_update_preview()
-                self.video_playback_thread.start_thread = True
-                self.video_playback_thread.start()
-    def trigger_play_video_medium_speed(self):
-        if self.play_video_medium_speed:
-            self.frame_number += 10
-            if self.frame_number <= self.video_n_frames:
-                self.trigger_update_preview()
-            else:
-                self.video_playback_thread.close()
-                self.frame_number = 1
-                self.trigger_update_preview()
-                self.video_playback_thread.start_thread = True
-                self.video_playback_thread.start()
-    def trigger_play_video_max_speed(self):
-        if self.play_video_max_speed:
-            self.frame_number += 50
-            if self.frame_number <= self.video_n_frames:
-                self.trigger_update_preview()
-            else:
-                self.video_playback_thread.close()
-                self.frame_number = 1
-                self.trigger_update_preview()
-                self.video_playback_thread.start_thread = True
-                self.video_playback_thread.start()
+        if was_playing and self.video_path and not self.preview_background:
+            # Show the frame that playback stopped on at full resolution.
+            self.trigger_update_preview()
+    def trigger_start_video_playback(self, playback_speed):
+        # Continue playing from the frame after the frame in the preview. Only the playback speed changes if the video is already playing. The proxy video is played once it has been built.
+        if self.playback_engine.is_playing(self.video_path) and self.playback_engine.convert_to_grayscale:
+            self.playback_engine.set_playback_speed(playback_speed)
+        else:
+            proxy_frames = self.frame_cache.get_sidecar(self.video_path, proxy_width = self.proxy_width) if self.use_proxy_video() else None
+            self.playback_engine.start(self.video_path, starting_frame = self.frame_number % self.video_n_frames, playback_speed = playback_speed, video_fps = self.video_fps, frames = proxy_frames)
+        self.playback_timer.start(playback_timer_interval)
+    def trigger_play_video(self):
+        # Show the latest frame that is due. Playback stops when the playback engine is used to play another video.
+        if not self.playback_engine.is_playing(self.video_path):
+            self.pause_video_button.setChecked(True)
+            self.check_pause_video_button()
+            return
+        frame_number, frame = self.playback_engine.get_frame()
+        if frame is None:
+            return
+        self.frame_number = frame_number + 1
+        if self.preview_background:
+            self.trigger_update_preview()
+        elif frame.shape[1] != self.video_frame_width and not self.use_proxy_video():
+            # The preview needs the frame at full resolution.
+            self.trigger_update_preview()
+        else:
+            # Frames that arrive while the previous frame is rendered replace it, so rendering never falls behind playback.
+            self.trigger_update_preview(frame = frame)
+        playback_statistics = self.playback_engine.get_statistics()
+        self.statusBar().showMessage('Playback: {0:.1f} / {1:.1f} fps. Dropped frames: {2}.'.format(playback_statistics['achieved_fps'], playback_statistics['playback_rate'], playback_statistics['n_dropped_frames'] + playback_statistics['n_skipped_frames']))
 
     # Defining Check Functions
     def check_preview_frame_number_textbox(self):
@@ -1967,6 +1994,10 @@ class TrackingContent(QMainWindow):
                     self.frame_number = 1
         self.trigger_update_preview()
     def check_frame_window_slider_moved(self):
+        self.frame_number = int(self.frame_window_slider.sliderPosition())
+        # Scrub through the proxy video while the slider is dragged.
+        self.trigger_update_preview(use_proxy = True)
+    def check_frame_window_slider_released(self):
         self.frame_number = int(self.frame_window_slider.sliderPosition())
         self.trigger_update_preview()
     def check_preview_background_checkbox(self):
@@ -2158,15 +2189,11 @@ class TrackingContent(QMainWindow):
             if self.play_video_medium_speed:
                 self.play_video_medium_speed = False
                 self.play_video_medium_speed_button.setChecked(False)
-                self.video_playback_thread.close()
             if self.play_video_max_speed:
                 self.play_video_max_speed = False
                 self.play_video_max_speed_button.setChecked(False)
-                self.video_playback_thread.close()
-            self.video_playback_thread = VideoPlaybackThread()
-            self.video_playback_thread.start()
-            self.video_playback_thread.time_signal.connect(self.trigger_play_video_slow_speed)
             self.play_video_slow_speed = True
+            self.trigger_start_video_playback(playback_speeds['slow'])
         else:
             self.pause_video_button.setChecked(True)
             self.trigger_pause_video()
@@ -2177,15 +2204,11 @@ class TrackingContent(QMainWindow):
             if self.play_video_slow_speed:
                 self.play_video_slow_speed = False
                 self.play_video_slow_speed_button.setChecked(False)
-                self.video_playback_thread.close()
             if self.play_video_max_speed:
                 self.play_video_max_speed = False
                 self.play_video_max_speed_button.setChecked(False)
-                self.video_playback_thread.close()
-            self.video_playback_thread = VideoPlaybackThread()
-            self.video_playback_thread.start()
-            self.video_playback_thread.time_signal.connect(self.trigger_play_video_medium_speed)
             self.play_video_medium_speed = True
+            self.trigger_start_video_playback(playback_speeds['medium'])
         else:
             self.pause_video_button.setChecked(True)
             self.trigger_pause_video()
@@ -2196,16 +2219,11 @@ class TrackingContent(QMainWindow):
             if self.play_video_slow_speed:
                 self.play_video_slow_speed = False
                 self.play_video_slow_speed_button.setChecked(False)
-                self.video_playback_thread.close()
             if self.play_video_medium_speed:
                 self.play_video_medium_speed = False
                 self.play_video_medium_speed_button.setChecked(False)
-                self.video_playback_thread.close()
-            self.video_playback_thread = VideoPlaybackThread()
-            self.video_playback_thread.video_fps = self.video_fps
-            self.video_playback_thread.start()
-            self.video_playback_thread.time_signal.connect(self.trigger_play_video_max_speed)
             self.play_video_max_speed = True
+            self.trigger_start_video_playback(playback_speeds['max'])
         else:
             self.pause_video_button.setChecked(True)
             self.trigger_pause_video()
@@ -2292,18 +2310,93 @@ class CalculateBackgroundThread(QThread):
         self.background = ut.calculate_background(self.video_path)[0]
         self.background_calculated_signal.emit(True)
 
+class PreviewRenderThread(QThread):
+
+    preview_rendered_signal = pyqtSignal(int, QImage)
+
+    def __init__(self, frame_cache):
+        super(PreviewRenderThread, self).__init__()
+        self.frame_cache = frame_cache
+        self.start_thread = True
+        # Only the latest preview request is kept. A request replaces the request that is waiting to be rendered.
+        self.preview_request = None
+        self.sequence_number = 0
+        self.condition = threading.Condition()
+
+    def request_preview(self, preview_request):
+        # Queue a preview request and return its sequence number.
+        with self.condition:
+            self.sequence_number += 1
+            self.preview_request = (self.sequence_number, preview_request)
+            self.condition.notify()
+            return self.sequence_number
+
+    def is_superseded(self, sequence_number):
+        # Check whether a newer preview request was made while a preview request was being rendered.
+        return sequence_number != self.sequence_number or not self.start_thread
+
+    def render_preview(self, sequence_number, preview_request):
+        # Load the frame from the frame cache, apply the preview options and resize the frame. Rendering stops between steps once the request is superseded.
+        # Frames from playback are passed with the request.
+        if preview_request['frame'] is not None:
+            success, frame = True, preview_request['frame']
+        else:
+            success, frame = self.frame_cache.load_frame(preview_request['video_path'], preview_request['frame_number'] - 1, proxy_width = preview_request['proxy_width'])
+        if not success or frame is None or self.is_superseded(sequence_number):
+            return None
+        use_grayscale = True
+        if preview_request['preview_eyes_threshold']:
+            frame = ut.apply_threshold_to_frame(ut.apply_median_blur_to_frame(ut.subtract_background_from_frame(frame, preview_request['background'])), preview_request['eyes_threshold'])
+        elif preview_request['preview_background_subtracted_frame'] or preview_request['preview_tracking_results']:
+            background_subtracted_frame = ut.subtract_background_from_frame(frame, preview_request['background'])
+            if preview_request['preview_background_subtracted_frame']:
+                frame = background_subtracted_frame
+            if preview_request['preview_tracking_results']:
+                results = ut.track_tail_in_frame([ut.apply_median_blur_to_frame(background_subtracted_frame), success, preview_request['n_tail_points'], preview_request['dist_tail_points'], preview_request['dist_eyes'], preview_request['dist_swim_bladder'], preview_request['pixel_threshold'], preview_request['extended_eyes_calculation'], preview_request['eyes_threshold']])
+                if self.is_superseded(sequence_number):
+                    return None
+                if results is not None:
+                    frame = ut.annotate_tracking_results_onto_frame(frame, results, preview_request['colours'], preview_request['line_length'], preview_request['extended_eyes_calculation'], preview_request['eyes_line_length'])
+                    use_grayscale = False
+        # Proxy frames are smaller than the frames of the video.
+        return create_preview_image(frame, frame.shape[1], frame.shape[0], preview_request['scaled_width'], grayscale = use_grayscale)
+
+    def run(self):
+        while True:
+            # Wait for the next preview request.
+            with self.condition:
+                while self.preview_request is None and self.start_thread:
+                    self.condition.wait()
+                if not self.start_thread:
+                    break
+                sequence_number, preview_request = self.preview_request
+                self.preview_request = None
+            preview_frame = self.render_preview(sequence_number, preview_request)
+            if preview_frame is not None and not self.is_superseded(sequence_number):
+                self.preview_rendered_signal.emit(sequence_number, preview_frame)
+
+    def close(self):
+        with self.condition:
+            self.start_thread = False
+            self.condition.notify()
+        self.wait()
+
 class PlottingWindow(QScrollArea):
 
-    def __init__(self):
+    def __init__(self, frame_cache = None, playback_engine = None):
         super(PlottingWindow, self).__init__()
-        self.plotting_content = PlottingContent()
+        self.plotting_content = PlottingContent(frame_cache = frame_cache, playback_engine = playback_engine)
         self.setWidget(self.plotting_content)
 
 class PlottingContent(QMainWindow):
 
     # Defining Initialization Functions
-    def __init__(self):
+    def __init__(self, frame_cache = None, playback_engine = None):
         super(PlottingContent, self).__init__()
+        self.frame_cache = frame_cache if frame_cache is not None else ut.FrameCache()
+        self.playback_engine = playback_engine if playback_engine is not None else ut.PlaybackEngine()
+        self.playback_timer = QTimer(self)
+        self.playback_timer.timeout.connect(self.trigger_play_video)
         self.initUI()
     def initUI(self):
         self.initialize_class_variables()
@@ -2323,6 +2416,7 @@ class PlottingContent(QMainWindow):
         self.play_video_medium_speed = False
         self.play_video_max_speed = False
         self.data_plot = None
+        self.proxy_width = None
 
     def get_video_attributes(self):
         self.video_path_folder = os.path.dirname(self.video_path)
@@ -2353,6 +2447,7 @@ class PlottingContent(QMainWindow):
         self.frame_window_slider.setTickInterval(0)
         self.frame_window_slider.setSingleStep(0)
         self.frame_window_slider.sliderMoved.connect(self.check_frame_window_slider_moved)
+        self.frame_window_slider.sliderReleased.connect(self.check_frame_window_slider_released)
         self.update_frame_window_slider(inactivate = True)
     def add_tracking_video_time_textbox(self):
         font = QFont()
@@ -2581,7 +2676,11 @@ class PlottingContent(QMainWindow):
         self.video_path, _ = QFileDialog.getOpenFileName(self, "Open Video File", "","Video Files (*.avi; *.mp4)", options = QFileDialog.Options())
         if self.video_path:
             self.get_video_attributes()
-            success, self.frame = ut.load_frame_into_memory(self.video_path, self.frame_number - 1, convert_to_grayscale = False)
+            # Build a downscaled proxy video in the background for scrubbing and playback when the frames are wider than the proxy video.
+            self.proxy_width = None
+            if self.video_frame_width > ut.default_proxy_width and self.frame_cache.build_sidecar(self.video_path, convert_to_grayscale = False, proxy_width = ut.default_proxy_width):
+                self.proxy_width = ut.default_proxy_width
+            success, self.frame = self.frame_cache.load_frame(self.video_path, self.frame_number - 1, convert_to_grayscale = False)
             if success and self.frame is not None:
                 self.update_preview_frame(self.frame, self.video_frame_width, self.video_frame_height)
                 self.update_preview_frame_window()
@@ -2590,11 +2689,11 @@ class PlottingContent(QMainWindow):
                 self.update_update_preview_button(activate = True)
                 self.update_video_playback_buttons(activate = True, activate_pause_video_button = True)
                 self.update_frame_change_buttons(activate = True)
-    def trigger_update_preview(self):
+    def trigger_update_preview(self, use_proxy = False):
         if self.video_path is not None:
-            success, self.frame = ut.load_frame_into_memory(self.video_path, self.frame_number - 1, convert_to_grayscale = False)
+            success, self.frame = self.frame_cache.load_frame(self.video_path, self.frame_number - 1, convert_to_grayscale = False, proxy_width = self.proxy_width if use_proxy else None)
             if success and self.frame is not None:
-                self.update_preview_frame(self.frame, self.video_frame_width, self.video_frame_height)
+                self.update_preview_frame(self.frame, self.frame.shape[1], self.frame.shape[0])
                 self.update_preview_frame_window()
                 self.update_frame_window_slider(activate = True)
                 self.update_tracking_video_time_textbox(activate = True)
@@ -2602,15 +2701,17 @@ class PlottingContent(QMainWindow):
                 self.update_video_playback_buttons(activate = True)
                 self.update_frame_change_buttons(activate = True)
     def trigger_load_tracking_results(self):
-        self.tracking_data_path, _ = QFileDialog.getOpenFileName(self, "Open Tracking Data", "","Tracking Data (*.npy)", options = QFileDialog.Options())
+        self.tracking_data_path, _ = QFileDialog.getOpenFileName(self, "Open Tracking Data", "","Tracking Data (metadata.json *.npy)", options = QFileDialog.Options())
         if self.tracking_data_path:
-            data = np.load(self.tracking_data_path).item()
+            # Memory-map the tracking results.
+            data = ut.load_tracking_results(self.tracking_data_path)
             self.data_plot = DataPlot()
             self.data_plot.initialize_class_variables(data = data)
             self.data_plot.calculate_variables()
             self.data_plot.update_plots()
             self.update_data_plot_window()
     def trigger_unload_all_plotting(self):
+        self.trigger_pause_video()
         self.initialize_class_variables()
         self.update_preview_frame_window(clear = True)
         self.update_frame_window_slider(inactivate = True)
@@ -2621,45 +2722,44 @@ class PlottingContent(QMainWindow):
         self.update_frame_window_slider_position()
         self.update_data_plot_window(clear = True)
     def trigger_pause_video(self):
-        if self.video_playback_thread:
-            self.video_playback_thread.close()
+        was_playing = self.playback_timer.isActive()
+        self.playback_timer.stop()
+        if self.playback_engine.is_playing(self.video_path):
+            self.playback_engine.stop()
+        self.statusBar().clearMessage()
         if self.play_video_slow_speed:
             self.play_video_slow_speed = False
-        if self.play_video_max_speed:
-            self.play_video_max_speed = False
-    def trigger_play_video_slow_speed(self):
-        if self.play_video_slow_speed:
-            self.frame_number += 1
-            if self.frame_number <= self.video_n_frames:
-                self.trigger_update_preview()
-            else:
-                self.video_playback_thread.close()
-                self.frame_number = 1
-                self.trigger_update_preview()
-                self.video_playback_thread.start_thread = True
-                self.video_playback_thread.start()
-    def trigger_play_video_medium_speed(self):
         if self.play_video_medium_speed:
-            self.frame_number += 10
-            if self.frame_number <= self.video_n_frames:
-                self.trigger_update_preview()
-            else:
-                self.video_playback_thread.close()
-                self.frame_number = 1
-                self.trigger_update_preview()
-                self.video_playback_thread.start_thread = True
-                self.video_playback_thread.start()
-    def trigger_play_video_max_speed(self):
+            self.play_video_medium_speed = False
         if self.play_video_max_speed:
-            self.frame_number += 50
-            if self.frame_number <= self.video_n_frames:
-                self.trigger_update_preview()
-            else:
-                self.video_playback_thread.close()
-                self.frame_number = 1
-                self.trigger_update_preview()
-                self.video_playback_thread.start_thread = True
-                self.video_playback_thread.start()
+            self.play_video_max_speed = False
+        if was_playing and self.video_path:
+            # Show the frame that playback stopped on at full resolution.
+            self.trigger_update_preview()
+    def trigger_start_video_playback(self, playback_speed):
+        # Continue playing from the frame after the frame in the preview. Only the playback speed changes if the video is already playing. The proxy video is played once it has been built.
+        if self.playback_engine.is_playing(self.video_path) and not self.playback_engine.convert_to_grayscale:
+            self.playback_engine.set_playback_speed(playback_speed)
+        else:
+            proxy_frames = self.frame_cache.get_sidecar(self.video_path, convert_to_grayscale = False, proxy_width = self.proxy_width) if self.proxy_width is not None else None
+            self.playback_engine.start(self.video_path, starting_frame = self.frame_number % self.video_n_frames, playback_speed = playback_speed, video_fps = self.video_fps, convert_to_grayscale = False, frames = proxy_frames)
+        self.playback_timer.start(playback_timer_interval)
+    def trigger_play_video(self):
+        # Show the latest frame that is due. Playback stops when the playback engine is used to play another video.
+        if not self.playback_engine.is_playing(self.video_path):
+            self.trigger_pause_video()
+            self.update_video_playback_buttons(activate = True, activate_pause_video_button = True)
+            return
+        frame_number, frame = self.playback_engine.get_frame()
+        if frame is None:
+            return
+        self.frame_number = frame_number + 1
+        self.update_preview_frame(frame, frame.shape[1], frame.shape[0])
+        self.update_preview_frame_window()
+        self.update_frame_window_slider(activate = True)
+        self.update_tracking_video_time_textbox(activate = True)
+        playback_statistics = self.playback_engine.get_statistics()
+        self.statusBar().showMessage('Playback: {0:.1f} / {1:.1f} fps. Dropped frames: {2}.'.format(playback_statistics['achieved_fps'], playback_statistics['playback_rate'], playback_statistics['n_dropped_frames'] + playback_statistics['n_skipped_frames']))
 
     def check_tracking_video_time_textbox(self):
         try:
@@ -2675,6 +2775,10 @@ class PlottingContent(QMainWindow):
             pass
         self.trigger_update_preview()
     def check_frame_window_slider_moved(self):
+        self.frame_number = int(self.frame_window_slider.sliderPosition())
+        # Scrub through the proxy video while the slider is dragged.
+        self.trigger_update_preview(use_proxy = True)
+    def check_frame_window_slider_released(self):
         self.frame_number = int(self.frame_window_slider.sliderPosition())
         self.trigger_update_preview()
     def check_large_frame_decrease_button(self):
@@ -2713,39 +2817,26 @@ class PlottingContent(QMainWindow):
         if not self.play_video_slow_speed:
             if self.play_video_medium_speed:
                 self.play_video_medium_speed = False
-                self.video_playback_thread.close()
             if self.play_video_max_speed:
                 self.play_video_max_speed = False
-                self.video_playback_thread.close()
-            self.video_playback_thread = VideoPlaybackThread()
-            self.video_playback_thread.start()
-            self.video_playback_thread.time_signal.connect(self.trigger_play_video_slow_speed)
             self.play_video_slow_speed = True
+            self.trigger_start_video_playback(playback_speeds['slow'])
     def check_play_video_medium_speed_button(self):
         if not self.play_video_medium_speed:
             if self.play_video_slow_speed:
                 self.play_video_slow_speed = False
-                self.video_playback_thread.close()
             if self.play_video_max_speed:
                 self.play_video_max_speed = False
-                self.video_playback_thread.close()
-            self.video_playback_thread = VideoPlaybackThread()
-            self.video_playback_thread.start()
-            self.video_playback_thread.time_signal.connect(self.trigger_play_video_medium_speed)
             self.play_video_medium_speed = True
+            self.trigger_start_video_playback(playback_speeds['medium'])
     def check_play_video_max_speed_button(self):
         if not self.play_video_max_speed:
             if self.play_video_slow_speed:
                 self.play_video_slow_speed = False
-                self.video_playback_thread.close()
             if self.play_video_medium_speed:
                 self.play_video_medium_speed = False
-                self.video_playback_thread.close()
-            self.video_playback_thread = VideoPlaybackThread()
-            self.video_playback_thread.video_fps = self.video_fps
-            self.video_playback_thread.start()
-            self.video_playback_thread.time_signal.connect(self.trigger_play_video_max_speed)
             self.play_video_max_speed = True
+            self.trigger_start_video_playback(playback_speeds['max'])
 
 class DataPlot(QMainWindow):
 
@@ -2754,6 +2845,8 @@ class DataPlot(QMainWindow):
         self.initUI()
 
     def initUI(self):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_qt5agg import FigureCanvas, NavigationToolbar2QT as NavigationToolbar
         self.data_plots = QWidget()
         self.setCentralWidget(self.data_plots)
         layout = QVBoxLayout(self.data_plots)
@@ -2788,82 +2881,15 @@ class DataPlot(QMainWindow):
     def calculate_variables(self):
         self.smoothing_factor = 3
 
-        self.tail_angles = [[np.arctan2(self.tail_coord_array[j][i + 1][0] - self.tail_coord_array[j][i][0], self.tail_coord_array[j][i + 1][1] - self.tail_coord_array[j][i][1]) for i in range(len(self.tail_coord_array[0]) - 1)] for j in range(len(self.tail_coord_array))]
-        self.body_tail_angles = [np.arctan2(self.tail_coord_array[j][0][0] - self.body_coord_array[j][0], self.tail_coord_array[j][0][1] - self.body_coord_array[j][1]) for j in range(len(self.tail_coord_array))]
-        self.tail_angles = [[self.tail_angles[j][i] - self.body_tail_angles[j] for i in range(len(self.tail_angles[0]))] for j in range(len(self.tail_angles))]
-        self.tail_angles = [[self.tail_angles[i][j] for i in range(len(self.tail_angles))] for j in range(len(self.tail_angles[0]))]
-
-        for i in range(len(self.tail_angles)):
-            for j in range(1, len(self.tail_angles[i])):
-                if self.tail_angles[i][j] >= 0.9 * np.pi:
-                    self.tail_angles[i][j] -= np.pi * 2
-                elif self.tail_angles[i][j] <= 0.9 * -np.pi:
-                    self.tail_angles[i][j] += np.pi * 2
-
-        self.sum_tail_angles = [np.sum([abs(self.tail_angles[i][j]) for i in range(len(self.tail_angles))]) for j in range(len(self.tail_angles[0]))]
-        self.tail_angle_frames = np.where([self.sum_tail_angles[i] == self.sum_tail_angles[i + 1] == self.sum_tail_angles[i + 2] for i in range(len(self.sum_tail_angles) - 2)])[0]
-        self.tail_angle_frames = np.where([self.sum_tail_angles[i] == self.sum_tail_angles[i + 1] for i in range(len(self.sum_tail_angles) - 1)])[0]
-        for i in range(1, len(self.tail_angle_frames)):
-            if self.tail_angle_frames[i] - self.tail_angle_frames[i - 1] == 2:
-                self.tail_angle_frames = np.append(self.tail_angle_frames, self.tail_angle_frames[i - 1] + 1)
-            elif self.tail_angle_frames[i] - self.tail_angle_frames[i - 1] == 3:
-                self.tail_angle_frames = np.append(self.tail_angle_frames, self.tail_angle_frames[i - 1] + 1)
-                self.tail_angle_frames = np.append(self.tail_angle_frames, self.tail_angle_frames[i - 1] + 2)
-
-        for i in range(len(self.tail_angles)):
-            for j in self.tail_angle_frames:
-                self.tail_angles[i][j] = 0.0
-        self.smoothed_tail_angles = [np.convolve(self.tail_angles[i], np.ones(self.smoothing_factor)/self.smoothing_factor, mode = 'same') for i in range(len(self.tail_angles))]
-
-        j = 0
-        if np.isnan(self.heading_angle_array[0]):
-            while np.isnan(self.heading_angle_array[0]):
-                if not np.isnan(self.heading_angle_array[j]):
-                    self.heading_angle_array[0] = self.heading_angle_array[j]
-                j += 1
-
-        self.heading_angles = np.array([self.heading_angle_array[i] - self.heading_angle_array[0] for i in range(len(self.heading_angle_array))])
-
-        i = 0
-        for j in range(len(self.heading_angles)):
-            if j not in self.tail_angle_frames:
-                i = j
-            else:
-                self.heading_angles[j] = self.heading_angles[i]
-
-        for i in range(1, len(self.heading_angles)):
-            if self.heading_angles[i] - self.heading_angles[i - 1] > np.pi:
-                self.heading_angles[i:] -= np.pi * 2
-            elif self.heading_angles[i] - self.heading_angles[i - 1] < -np.pi:
-                self.heading_angles[i:] += np.pi * 2
-
-        self.smoothed_heading_angles = np.convolve(self.heading_angles, np.ones(self.smoothing_factor)/self.smoothing_factor, mode = 'same')
-
-        self.eye_angles = [[self.eye_angle_array[i][j] - self.heading_angle_array[i] for i in range(len(self.eye_angle_array))] for j in range(len(self.eye_angle_array[0]))]
-
-        i = 0
-        for k in range(len(self.eye_angles)):
-            for j in range(len(self.eye_angles[k])):
-                if j not in self.tail_angle_frames:
-                    i = j
-                else:
-                    self.eye_angles[k][j] = self.eye_angles[k][i]
-
-        for j in range(len(self.eye_angles)):
-            for i in range(1, len(self.eye_angles[j])):
-                if self.eye_angles[j][i] - self.eye_angles[j][i - 1] > np.pi * 0.9:
-                    self.eye_angles[j][i] -= np.pi * 2
-                elif self.eye_angles[j][i] - self.eye_angles[j][i - 1] < -np.pi * 0.9:
-                    self.eye_angles[j][i] += np.pi * 2
-
-        for j in range(len(self.eye_angles)):
-            for i in range(1, len(self.eye_angles[j])):
-                if self.eye_angles[j][i] > np.pi:
-                    self.eye_angles[j][i] -= np.pi * 2
-                elif self.eye_angles[j][i] < -np.pi:
-                    self.eye_angles[j][i] += np.pi * 2
-
-        self.smoothed_eye_angles = [np.convolve(self.eye_angles[i], np.ones(self.smoothing_factor)/self.smoothing_factor, mode = 'same') for i in range(len(self.eye_angles))]
+        kinematics = kin.calculate_kinematics(self.tail_coord_array, self.body_coord_array, self.heading_angle_array, self.eye_angle_array, smoothing_factor = self.smoothing_factor)
+        self.tail_angles = kinematics['tail_angles']
+        self.sum_tail_angles = kinematics['sum_tail_angles']
+        self.tail_angle_frames = kinematics['tail_angle_frames']
+        self.smoothed_tail_angles = kinematics['smoothed_tail_angles']
+        self.heading_angles = kinematics['heading_angles']
+        self.smoothed_heading_angles = kinematics['smoothed_heading_angles']
+        self.eye_angles = kinematics['eye_angles']
+        self.smoothed_eye_angles = kinematics['smoothed_eye_angles']
 
         self.timepoints = np.linspace(0, self.video_n_frames / self.video_fps, self.video_n_frames)
 
@@ -2887,23 +2913,6 @@ class DataPlot(QMainWindow):
         self.eye_angles_plot_axis.set_ylabel('Angle (radians)')
         self.eye_angles_plot_axis.set_title('Eye Angles Over Time')
 
-class VideoPlaybackThread(QThread):
-
-    time_signal = pyqtSignal(float)
-
-    def __init__(self):
-        super(VideoPlaybackThread, self).__init__()
-        self.start_thread = True
-
-    def run(self):
-        while self.start_thread:
-            time_now = time.perf_counter()
-            self.time_signal.emit(time_now)
-            time.sleep(0.1)
-
-    def close(self):
-        self.start_thread = False
-
 if __name__ == '__main__':
     app = QApplication(sys.argv)
     ex = MainWindow()
@@ -0,0 +1,223 @@
+'''Software Written by Nicholas Guilbeault 2018'''
+
+# Import libraries.
+import numpy as np
+
+def calculate_tail_angles(tail_coord_array, body_coord_array):
+    '''
+    Calculates the angle of each tail segment relative to the angle between the body and the swim bladder.
+
+    Required Arguments:
+        tail_coord_array (n frames, n tail points + 1, 2) - Coordinates of the swim bladder followed by the tail points.
+        body_coord_array (n frames, 2) - Coordinates of the body.
+
+    Returns:
+        tail_angles (n tail points, n frames) - Tail angles.
+            ** Tail angles greater than 0.9 * pi or less than -0.9 * pi are wrapped by 2 * pi, except for the first frame.
+    '''
+    # Calculate the angle of each tail segment.
+    tail_segments = np.diff(tail_coord_array, axis = 1)
+    tail_angles = np.arctan2(tail_segments[:, :, 0], tail_segments[:, :, 1])
+    # Calculate the angle between the body and the swim bladder.
+    body_tail_angles = np.arctan2(tail_coord_array[:, 0, 0] - body_coord_array[:, 0], tail_coord_array[:, 0, 1] - body_coord_array[:, 1])
+    # Subtract the body tail angle from each tail angle and arrange the tail angles by tail point.
+    tail_angles -= body_tail_angles[:, np.newaxis]
+    tail_angles = tail_angles.T.copy()
+    # Wrap the tail angles.
+    tail_angles[:, 1:] = wrap_angles(tail_angles[:, 1:], 0.9 * np.pi, inclusive = True)
+    return tail_angles
+
+def wrap_angles(angles, threshold, inclusive = False):
+    # Subtract 2 * pi from angles above the threshold and add 2 * pi to angles below the negative threshold. Each angle is wrapped at most once.
+    if inclusive:
+        above_threshold = angles >= threshold
+        below_threshold = angles <= -threshold
+    else:
+        above_threshold = angles > threshold
+        below_threshold = angles < -threshold
+    wrapped_angles = np.where(above_threshold, angles - np.pi * 2, np.where(below_threshold, angles + np.pi * 2, angles))
+    return wrapped_angles
+
+def calculate_sum_tail_angles(tail_angles):
+    # Calculate the sum of the absolute tail angles in each frame. Each frame is summed as a contiguous row so that the order of the additions is the same as summing each frame separately.
+    return np.sum(np.ascontiguousarray(np.abs(tail_angles).T), axis = 1)
+
+def calculate_stuck_frames(sum_tail_angles, stuck_frame_window = 2, fill_stuck_frame_gaps = True):
+    '''
+    Finds the frames where the tracking of the tail did not change.
+
+    Required Arguments:
+        sum_tail_angles (n frames) - Sum of the absolute tail angles in each frame.
+
+    Optional Arguments:
+        stuck_frame_window (int) - Number of consecutive frames with the same sum of tail angles needed for the first of these frames to be stuck. Default = 2.
+        fill_stuck_frame_gaps (bool) - Boolean to determine whether or not gaps of one or two frames between stuck frames are also stuck frames. Default = True.
+
+    Returns:
+        tail_angle_frames (array) - Frame numbers of the stuck frames.
+    '''
+    n_frames = len(sum_tail_angles) - stuck_frame_window + 1
+    if n_frames < 1:
+        return np.array([], dtype = np.int64)
+    # Find the frames where the sum of tail angles is equal to the sum of tail angles of each of the following frames in the window.
+    stuck_frames = np.ones(n_frames, dtype = bool)
+    for i in range(1, stuck_frame_window):
+        stuck_frames &= sum_tail_angles[:n_frames] == sum_tail_angles[i:i + n_frames]
+    tail_angle_frames = np.flatnonzero(stuck_frames)
+    if fill_stuck_frame_gaps and len(tail_angle_frames) > 1:
+        # Add the frames in between stuck frames that are two or three frames apart.
+        gaps = np.diff(tail_angle_frames)
+        previous_frames = tail_angle_frames[:-1]
+        tail_angle_frames = np.concatenate([tail_angle_frames, previous_frames[gaps == 2] + 1, previous_frames[gaps == 3] + 1, previous_frames[gaps == 3] + 2])
+    return tail_angle_frames
+
+def calculate_forward_fill_index(stuck_frames, initial_index = 0):
+    # Calculate the index of the last frame that is not stuck for each frame. Frames before the first frame that is not stuck use the initial index.
+    index = np.where(stuck_frames, -1, np.arange(len(stuck_frames)))
+    index = np.maximum.accumulate(index)
+    index[index < 0] = initial_index
+    return index
+
+def unwrap_angles(angles):
+    # Subtract or add 2 * pi to all following angles whenever the angle changes by more than pi from one frame to the next.
+    changes = np.zeros(len(angles))
+    differences = np.diff(angles)
+    changes[1:][differences > np.pi] = -np.pi * 2
+    changes[1:][differences < -np.pi] = np.pi * 2
+    return angles + np.cumsum(changes)
+
+def get_transition_composition_table():
+    # Each transition maps the 3 ways that the previous angle could have been wrapped to the way that the current angle is wrapped, and is stored as the code f(0) + 3 * f(1) + 9 * f(2). The table gives the code of f(g(state)) for each pair of codes f and g.
+    transitions = np.array([[code % 3, code // 3 % 3, code // 9] for code in range(27)])
+    composition_table = np.zeros((27, 27), dtype = np.uint8)
+    for f in range(27):
+        for g in range(27):
+            composed_transition = transitions[f][transitions[g]]
+            composition_table[f, g] = composed_transition[0] + 3 * composed_transition[1] + 9 * composed_transition[2]
+    return composition_table
+
+transition_composition_table = get_transition_composition_table()
+identity_transition = 0 + 3 * 1 + 9 * 2
+
+def wrap_angles_sequentially(angles, threshold = np.pi * 0.9):
+    '''
+    Wraps each angle by 2 * pi when it differs from the previous wrapped angle by more than the threshold.
+
+    Steps:
+        Each angle can be wrapped by -2 * pi, 0, or +2 * pi, depending on how the previous angle was wrapped.
+        For each frame, the wrapping of the angle is calculated for each of the three ways that the previous angle could have been wrapped.
+        These transitions are combined across all frames with a parallel prefix scan.
+
+    Required Arguments:
+        angles (n frames) - Angles to wrap.
+
+    Optional Arguments:
+        threshold (float) - Largest change in angle from one frame to the next that is not wrapped. Default = 0.9 * pi.
+
+    Returns:
+        wrapped_angles (n frames) - Wrapped angles.
+    '''
+    n_frames = len(angles)
+    if n_frames < 2:
+        return angles.copy()
+    # Calculate the wrapping of each angle for each wrapping of the previous angle. 0 is -2 * pi, 1 is no wrapping, and 2 is +2 * pi.
+    transitions = np.zeros(n_frames, dtype = np.uint8)
+    for state, previous_angles in enumerate([angles[:-1] - np.pi * 2, angles[:-1], angles[:-1] + np.pi * 2]):
+        differences = angles[1:] - previous_angles
+        transitions[1:] += (np.where(differences > threshold, 0, np.where(differences < -threshold, 2, 1)) * 3 ** state).astype(np.uint8)
+    # The first angle is not wrapped.
+    transitions[0] = 1 + 3 + 9
+    # Angles whose transition keeps the way the previous angle was wrapped are skipped by the scan.
+    changing_frames = transitions != identity_transition
+    changing_transitions = transitions[changing_frames]
+    # Combine the transitions with a parallel prefix scan.
+    step = 1
+    while step < len(changing_transitions):
+        changing_transitions[step:] = transition_composition_table[changing_transitions[step:], changing_transitions[:-step]]
+        step *= 2
+    # Every combined transition is now constant, so take the way each angle is wrapped for any previous state and forward fill it over the skipped angles.
+    states = np.zeros(n_frames, dtype = np.uint8)
+    states[changing_frames] = changing_transitions % 3
+    states = states[np.maximum.accumulate(np.where(changing_frames, np.arange(n_frames), 0))]
+    wrapped_angles = np.where(states == 0, angles - np.pi * 2, np.where(states == 2, angles + np.pi * 2, angles))
+    return wrapped_angles
+
+def smooth_angles(angles, smoothing_factor):
+    # Smooth the angles with a moving average.
+    return np.convolve(angles, np.ones(smoothing_factor)/smoothing_factor, mode = 'same')
+
+def calculate_kinematics(tail_coord_array, body_coord_array, heading_angle_array, eye_angle_array = None, smoothing_factor = 3, stuck_frame_window = 2, fill_stuck_frame_gaps = True, zero_stuck_tail_angles = True):
+    '''
+    Calculates the tail angles, heading angles, and eye angles from the results of tracking a video.
+
+    Steps:
+        Calculates the tail angles relative to the angle between the body and the swim bladder.
+        Finds the stuck frames, where the sum of the absolute tail angles did not change.
+        The heading angles are calculated relative to the first heading angle that is not NaN, forward filled over stuck frames, and unwrapped.
+        The eye angles are calculated relative to the heading angles, forward filled over stuck frames, and wrapped.
+        The tail angles, heading angles, and eye angles are smoothed with a moving average.
+
+    Required Arguments:
+        tail_coord_array (n frames, n tail points + 1, 2) - Coordinates of the swim bladder followed by the tail points.
+        body_coord_array (n frames, 2) - Coordinates of the body.
+        heading_angle_array (n frames) - Heading angles.
+
+    Optional Arguments:
+        eye_angle_array (n frames, 2) - Eye angles. Default = None.
+            ** When eye_angle_array is None, the eye angles are not calculated.
+        smoothing_factor (int) - Number of frames used by the moving average. Default = 3.
+        stuck_frame_window (int) - Number of consecutive frames with the same sum of tail angles needed for a frame to be stuck. Default = 2.
+        fill_stuck_frame_gaps (bool) - Boolean to determine whether or not gaps of one or two frames between stuck frames are also stuck frames. Default = True.
+        zero_stuck_tail_angles (bool) - Boolean to determine whether or not the tail angles of stuck frames are set to 0. Default = True.
+
+    Returns:
+        kinematics (dict) - Dictionary that contains the tail angles, sum of tail angles, stuck frames, heading angles, and eye angles, and their smoothed versions.
+    '''
+    tail_coord_array = np.asarray(tail_coord_array, dtype = np.float64)
+    body_coord_array = np.asarray(body_coord_array, dtype = np.float64)
+    heading_angle_array = np.array(heading_angle_array, dtype = np.float64)
+    n_frames = len(heading_angle_array)
+
+    # Calculate the tail angles and find the stuck frames.
+    tail_angles = calculate_tail_angles(tail_coord_array, body_coord_array)
+    sum_tail_angles = calculate_sum_tail_angles(tail_angles)
+    tail_angle_frames = calculate_stuck_frames(sum_tail_angles, stuck_frame_window = stuck_frame_window, fill_stuck_frame_gaps = fill_stuck_frame_gaps)
+    stuck_frames = np.zeros(n_frames, dtype = bool)
+    stuck_frames[tail_angle_frames] = True
+    if zero_stuck_tail_angles:
+        tail_angles[:, stuck_frames] = 0.0
+    smoothed_tail_angles = np.array([smooth_angles(tail_angles[i], smoothing_factor) for i in range(len(tail_angles))])
+
+    # Replace the first heading angle with the first heading angle that is not NaN.
+    tracked_frames = np.flatnonzero(~np.isnan(heading_angle_array))
+    if len(tracked_frames) > 0:
+        heading_angle_array[0] = heading_angle_array[tracked_frames[0]]
+    # Calculate the heading angles relative to the first heading angle, forward fill the heading angles over the stuck frames, and unwrap the heading angles.
+    heading_angles = heading_angle_array - heading_angle_array[0]
+    forward_fill_index = calculate_forward_fill_index(stuck_frames)
+    heading_angles = unwrap_angles(heading_angles[forward_fill_index])
+    smoothed_heading_angles = smooth_angles(heading_angles, smoothing_factor)
+
+    kinematics = {  'tail_angles' : tail_angles,
+                    'smoothed_tail_angles' : smoothed_tail_angles,
+                    'sum_tail_angles' : sum_tail_angles,
+                    'tail_angle_frames' : tail_angle_frames,
+                    'heading_angles' : heading_angles,
+                    'smoothed_heading_angles' : smoothed_heading_angles
+                }
+
+    if eye_angle_array is not None:
+        eye_angle_array = np.asarray(eye_angle_array, dtype = np.float64)
+        # Calculate the eye angles relative to the heading angles.
+        eye_angles = (eye_angle_array - heading_angle_array[:, np.newaxis]).T.copy()
+        # Forward fill the eye angles over the stuck frames. Stuck frames before the first frame that is not stuck use the last frame that is not stuck of the previous eye.
+        last_index = forward_fill_index[-1] if n_frames > 0 else 0
+        for k in range(len(eye_angles)):
+            eye_angles[k] = eye_angles[k][calculate_forward_fill_index(stuck_frames, initial_index = 0 if k == 0 else last_index)]
+            # Wrap the eye angles that change by more than 0.9 * pi, then wrap the eye angles into the range -pi to pi, except for the first frame.
+            eye_angles[k] = wrap_angles_sequentially(eye_angles[k])
+            eye_angles[k][1:] = wrap_angles(eye_angles[k][1:], np.pi)
+        kinematics['eye_angles'] = eye_angles
+        kinematics['smoothed_eye_angles'] = np.array([smooth_angles(eye_angles[i], smoothing_factor) for i in range(len(eye_angles))])
+
+    return kinematics
@@ -7,6 +7,26 @@ import os
 import sys
 import multiprocessing as mp
 import time
+import functools
+import json
+import hashlib
+import threading
+import queue
+import subprocess
+import shutil
+import glob
+import inspect
+import contextlib
+import traceback
+import collections
+import re
+import math
+
+# Shared memory is only available from Python 3.8 onwards. Frames are sent to worker processes directly when it is not available.
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
 
 def get_total_frame_number_from_video(video_path):
     capture = cv2.VideoCapture(video_path)
@@ -32,30 +52,387 @@ def get_video_format_from_video(video_path):
     capture.release()
     return video_format
 
-def calculate_background(video_path, method = 'brightest', save_path = None, num_backgrounds = 1, save_background = False):
+def report_progress(message, n_completed, n_total, progress_callback = None, stage = None, end = '\r'):
+    # Report the progress of a long task. Without a progress callback, the message is printed on a line that is overwritten by the next message, unless end is changed. With a progress callback, the callback receives a dictionary with the stage, the number of completed and total items and the message.
+    if progress_callback is None:
+        print(message, end = end)
+    else:
+        progress_callback({'stage' : stage, 'n_completed' : n_completed, 'n_total' : n_total, 'message' : message})
+
+# Stages of the tracking pipeline that are timed by a TrackingProfiler, in the order they are shown in the summary table.
+profiler_stages = ['background', 'read', 'decode', 'grayscale', 'absdiff', 'median_blur', 'track', 'motion_gate', 'first_eye', 'second_eye', 'extended_eyes', 'swim_bladder', 'tail', 'roi_tracking', 'write', 'annotate', 'encode', 'checkpoint', 'save_results']
+
+# Outcomes of the frames that are counted by a TrackingProfiler.
+profiler_counters = ['frames_tracked', 'frames_skipped_pixel_threshold', 'frames_skipped_frame_change', 'frames_failed_exception', 'frames_lost', 'frames_failed_decode']
+
+class TrackingProfiler():
+    '''
+    Times the stages of the tracking pipeline and counts the outcome of each frame.
+
+    Steps:
+        Each stage adds the time it took to the total time of the stage with add_time. Timing a stage costs one call to time.perf_counter and a dictionary update.
+            ** read, track, and write are the time spent by the tracking loop on each step. The other stages are parts of these steps, or run in the decode and writer threads when the video is tracked with pipelined = True.
+            ** Stages in different threads overlap, so the sum of the stage times can be larger than the processing time.
+        Each frame is counted as tracked, skipped by the pixel threshold, skipped by the frame change threshold, failed with an exception, lost, or failed to decode with count.
+            ** A frame is lost when its brightest pixel is above the pixel threshold but the fish could not be tracked.
+        The time spent by the tracking loop on each frame is kept in an array that is saved with the tracking results as frame_time_array.
+        At the end of a run, the summary table is printed and the summary and frame times are saved to a JSON trace.
+
+    Optional Arguments:
+        enabled (bool) - Boolean to determine whether or not the profiler times anything. Default = True.
+            ** When enabled is False, track_video runs as if no profiler was provided.
+        n_frames (int) - Number of frames whose time is kept. Default = 0.
+            ** track_video calls start with the number of frames to track.
+
+    Usage:
+        profiler = TrackingProfiler()
+        track_video(video_path, colours, n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, profiler = profiler)
+        summary = profiler.get_summary()
+    '''
+
+    def __init__(self, enabled = True, n_frames = 0):
+        self.enabled = enabled
+        self.start(n_frames)
+
+    def start(self, n_frames = 0):
+        # Reset the stage times, counters, and frame times, and start the clock of the run.
+        self.stage_times = collections.OrderedDict([(stage, 0.0) for stage in profiler_stages])
+        self.stage_calls = collections.OrderedDict([(stage, 0) for stage in profiler_stages])
+        self.counters = collections.OrderedDict([(counter, 0) for counter in profiler_counters])
+        self.frame_time_array = np.full(max(int(n_frames), 0), np.nan, dtype = np.float32)
+        self.t0 = time.perf_counter()
+        self.t1 = None
+
+    def stop(self):
+        # Stop the clock of the run.
+        self.t1 = time.perf_counter()
+
+    def add_time(self, stage, t0):
+        # Add the time since t0 to a stage. Returns the current time, so that the next stage can start from it.
+        t = time.perf_counter()
+        self.stage_times[stage] = self.stage_times.get(stage, 0.0) + t - t0
+        self.stage_calls[stage] = self.stage_calls.get(stage, 0) + 1
+        return t
+
+    def count(self, counter, n = 1):
+        # Add to the number of frames with an outcome.
+        self.counters[counter] = self.counters.get(counter, 0) + int(n)
+
+    def set_frame_time(self, frame_index, frame_time):
+        # Keep the time spent on a frame. Frames outside of the array are ignored.
+        if 0 <= frame_index < len(self.frame_time_array):
+            self.frame_time_array[frame_index] = frame_time
+
+    def get_wall_time(self):
+        # Return the time since the run started, or the duration of the run once it stopped.
+        return (self.t1 if self.t1 is not None else time.perf_counter()) - self.t0
+
+    def get_summary(self):
+        '''
+        Returns the stage times, counters, and statistics of the frame times.
+
+        Returns:
+            summary (dict) - Dictionary that contains the wall time, the total time, number of calls, mean time, and fraction of the wall time of each stage that was timed, the counters, and the percentiles of the frame times in milliseconds.
+        '''
+        wall_time = self.get_wall_time()
+        stages = collections.OrderedDict()
+        for stage, stage_time in self.stage_times.items():
+            if self.stage_calls[stage] == 0:
+                continue
+            stages[stage] = {'total_s' : stage_time, 'calls' : self.stage_calls[stage], 'mean_ms' : stage_time / self.stage_calls[stage] * 1000, 'fraction' : stage_time / wall_time if wall_time > 0 else None}
+        frame_times = self.frame_time_array[~np.isnan(self.frame_time_array)].astype(np.float64) * 1000
+        frame_time_summary = {'n_frames' : len(frame_times)}
+        if len(frame_times) > 0:
+            frame_time_summary.update({'mean_ms' : float(np.mean(frame_times)), 'p50_ms' : float(np.percentile(frame_times, 50)), 'p90_ms' : float(np.percentile(frame_times, 90)), 'p99_ms' : float(np.percentile(frame_times, 99)), 'max_ms' : float(np.max(frame_times))})
+            frame_time_summary['frames_per_second'] = len(frame_times) / wall_time if wall_time > 0 else None
+        return {'wall_time_s' : wall_time, 'stages' : stages, 'counters' : dict(self.counters), 'frame_times' : frame_time_summary}
+
+    def format_summary(self):
+        # Return the summary as a table with one row for each stage that was timed, followed by the counters.
+        summary = self.get_summary()
+        lines = ['{0:<16}{1:>12}{2:>12}{3:>12}{4:>10}'.format('Stage', 'Total (s)', 'Calls', 'Mean (ms)', 'Wall %')]
+        for stage, stage_summary in summary['stages'].items():
+            lines.append('{0:<16}{1:>12.3f}{2:>12}{3:>12.3f}{4:>10.1f}'.format(stage, stage_summary['total_s'], stage_summary['calls'], stage_summary['mean_ms'], (stage_summary['fraction'] or 0) * 100))
+        lines.append('Wall time: {0:.3f} seconds.'.format(summary['wall_time_s']))
+        for counter, value in summary['counters'].items():
+            lines.append('{0}: {1}'.format(counter.replace('_', ' ').capitalize(), value))
+        if summary['frame_times']['n_frames'] > 0:
+            lines.append('Frame time (ms): mean {mean_ms:.3f}, p50 {p50_ms:.3f}, p90 {p90_ms:.3f}, p99 {p99_ms:.3f}, max {max_ms:.3f}.'.format(**summary['frame_times']))
+        return '\n'.join(lines)
+
+    def save_trace(self, trace_path):
+        # Save the summary and the time spent on each frame in milliseconds to a JSON file. Frames that were not timed are null.
+        trace = self.get_summary()
+        trace['frame_times_ms'] = [None if np.isnan(frame_time) else round(float(frame_time) * 1000, 4) for frame_time in self.frame_time_array]
+        with open(trace_path, 'w') as f:
+            json.dump(trace, f, indent = 4)
+        return trace_path
+
+# Default location and maximum size of the background cache. The least recently used backgrounds are removed when the cache grows larger than the maximum size.
+background_cache_path = os.path.join(os.path.expanduser('~'), '.free_swimming_tail_tracking', 'background_cache')
+background_cache_max_size = 512 * 1024 * 1024
+
+def get_video_fingerprint(video_path, n_sampled_frames = 5):
+    '''
+    Calculates a fingerprint that identifies the contents of a video without reading every frame.
+
+    Steps:
+        The absolute path, file size, modification time and total number of frames of the video are hashed.
+        A number of frames that are equally spaced throughout the video are read and added to the hash.
+
+    Required Arguments:
+        video_path (str) - Path to the video.
+
+    Optional Arguments:
+        n_sampled_frames (int) - Number of frames that are added to the hash. Default = 5.
+
+    Returns:
+        video_fingerprint (str) - Hexadecimal digest of the hash.
+    '''
+    # Hash the attributes of the video file.
+    video_stat = os.stat(video_path)
+    video_total_frames = get_total_frame_number_from_video(video_path)
+    video_hash = hashlib.sha1('{0}|{1}|{2}|{3}'.format(os.path.abspath(video_path), video_stat.st_size, video_stat.st_mtime_ns, video_total_frames).encode())
+    # Hash a few frames spread throughout the video.
+    capture = cv2.VideoCapture(video_path)
+    for frame_num in np.unique(np.linspace(0, max(video_total_frames - 1, 0), n_sampled_frames).astype(int)):
+        capture.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
+        success, frame = capture.read()
+        if success:
+            video_hash.update(np.ascontiguousarray(frame).tobytes())
+    capture.release()
+    return video_hash.hexdigest()
+
+def get_background_cache_file(video_path, method = 'brightest', num_backgrounds = 1, frame_stride = 1, cache_path = None):
+    # Return the path of the file in the cache which contains the background(s) of a video calculated with the given method, number of backgrounds and frame stride.
+    if cache_path is None:
+        cache_path = background_cache_path
+    background_key = hashlib.sha1('{0}|{1}|{2}|{3}'.format(get_video_fingerprint(video_path), method, num_backgrounds, frame_stride).encode()).hexdigest()
+    return os.path.join(cache_path, '{0}.npy'.format(background_key))
+
+def load_background_from_cache(background_cache_file):
+    # Load the background(s) from the cache. Returns None if the background(s) have not been cached.
+    if not os.path.isfile(background_cache_file):
+        return None
+    try:
+        background_array = np.load(background_cache_file)
+    except:
+        return None
+    # Update the modification time of the file so that recently used backgrounds are removed from the cache last.
+    os.utime(background_cache_file)
+    return [background for background in background_array]
+
+def save_background_to_cache(background_array, background_cache_file, max_cache_size = None):
+    # Save the background(s) into the cache and remove the least recently used backgrounds if the cache is too large.
+    cache_path = os.path.dirname(background_cache_file)
+    os.makedirs(cache_path, exist_ok = True)
+    # Write into a temporary file first so that a partially written file is never loaded from the cache.
+    temporary_file = '{0}.{1}.tmp'.format(background_cache_file, os.getpid())
+    with open(temporary_file, 'wb') as f:
+        np.save(f, np.array(background_array, dtype = np.uint8))
+    os.replace(temporary_file, background_cache_file)
+    evict_background_cache(cache_path, max_cache_size = max_cache_size)
+
+def evict_cache_folder(cache_path, max_cache_size):
+    # Remove the least recently used files from a cache folder until the size of the cache is smaller than the maximum size. Only finished cache files are removed, so files that are still being written are kept.
+    if not os.path.isdir(cache_path):
+        return
+    cache_files = [os.path.join(cache_path, cache_file) for cache_file in os.listdir(cache_path) if cache_file.endswith('.npy')]
+    cache_files = sorted([[os.path.getmtime(cache_file), os.path.getsize(cache_file), cache_file] for cache_file in cache_files])
+    cache_size = sum([cache_file_size for _, cache_file_size, _ in cache_files])
+    for _, cache_file_size, cache_file in cache_files:
+        if cache_size <= max_cache_size:
+            break
+        try:
+            os.remove(cache_file)
+            cache_size -= cache_file_size
+        except OSError:
+            pass
+
+def evict_background_cache(cache_path = None, max_cache_size = None):
+    # Remove the least recently used backgrounds from the cache until the size of the cache is smaller than the maximum size.
+    if cache_path is None:
+        cache_path = background_cache_path
+    if max_cache_size is None:
+        max_cache_size = background_cache_max_size
+    evict_cache_folder(cache_path, max_cache_size)
+
+def clear_background_cache(cache_path = None):
+    # Remove all backgrounds from the cache.
+    evict_background_cache(cache_path = cache_path, max_cache_size = 0)
+
+# Maximum number of sampled frames in each range of frames reduced into a histogram for the mode and median backgrounds, so that the counts of each range fit into 16 bit integers.
+background_histogram_max_frames = np.iinfo(np.uint16).max
+
+# Number of pixels of the merged histogram that are converted into a background image at a time.
+background_histogram_block_size = 4096
+
+# Fraction of the available memory that the histograms of the mode and median backgrounds may use.
+background_memory_fraction = 0.75
+
+def get_background_n_processes(n_processes, frame_size, method = 'brightest', available_memory = None):
+    # Limit the number of processes used to calculate a mode or median background so that the histograms fit into memory. Each process keeps a histogram of 16 bit counts, which uses 512 bytes per pixel, and holds a copy of the histogram while sending it to the main process, which receives a third copy. The main process also keeps the merged histogram, which uses up to 1 KB per pixel once the counts no longer fit into 16 bits. Returns at least 1 process.
+    if method not in ['mode', 'median']:
+        return n_processes
+    if available_memory is None:
+        available_memory = get_available_memory()
+        if available_memory is None:
+            return n_processes
+    histogram_bytes = 256 * np.dtype(np.uint16).itemsize * frame_size[0] * frame_size[1]
+    merged_histogram_bytes = 2 * histogram_bytes
+    max_n_processes = int((available_memory * background_memory_fraction - merged_histogram_bytes) // (3 * histogram_bytes))
+    return max(min(n_processes, max_n_processes), 1)
+
+def get_background_frame_ranges(video_total_frames, num_backgrounds = 1, n_ranges = 1):
+    '''
+    Splits the frames of a video into ranges of frames that are reduced separately when calculating the background.
+
+    Steps:
+        The number of frames in the video is divided by the number of backgrounds to find the frames after which each background is taken.
+        Each background includes all frames from the start of the video up to and including the frame after which it is taken. The last background includes every frame.
+        The frames are split at each of these frames, and further split into ranges of roughly equal size.
+
+    Required Arguments:
+        video_total_frames (int) - Total number of frames in the video.
+
+    Optional Arguments:
+        num_backgrounds (int) - Number of backgrounds. Default = 1.
+        n_ranges (int) - Approximate number of ranges to split the frames into. Default = 1.
+
+    Returns:
+        frame_ranges (list) - List of [starting frame, stopping frame, background taken] for each range. Stopping frames are not included in the range.
+    '''
+    # Determine the frames after which to take each background.
+    background_chunk_index = max(int(video_total_frames / num_backgrounds), 1)
+    background_frames = [frame_num for frame_num in range(background_chunk_index, video_total_frames, background_chunk_index)][:num_backgrounds]
+    if len(background_frames) < num_backgrounds:
+        background_frames.append(video_total_frames - 1)
+    background_stopping_frames = [frame_num + 1 for frame_num in background_frames]
+    # Split the frames into ranges of roughly equal size that do not cross any of the frames after which a background is taken.
+    range_size = max(int(np.ceil(video_total_frames / n_ranges)), 1)
+    stopping_frames = sorted(set(background_stopping_frames) | set(range(range_size, video_total_frames, range_size)) | {video_total_frames})
+    frame_ranges = []
+    starting_frame = 0
+    for stopping_frame in stopping_frames:
+        if stopping_frame > starting_frame:
+            frame_ranges.append([starting_frame, stopping_frame, stopping_frame in background_stopping_frames])
+            starting_frame = stopping_frame
+    return frame_ranges
+
+def _calculate_background_in_frame_range(background_params):
+    # Reduce a range of frames into a partial background. Brightest and darkest return the brightest or darkest pixels. Mode and median return a histogram of pixel values for each pixel with 16 bit counts. See background_histogram_max_frames.
+    video_path, method, starting_frame, stopping_frame, frame_stride = background_params
+    capture = cv2.VideoCapture(video_path)
+    # Set the frame position to the first frame of the range.
+    if starting_frame > 0:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, starting_frame)
+    partial_background = None
+    for frame_num in range(starting_frame, stopping_frame):
+        # Skip the frames in between sampled frames without retrieving them.
+        if frame_num % frame_stride != 0:
+            capture.grab()
+            continue
+        # Load frame into memory.
+        success, frame = capture.read()
+        # Check if frame was loaded successfully.
+        if not success:
+            continue
+        # Convert frame to grayscale.
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if partial_background is None:
+            if method in ['brightest', 'darkest']:
+                # Copy the first frame into the background.
+                partial_background = frame.copy()
+                continue
+            # Create an empty histogram with a row of counts for each of the 256 pixel values and the offset of each pixel in a row. Most pixels of a frame are close to the background, so keeping the counts of each pixel value together means that the counts of neighbouring pixels are incremented close together in memory. The range holds at most background_histogram_max_frames sampled frames, so the counts fit into 16 bits, which halves the memory of the histogram and the data sent back to the main process.
+            partial_background = np.zeros((256, frame.size), dtype = np.uint16)
+            histogram_offsets = np.arange(frame.size)
+        if method == 'brightest':
+            # Update the background in place where the pixels in the frame are brighter than the background.
+            cv2.max(partial_background, frame, dst = partial_background)
+        elif method == 'darkest':
+            # Update the background in place where the pixels in the frame are darker than the background.
+            cv2.min(partial_background, frame, dst = partial_background)
+        else:
+            # Count the value of each pixel in the histogram. Each pixel appears once per frame so the counts can be incremented with a single index.
+            partial_background.reshape(-1)[frame.reshape(-1).astype(np.intp) * frame.size + histogram_offsets] += 1
+    capture.release()
+    return partial_background
+
+def merge_partial_backgrounds(background, partial_background, method):
+    # Merge a partial background into the background. Brightest and darkest keep the brightest or darkest pixels. Mode and median add the histograms together. Each partial background is a new array, so the first one becomes the background without a copy.
+    if partial_background is None:
+        return background
+    if background is None:
+        return partial_background
+    if method == 'brightest':
+        cv2.max(background, partial_background, dst = background)
+    elif method == 'darkest':
+        cv2.min(background, partial_background, dst = background)
+    else:
+        # Keep the 16 bit counts of the histograms until the number of merged frames no longer fits into 16 bits. Each pixel is counted once per frame, so the counts of the first pixel add up to the number of frames.
+        if background.dtype == np.uint16 and int(background[:, 0].sum()) + int(partial_background[:, 0].sum()) > background_histogram_max_frames:
+            background = background.astype(np.uint32)
+        background += partial_background
+    return background
+
+def get_background_from_partial_background(background, method, frame_size):
+    # Convert a merged background into a background image. Mode takes the most common value of each pixel and median takes the median value of each pixel.
+    if method in ['brightest', 'darkest']:
+        return background.copy()
+    # Convert the histogram a block of pixels at a time so that only a block of the histogram is copied.
+    n_frames = int(background[:, 0].sum())
+    background_image = np.zeros(background.shape[1], dtype = np.uint8)
+    for block_start in range(0, background.shape[1], background_histogram_block_size):
+        histogram_block = background[:, block_start:block_start + background_histogram_block_size]
+        if method == 'mode':
+            background_image[block_start:block_start + background_histogram_block_size] = np.argmax(histogram_block, axis = 0)
+        else:
+            # Take the first pixel value where at least half of the frames have a value less than or equal to it.
+            background_image[block_start:block_start + background_histogram_block_size] = np.argmax(np.cumsum(histogram_block, axis = 0, dtype = np.uint32) >= (n_frames + 1) // 2, axis = 0)
+    return background_image.reshape(frame_size[1], frame_size[0])
+
+def calculate_background(video_path, method = 'brightest', save_path = None, num_backgrounds = 1, save_background = False, frame_stride = 1, n_processes = None, use_cache = True, cache_path = None, progress_callback = None):
 
     '''
     Function that calculates the background of a video.
 
     Steps:
         A path to the video is provided.
-        OpenCV is used to open the video.
-        The first frame is read into memory.
-        The first frame is copied as the background.
-        Each frame is subsequently iterated through and compared to the current background.
-        Pixels in the frame that are either brighter (default) or darker than the background are used to update the existing background.
+        The background cache is checked for backgrounds that were previously calculated from the same video with the same method, number of backgrounds and frame stride.
+        If the backgrounds are not in the cache, the frames of the video are split into ranges of frames.
+        Each range of frames is reduced into a partial background in a separate process.
+        For brightest (default) and darkest, the partial background contains the brightest or darkest pixels in the range, updated in place for each frame.
+        For mode and median, the partial background contains a histogram of pixel values for each pixel.
+        The partial backgrounds are merged in order. Each background includes all of the frames from the start of the video up to the point where it is taken.
         The final output is an array of background images that are equally spaced throughout the video.
+        The backgrounds are added to the background cache.
 
     Required Arguments:
         video_path (str) - Path to the video.
 
     Optional Arguments:
-        method (str) - Method to use for calculating background. Different types of methods include brightest, darkest and mode. Default = brightest.
+        method (str) - Method to use for calculating background. Different types of methods include brightest, darkest, mode and median. Default = brightest.
+            ** Mode and median keep a histogram of 256 values for each pixel in each process and in the main process, which uses 512 bytes of memory per pixel, or 1 KB per pixel in the main process when more than 65535 frames are sampled.
+            ** The number of processes used for mode and median is reduced when the histograms would not fit into the available memory. See get_background_n_processes.
         num_backgrounds (int) - Number of returned backgrounds. Default = 1.
             ** Useful for long videos when the background illumination fluctuates over time.
         save_background (bool) - Saves the background(s) seperately into external TIFF files. Default = False.
             ** Location of images can be found in path to video.
             ** Name of file will be {name of video}_background.tif
+        frame_stride (int) - Only every nth frame is used to calculate the background. Default = 1.
+            ** Useful for estimating the background of long videos from a fraction of the frames.
+        n_processes (int) - Number of processes used to calculate the background. Default = None.
+            ** When n_processes is None, the number of processes is equal to the number of CPUs.
+            ** When n_processes is 1, the background is calculated in the current process.
+        use_cache (bool) - Loads the background(s) from the background cache if they were previously calculated and adds new backgrounds to the cache. Default = True.
+            ** Videos are identified by their path, size, modification time, number of frames and the contents of a few frames.
+        cache_path (str) - Path to the folder used as the background cache. Default = None.
+            ** When cache_path is None, the cache is located in ~/.free_swimming_tail_tracking/background_cache.
+            ** The least recently used backgrounds are removed when the cache is larger than background_cache_max_size.
+        progress_callback (function) - Function that receives the progress after each range of frames. Default = None.
+            ** When progress_callback is None, the progress is printed. See report_progress.
 
     Returns:
         background_array (list(num_backgrounds, frame width, frame height)) - Array of calculated background images.
@@ -65,8 +442,8 @@ def calculate_background(video_path, method = 'brightest', save_path = None, num
     if not isinstance(video_path, str):
         print('Error: video_path must be formatted as a string.')
         return
-    if not isinstance(method, str) or method not in ['brightest', 'darkest', 'mode']:
-        print('Error: method must be formatted as a string and must be one of the following: brightest, darkest, or mode.')
+    if not isinstance(method, str) or method not in ['brightest', 'darkest', 'mode', 'median']:
+        print('Error: method must be formatted as a string and must be one of the following: brightest, darkest, mode, or median.')
         return
     if not isinstance(num_backgrounds, int):
         print('Error: num_backgrounds must be formatted as an integer.')
@@ -74,72 +451,178 @@ def calculate_background(video_path, method = 'brightest', save_path = None, num
     if not isinstance(save_background, bool):
         print('Error: save_background must be formatted as a boolean (True/False).')
         return
+    if not isinstance(frame_stride, int) or frame_stride < 1:
+        print('Error: frame_stride must be formatted as an integer greater than 0.')
+        return
 
     try:
-        # Load the video.
-        capture = cv2.VideoCapture(video_path)
-        # Initialize background array.
-        background_array = []
-        # Retrieve total number of frames in video.
-        video_total_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
-        # Determine the indices for when to calculate new background.
-        background_chunk_index = int(video_total_frames / num_backgrounds)
-
-        # Iterate through each frame in the video.
-        for frame_num in range(video_total_frames):
-            print('Calculating background. Processing frame number: {0}/{1}.'.format(frame_num + 1, video_total_frames), end = '\r')
-            # Load frame into memory.
-            success, frame = capture.read()
-            # Check if frame was loaded successfully.
-            if success:
-                # Convert frame to grayscale.
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                # Copy frame into background if this is the first frame.
-                if frame_num == 0:
-                    background = frame.copy().astype(np.float32)
-                if method == 'brightest':
-                    # Create a mask where the background is compared to the frame in the loop and used to update the background where the frame is.
-                    mask = np.less(background, frame)
-                    # Update the background image where all of the pixels in the new frame are brighter than the background image.
-                    background[mask] = frame[mask]
-                elif method == 'darkest':
-                    # Create a mask where the background is compared to the frame in the loop and used to update the background where the frame is.
-                    mask = np.greater(background, frame)
-                    # Update the background image where all of the pixels in the new frame are darker than the background image.
-                    background[mask] = frame[mask]
-                # Compare the current number of frames iterated through to the number of backgrounds requested and add the background to the background array.
-                if frame_num > 0 and frame_num % background_chunk_index == 0:
-                    background_array.append(background.astype(np.uint8))
-                elif len(background_array) < num_backgrounds:
-                    if (frame_num + 1) == video_total_frames:
-                        background_array.append(background.astype(np.uint8))
-        print('Calculating background complete. Processing frame number: {0}/{1}.'.format(frame_num + 1, video_total_frames))
+        background_array = None
+        if use_cache:
+            # Load the background(s) from the cache if they have been calculated before.
+            background_cache_file = get_background_cache_file(video_path, method = method, num_backgrounds = num_backgrounds, frame_stride = frame_stride, cache_path = cache_path)
+            background_array = load_background_from_cache(background_cache_file)
+            if background_array is not None:
+                print('Background loaded from cache: {0}'.format(background_cache_file))
+    except:
+        # Calculate the background(s) when the cache can not be used.
+        use_cache = False
+
+    try:
+        if background_array is None:
+            # Retrieve total number of frames and frame size of the video.
+            video_total_frames = get_total_frame_number_from_video(video_path)
+            frame_size = get_frame_size_from_video(video_path)
+            if n_processes is None:
+                n_processes = mp.cpu_count()
+            # Use fewer processes for mode and median when the histograms of every process do not fit into memory.
+            max_n_processes = get_background_n_processes(n_processes, frame_size, method = method)
+            if max_n_processes < n_processes:
+                print('Warning: calculating the background with {0} processes instead of {1} so that the histograms of the pixel values fit into memory.'.format(max_n_processes, n_processes))
+                n_processes = max_n_processes
+            # Split the video into ranges of frames. Each process receives a few ranges so that the progress can be reported. For mode and median, each range returns a histogram that is as large as 512 frames, so each process only receives one range unless the range would hold more frames than the 16 bit counts allow.
+            if method in ['mode', 'median']:
+                n_ranges = max(n_processes, int(np.ceil(video_total_frames / (background_histogram_max_frames * frame_stride))))
+            else:
+                n_ranges = n_processes * 4
+            frame_ranges = get_background_frame_ranges(video_total_frames, num_backgrounds = num_backgrounds, n_ranges = n_ranges)
+            background_params = [[video_path, method, starting_frame, stopping_frame, frame_stride] for starting_frame, stopping_frame, background_taken in frame_ranges]
+            # Initialize background array.
+            background_array = []
+            background = None
+            pool = None
+            if n_processes > 1 and len(frame_ranges) > 1:
+                # Reduce the ranges of frames in separate processes and receive the partial backgrounds in order.
+                pool = mp.Pool(min(n_processes, len(frame_ranges)))
+                partial_backgrounds = pool.imap(_calculate_background_in_frame_range, background_params)
+            else:
+                partial_backgrounds = map(_calculate_background_in_frame_range, background_params)
+            try:
+                for (starting_frame, stopping_frame, background_taken), partial_background in zip(frame_ranges, partial_backgrounds):
+                    report_progress('Calculating background. Processing frame number: {0}/{1}.'.format(stopping_frame, video_total_frames), stopping_frame, video_total_frames, progress_callback = progress_callback, stage = 'background')
+                    background = merge_partial_backgrounds(background, partial_background, method)
+                    # Add the background to the background array at the end of each chunk of frames.
+                    if background_taken and background is not None:
+                        background_array.append(get_background_from_partial_background(background, method, frame_size))
+            finally:
+                if pool is not None:
+                    pool.close()
+                    pool.join()
+            print('Calculating background complete. Processing frame number: {0}/{1}.'.format(video_total_frames, video_total_frames))
+            if len(background_array) == 0:
+                raise ValueError('No frames could be loaded from the video.')
+            if use_cache:
+                # Add the background(s) to the cache.
+                try:
+                    save_background_to_cache(background_array, background_cache_file)
+                except:
+                    print('Warning: the background could not be added to the cache.')
         # Save the background into an external file if requested.
         if save_background:
-            if num_backgrounds == 1:
+            for i in range(len(background_array)):
+                background_name = '{0}_background{1}.tif'.format(os.path.splitext(os.path.basename(video_path))[0], i + 1 if num_backgrounds > 1 else '')
                 if save_path != None:
-                    background_path = '{0}\\{1}_background.tif'.format(save_path, os.path.basename(video_path)[:-4])
+                    background_path = os.path.join(save_path, background_name)
                 else:
-                    background_path = '{0}_background.tif'.format(video_path[:-4])
-                cv2.imwrite(background_path, background_array[0].astype(np.uint8))
-            else:
-                for i in range(len(background_array)):
-                    if save_path != None:
-                        background_path = '{0}\\{1}_background{2}.tif'.format(save_path, os.path.basename(video_path)[:-4], i + 1)
-                    else:
-                        background_path = '{0}_background{1}.tif'.format(video_path[:-4], i + 1)
-                    cv2.imwrite(background_path, background_array[i].astype(np.uint8))
+                    background_path = os.path.join(os.path.dirname(video_path), background_name)
+                cv2.imwrite(background_path, background_array[i].astype(np.uint8))
     except:
         # Errors that may occur during the background calculation are handled.
         print('')
-        if capture.isOpened():
-            capture.release()
-        return [None * num_backgrounds]
-    # Unload video from memory.
-    capture.release()
-    # Return the calculated background(s) as the brightest set of pixels throughout the video. An array is returned to provide the number of backgrounds requested.
+        print('Error: something went wrong while calculating the background!')
+        return [None for i in range(num_backgrounds)]
+    # Return the calculated background(s). An array is returned to provide the number of backgrounds requested.
     return background_array
 
+# Largest distance in pixels between the offsets taken from a table of circle offsets and the offsets calculated for the exact angles. See get_circle_coords.
+circle_offsets_tolerance = 1e-6
+
+@functools.lru_cache(maxsize = 256)
+def get_circle_offsets_table(radius, n_angles, range_angles):
+    # Return a table of the offsets from the centre of a circle to points all around the circle, or None if a table can not be made. The angles of the table are spaced by the angle between the points of an arc, so the points of an arc are consecutive columns of the table once the arc is rotated to the closest angle of the table. The table goes past a full circle by the length of an arc, so arcs that cross zero do not wrap around.
+    table_step = range_angles / (n_angles - 1) if n_angles > 1 else range_angles
+    if not np.isfinite(radius * table_step) or radius * table_step <= 0:
+        return None
+    angles = np.arange(int(np.ceil(2 * np.pi / table_step)) + n_angles) * table_step
+    offsets = np.array([radius * np.sin(angles), radius * np.cos(angles)])
+    offsets.flags.writeable = False
+    return offsets, table_step
+
+def get_circle_offsets(radius, angle, n_angles, range_angles, exact = False):
+    '''
+    Returns the offsets from the centre of a circle to each of the points on an arc of the circle.
+
+    Steps:
+        The points of the arc that starts at the angle of the table closest to the start of the arc are taken from the table of get_circle_offsets_table, which is cached for each radius, number of points and range of angles.
+        The points are rotated by the difference between the start of the arc and the angle of the table.
+
+    Required Arguments:
+        radius (float) - Radius of the circle.
+        angle (float or N) - Angle at the centre of the arc, or of each arc.
+            ** Units in radians.
+        n_angles (int) - Number of points on the arc.
+        range_angles (float) - The entire range of angles covered by the arc.
+            ** Units in radians.
+
+    Optional Arguments:
+        exact (bool) - Boolean to determine whether or not the offsets are calculated for the exact angles of the arc. Default = False.
+            ** When exact is False, the offsets differ from the exact offsets by rounding errors that are much smaller than circle_offsets_tolerance.
+            ** The exact offsets are returned when an angle is given for each arc or when a table can not be made. Calculating the offsets of many arcs at once costs less than rotating each arc from the table.
+
+    Returns:
+        offsets (2, n_angles) or (2, N, n_angles) - Offsets along the y axis, followed by the offsets along the x axis.
+    '''
+    offsets_table = None if exact or np.ndim(angle) > 0 else get_circle_offsets_table(radius, n_angles, range_angles)
+    if offsets_table is None or not math.isfinite(angle):
+        # Calculate list of angles.
+        angles = np.linspace(np.subtract(angle, range_angles / 2), np.add(angle, range_angles / 2), n_angles, axis = np.ndim(angle))
+        # Calculate the offsets of each point on the arc.
+        return np.array([radius * np.sin(angles), radius * np.cos(angles)])
+    table_offsets, table_step = offsets_table
+    # Find the angle of the table that is closest to the start of the arc and the angle left over.
+    start_angle = (angle - range_angles / 2) % (2 * np.pi)
+    table_index = int(round(start_angle / table_step))
+    rotation_angle = start_angle - table_index * table_step
+    # Rotate the points of the arc in the table by the angle left over.
+    cos_rotation = math.cos(rotation_angle)
+    sin_rotation = math.sin(rotation_angle)
+    return np.array([[cos_rotation, sin_rotation], [-sin_rotation, cos_rotation]]) @ table_offsets[:, table_index:table_index + n_angles]
+
+def get_circle_coords(init_coords, radius, angle, n_angles, range_angles):
+    '''
+    Returns the pixel coordinates of each of the points on an arc of a circle.
+
+    Steps:
+        The offsets of the points on the arc are added to the centre of the circle and rounded to the closest pixel.
+        For a single circle, the offsets are taken from the table of circle offsets. If a coordinate is so close to halfway between two pixels that the rounding errors of the offsets of the table could round it to a different pixel, the arc is calculated again with the exact offsets, so the coordinates are always the same as with the exact offsets.
+        For many circles, the exact offsets are calculated for all of the circles at once.
+
+    Required Arguments:
+        init_coords (y, x) or (N, 2) - Coordinates of the centre of the circle, or of each circle.
+        radius (float) - Radius of the circle.
+        angle (float or N) - Angle at the centre of the arc, or of each arc.
+            ** Units in radians.
+        n_angles (int) - Number of points on the arc.
+        range_angles (float) - The entire range of angles covered by the arc.
+            ** Units in radians.
+
+    Returns:
+        next_coords (2, n_angles) or (2, N, n_angles) - Coordinates of the points along the y axis, followed by the coordinates along the x axis.
+    '''
+    init_coords = np.asarray(init_coords, dtype = np.float64)
+    if init_coords.ndim == 2:
+        offsets = get_circle_offsets(radius, angle, n_angles, range_angles, exact = True)
+        if offsets.ndim == 2:
+            offsets = offsets[:, np.newaxis]
+        # The offsets are added to the centre of the circle before rounding so that non-integer centres are handled.
+        return np.round(init_coords.T[:, :, np.newaxis] + offsets).astype(np.int64)
+    init_coords = init_coords[:, np.newaxis]
+    next_coords = init_coords + get_circle_offsets(radius, angle, n_angles, range_angles)
+    rounded_coords = np.round(next_coords)
+    # Calculate the arc again with the exact offsets if any coordinates are close to halfway between two pixels.
+    if np.abs(next_coords - rounded_coords).max() >= 0.5 - circle_offsets_tolerance:
+        rounded_coords = np.round(init_coords + get_circle_offsets(radius, angle, n_angles, range_angles, exact = True))
+    return rounded_coords.astype(np.int64)
+
 def calculate_next_coords(init_coords, radius, frame, angle = 0, n_angles = 20, range_angles = np.pi * 2.0 / 3.0, tail_calculation = True):
     '''
     Function that calculates the next set of coordinates provided an initial set of coordinates, radius, and frame.
@@ -172,33 +655,33 @@ def calculate_next_coords(init_coords, radius, frame, angle = 0, n_angles = 20,
     Returns:
         next_coords (y, x) - The next coordinates in the frame.
     '''
-    # Calculate list of angles.
-    angles = np.linspace(angle - range_angles / 2, angle + range_angles / 2, n_angles)
-    # Calculate list of all potential next coordinates.
-    next_coords = [[int(round(init_coords[0] + (radius * np.sin(angles[i])))), int(round(init_coords[1] + (radius * np.cos(angles[i]))))] for i in range(len(angles))]
-    # Remove duplicate coordinates.
-    next_coords = [next_coords[i] for i in range(len(next_coords)) if next_coords[i][0] != next_coords[i - 1][0] or next_coords[i][1] != next_coords[i - 1][1]]
-    # Get the list of coordinates where the potential next coordinates are the brightest pixels in the frame.
-    coords = np.transpose(np.where(frame == np.max([frame[i[0]][i[1]] for i in next_coords])))
-    # Get only the coordinates that were in the original list.
-    next_coords = [[coords[j] for i in range(len(next_coords)) if coords[j][0] == next_coords[i][0] and coords[j][1] == next_coords[i][1]] for j in range(len(coords))]
-    # Convert the coordinates to lists.
-    next_coords = [next_coords[i][0].tolist() for i in range(len(next_coords)) if len(next_coords[i]) > 0]
+    # Calculate all potential next coordinates from the table of circle offsets.
+    next_coords_y, next_coords_x = get_circle_coords(init_coords, radius, angle, n_angles, range_angles)
+    # Remove duplicate coordinates. Each set of coordinates is compared to the previous set, and the first set is compared to the last.
+    unique_coords = (next_coords_y != np.roll(next_coords_y, 1)) | (next_coords_x != np.roll(next_coords_x, 1))
+    next_coords_y = next_coords_y[unique_coords]
+    next_coords_x = next_coords_x[unique_coords]
+    # Get the pixel values at each of the potential next coordinates.
+    pixel_values = frame[next_coords_y, next_coords_x]
+    # Get only the coordinates that are the brightest. Negative coordinates wrap around when indexing the frame but are never returned.
+    brightest_coords = (pixel_values == np.max(pixel_values)) & (next_coords_y >= 0) & (next_coords_x >= 0)
+    # Remove duplicates and sort the coordinates in the same order as they appear in the frame.
+    next_coords_index = np.unique(next_coords_y[brightest_coords] * frame.shape[1] + next_coords_x[brightest_coords])
+    next_coords_y = next_coords_index // frame.shape[1]
+    next_coords_x = next_coords_index % frame.shape[1]
+    # Take the first set of coordinates by default.
+    index = 0
     # Checks if more than one set of coordinates was found. This can occur if there are multiple pixels with the same (maximum) value.
-    if len(next_coords) > 1:
+    if len(next_coords_index) > 1:
         # Method to use for finding the next point if it is searching along the tail. For tail calculation, if multiple points are returned, then take the point whose angle is most similar to the previous angle.
         if tail_calculation:
-            # Calculate the minimum difference between the angle of the next coordinates and the initial coordinates and the previous angle that was given.
-            min_value = np.min([abs(angle - np.arctan2(next_coords[i][0] - init_coords[0], next_coords[i][1] - init_coords[1])) for i in range(len(next_coords))])
-            # Take the set of coordinates whose angle matches the minimum difference.
-            next_coords = [next_coords[i] for i in range(len(next_coords)) if abs(angle - np.arctan2(next_coords[i][0] - init_coords[0], next_coords[i][1] - init_coords[1])) == min_value]
+            # Take the first set of coordinates with the minimum difference between the angle of the next coordinates and the initial coordinates and the previous angle that was given.
+            index = np.argmin(np.abs(angle - np.arctan2(next_coords_y - init_coords[0], next_coords_x - init_coords[1])))
         else:
-            # Calculate the minimum length between the next coordinates and the initial coordinates.
-            min_value = np.min([np.hypot(next_coords[i][0] - init_coords[0], next_coords[i][1] - init_coords[1]) for i in range(len(next_coords))])
-            # Take the set of coordinates whose length between the next coordinates and previous coordinates matches the minimum length.
-            next_coords = [next_coords[i] for i in range(len(next_coords)) if np.hypot(next_coords[i][0] - init_coords[0], next_coords[i][1] - init_coords[1]) == min_value]
-    # Return the first set of coordinates.
-    return np.array(next_coords[0])
+            # Take the first set of coordinates with the minimum length between the next coordinates and the initial coordinates.
+            index = np.argmin(np.hypot(next_coords_y - init_coords[0], next_coords_x - init_coords[1]))
+    # Return the selected set of coordinates.
+    return np.array([int(next_coords_y[index]), int(next_coords_x[index])])
 
 def save_background_to_file(background, background_path):
     cv2.imwrite(background_path, background.astype(np.uint8))
@@ -210,7 +693,11 @@ def subtract_background_from_frame(frame, background):
 def annotate_tracking_results_onto_frame(frame, results, colours, line_length, extended_eyes_calculation, eyes_line_length):
 
     first_eye_coords, second_eye_coords, first_eye_angle, second_eye_angle, heading_coords, body_coords, heading_angle, tail_point_coords = results
-    annotated_frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB).astype(np.uint8)
+    # Convert grayscale frames to colour frames. Colour frames are copied so that the original frame is not changed.
+    if frame.ndim == 2:
+        annotated_frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB).astype(np.uint8)
+    else:
+        annotated_frame = frame.astype(np.uint8)
     # Check whether to to an additional process to calculate eye angles.
     if extended_eyes_calculation:
         # Draw a circle arround the first eye coordinates.
@@ -280,31 +767,1143 @@ def apply_median_blur_to_frames(frame_array):
     frame_array = [[success, cv2.medianBlur(frame, 3)] if success else [success, frame] for success, frame in frame_array]
     return frame_array
 
+def subtract_background_from_frame_stack(frame_stack, background):
+    # Convert a stack of frames into the absolute difference between each frame and the background. The difference is taken as the maximum minus the minimum so that it stays within uint8.
+    subtracted_frame_stack = np.maximum(frame_stack, background)
+    subtracted_frame_stack -= np.minimum(frame_stack, background)
+    return subtracted_frame_stack
+
+def apply_median_blur_to_frame_stack(frame_stack, valid_frames = None, median_blur_value = 3):
+    # Apply a median blur filter to each frame in a stack of frames in place. Frames that were not loaded successfully are skipped.
+    for i in range(len(frame_stack)):
+        if valid_frames is None or valid_frames[i]:
+            cv2.medianBlur(frame_stack[i], median_blur_value, dst = frame_stack[i])
+    return frame_stack
+
 def load_frames_into_memory(video_path, starting_frame = 0, frame_batch_size = 50, convert_to_grayscale = True):
 
-    # Open the video path.
-    capture = cv2.VideoCapture(video_path)
+    # Open the video path and read the batch of frames sequentially.
+    with FrameReader(video_path, starting_frame = starting_frame, convert_to_grayscale = convert_to_grayscale) as frame_reader:
+        frame_array = frame_reader.read_batch(frame_batch_size)
 
-    # Get the total number of frames in the video.
-    video_n_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    return frame_array
 
-    # Set the frame position to start.
-    capture.set(cv2.CAP_PROP_POS_FRAMES, starting_frame)
+class FrameReader():
+    '''
+    Streaming reader that keeps a single video capture open and returns frames in order.
 
-    frame_array = []
-    # Load frames into memory.
-    for i in range(frame_batch_size):
-        success, original_frame = capture.read()
-        frame = original_frame.astype(np.uint8).copy()
-        if success and convert_to_grayscale:
-            frame = cv2.cvtColor(original_frame, cv2.COLOR_BGR2GRAY).astype(np.uint8)
-        frame_array.append([success, frame])
+    Steps:
+        The video is opened once and the frame position is set to the starting frame.
+        Each call to read decodes the next frame in the video.
+        The frame is converted to grayscale.
+        If a background is provided, the frame is converted into the absolute difference between the frame and the background and a median blur filter is applied.
 
-    capture.release()
+    Required Arguments:
+        video_path (str) - Path to the video.
 
-    return frame_array
+    Optional Arguments:
+        starting_frame (int) - Frame number at which to start reading. Default = 0.
+        n_frames (int) - Number of frames to read. Default = None.
+            ** When n_frames is None, frames are read until the end of the video.
+        background (frame width, frame height) - Background that is subtracted from each frame. Default = None.
+            ** When background is None, frames are returned without background subtraction or median blur.
+        median_blur_value (int) - Aperture size of the median blur filter applied to background subtracted frames. Default = 3.
+            ** When median_blur_value is 0, the median blur filter is not applied.
+        convert_to_grayscale (bool) - Boolean to determine whether or not frames are converted to grayscale. Default = True.
+            ** Background subtraction requires grayscale frames.
+        profiler (TrackingProfiler) - Profiler that times decoding and preprocessing each frame. Default = None.
+
+    Usage:
+        with FrameReader(video_path, background = background) as frame_reader:
+            for success, frame in frame_reader:
+                ...
+    '''
+
+    def __init__(self, video_path, starting_frame = 0, n_frames = None, background = None, median_blur_value = 3, convert_to_grayscale = True, profiler = None):
+        self.video_path = video_path
+        self.background = background
+        self.profiler = profiler
+        self.median_blur_value = median_blur_value
+        self.convert_to_grayscale = convert_to_grayscale
+        # Open the video path.
+        self.capture = cv2.VideoCapture(video_path)
+        # Get the total number of frames in the video.
+        self.video_n_frames = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        if starting_frame > self.video_n_frames:
+            starting_frame = self.video_n_frames
+        # Set the frame position to start. This is the only seek performed by the reader.
+        if starting_frame > 0:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, starting_frame)
+        self.frame_number = starting_frame
+        # Get the size of the frames.
+        self.frame_size = (int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        if n_frames is None or starting_frame + n_frames > self.video_n_frames:
+            self.stopping_frame = self.video_n_frames
+        else:
+            self.stopping_frame = starting_frame + n_frames
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def __iter__(self):
+        while self.frame_number < self.stopping_frame:
+            yield self.read()
+
+    def __len__(self):
+        return max(self.stopping_frame - self.frame_number, 0)
+
+    def preprocess_frame(self, original_frame):
+        frame = original_frame
+        profiler = self.profiler
+        if profiler is not None:
+            t = time.perf_counter()
+        # Convert the original frame to grayscale.
+        if self.convert_to_grayscale and frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            if profiler is not None:
+                t = profiler.add_time('grayscale', t)
+        if self.background is not None:
+            # Convert the frame into the absolute difference between the frame and the background.
+            frame = cv2.absdiff(frame, self.background)
+            if profiler is not None:
+                t = profiler.add_time('absdiff', t)
+            # Apply a median blur filter to the frame.
+            if self.median_blur_value > 0:
+                frame = cv2.medianBlur(frame, self.median_blur_value)
+                if profiler is not None:
+                    profiler.add_time('median_blur', t)
+        return frame
+
+    def read(self, return_original_frame = False):
+        success = False
+        original_frame = None
+        frame = None
+        # Load the next frame into memory if there are frames remaining.
+        if self.frame_number < self.stopping_frame:
+            if self.profiler is not None:
+                t = time.perf_counter()
+            success, original_frame = self.capture.read()
+            if self.profiler is not None:
+                self.profiler.add_time('decode', t)
+            self.frame_number += 1
+        # Checks if the frame was loaded successfully.
+        if success and original_frame is not None:
+            frame = self.preprocess_frame(original_frame)
+        else:
+            success = False
+        if return_original_frame:
+            return success, frame, original_frame
+        return success, frame
+
+    def read_batch(self, frame_batch_size):
+        # Load a batch of frames into memory as a list of [success, frame] pairs.
+        frame_array = [list(self.read()) for i in range(frame_batch_size)]
+        return frame_array
+
+    def read_stack(self, frame_batch_size, frame_stack = None):
+        # Load a batch of grayscale frames into a contiguous stack of frames. Returns the stack and a mask of the frames that were loaded successfully.
+        if frame_stack is None:
+            frame_stack = np.zeros((frame_batch_size, self.frame_size[1], self.frame_size[0]), dtype = np.uint8)
+        valid_frames = np.zeros(frame_batch_size, dtype = bool)
+        for i in range(frame_batch_size):
+            success, frame = self.read()
+            if success and frame.shape == frame_stack.shape[1:]:
+                frame_stack[i] = frame
+                valid_frames[i] = True
+        return frame_stack, valid_frames
+
+    def release(self):
+        # Unload the video from memory.
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+
+class FramePrefetcher():
+    '''
+    Reads frames ahead of time in a separate thread so that decoding the video overlaps with tracking.
+
+    Steps:
+        A FrameReader is opened and a reader thread decodes and preprocesses frames into a queue.
+        When the queue is full, the reader thread waits until frames are taken from the queue.
+        Each call to read returns the next frame in the queue, in the same format as FrameReader.read.
+
+    Required Arguments:
+        video_path (str) - Path to the video.
+
+    Optional Arguments:
+        starting_frame (int) - Frame number at which to start reading. Default = 0.
+        n_frames (int) - Number of frames to read. Default = None.
+            ** When n_frames is None, frames are read until the end of the video.
+        background (frame width, frame height) - Background that is subtracted from each frame. Default = None.
+        median_blur_value (int) - Aperture size of the median blur filter applied to background subtracted frames. Default = 3.
+        convert_to_grayscale (bool) - Boolean to determine whether or not frames are converted to grayscale. Default = True.
+        queue_depth (int) - Maximum number of frames that are read ahead. Default = 16.
+            ** Each frame in the queue holds both the original frame and the preprocessed frame in memory.
+        profiler (TrackingProfiler) - Profiler that times decoding and preprocessing each frame in the reader thread. Default = None.
+
+    Usage:
+        with FramePrefetcher(video_path, background = background) as frame_reader:
+            for success, frame in frame_reader:
+                ...
+    '''
+
+    def __init__(self, video_path, starting_frame = 0, n_frames = None, background = None, median_blur_value = 3, convert_to_grayscale = True, queue_depth = 16, profiler = None):
+        self.frame_reader = FrameReader(video_path, starting_frame = starting_frame, n_frames = n_frames, background = background, median_blur_value = median_blur_value, convert_to_grayscale = convert_to_grayscale, profiler = profiler)
+        self.frame_size = self.frame_reader.frame_size
+        self.video_n_frames = self.frame_reader.video_n_frames
+        self.n_frames_remaining = len(self.frame_reader)
+        self.frame_queue = queue.Queue(maxsize = max(queue_depth, 1))
+        self.stop_event = threading.Event()
+        self.finished = False
+        self.error = None
+        # Start reading frames. OpenCV releases the GIL while decoding, so the reader thread runs alongside the tracking thread.
+        self.thread = threading.Thread(target = self._read_frames, daemon = True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def __iter__(self):
+        while self.n_frames_remaining > 0:
+            yield self.read()
+
+    def __len__(self):
+        return self.n_frames_remaining
+
+    def _put(self, item):
+        # Wait until there is space in the queue or the prefetcher is released.
+        while not self.stop_event.is_set():
+            try:
+                self.frame_queue.put(item, timeout = 0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _read_frames(self):
+        try:
+            while len(self.frame_reader) > 0 and not self.stop_event.is_set():
+                if not self._put(self.frame_reader.read(return_original_frame = True)):
+                    break
+        except Exception as error:
+            # Errors are raised in the thread that reads from the queue.
+            self.error = error
+        finally:
+            # Signal the end of the frames.
+            self._put(None)
+
+    def read(self, return_original_frame = False):
+        success, frame, original_frame = False, None, None
+        if not self.finished:
+            item = self.frame_queue.get()
+            if item is None:
+                self.finished = True
+                if self.error is not None:
+                    raise self.error
+            else:
+                success, frame, original_frame = item
+                self.n_frames_remaining -= 1
+        if return_original_frame:
+            return success, frame, original_frame
+        return success, frame
+
+    def release(self):
+        # Stop the reader thread and unload the video from memory once the thread has stopped using it.
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.frame_reader.release()
+
+# Default location and maximum size of the frame cache. The least recently used sidecar files of decoded frames are removed when the cache grows larger than the maximum size.
+frame_cache_path = os.path.join(os.path.expanduser('~'), '.free_swimming_tail_tracking', 'frame_cache')
+frame_cache_max_size = 16 * 1024 * 1024 * 1024
+
+# Width of the frames of proxy videos. Videos that are not wider than this do not need a proxy video.
+default_proxy_width = 480
+
+def get_frame_cache_file(video_path, cache_path = None, convert_to_grayscale = True, proxy_width = None):
+    # Return the path of the sidecar file in the cache which contains the decoded frames of a video.
+    if cache_path is None:
+        cache_path = frame_cache_path
+    return os.path.join(cache_path, '{0}{1}{2}.npy'.format(get_video_fingerprint(video_path), '' if proxy_width is None else '_proxy{0}'.format(proxy_width), '' if convert_to_grayscale else '_colour'))
+
+def get_proxy_file(video_path, proxy_width, convert_to_grayscale = True):
+    # Return the path of the proxy video of a video, which is saved next to the video.
+    return os.path.join(os.path.dirname(os.path.abspath(video_path)), '{0}_proxy{1}{2}.npy'.format(os.path.splitext(os.path.basename(video_path))[0], proxy_width, '' if convert_to_grayscale else '_colour'))
+
+def get_proxy_frame_size(frame_size, proxy_width):
+    # Return the size of the frames of a proxy video. The aspect ratio of the frames is kept and frames are never enlarged.
+    frame_width, frame_height = frame_size
+    if proxy_width is None or proxy_width >= frame_width:
+        return frame_width, frame_height
+    return proxy_width, max(int(round(frame_height * proxy_width / frame_width)), 1)
+
+class FrameCache():
+    '''
+    Cache of decoded frames that gives fast random access to the frames of videos. A single cache can be shared by every part of a program that displays frames.
+
+    Steps:
+        Each video is opened once and its video capture is kept open. A frame that follows the previously read frame is decoded without seeking.
+        The cache is only locked while frames are looked up or added. Frames are decoded under a separate lock for each video capture, so that threads can decode frames of different videos at the same time.
+        Decoded frames are kept in memory. The least recently used frames are removed when the frames take up more than max_memory.
+        Optionally, every frame of a video is decoded once in a separate thread into a raw sidecar file that is memory-mapped. Frames that are in the sidecar file are read from it instead of being decoded.
+        Sidecar files can hold the frames at full resolution, which are kept in the cache folder, or downscaled to a proxy width, which are kept next to the video as a proxy video.
+
+    Optional Arguments:
+        max_memory (int) - Maximum number of bytes of decoded frames that are kept in memory. Default = 256 MB.
+        cache_path (str) - Path to the folder that contains the full resolution sidecar files. Default = None.
+            ** When cache_path is None, cache_path = frame_cache_path.
+            ** Proxy videos are also saved into the cache folder when the folder of the video cannot be written to.
+        max_cache_size (int) - Maximum number of bytes of sidecar files that are kept in the cache folder. Default = None.
+            ** When max_cache_size is None, max_cache_size = frame_cache_max_size.
+
+    Usage:
+        frame_cache = FrameCache()
+        success, frame = frame_cache.load_frame(video_path, frame_number)
+        frame_cache.build_sidecar(video_path, proxy_width = default_proxy_width)
+        success, proxy_frame = frame_cache.load_frame(video_path, frame_number, proxy_width = default_proxy_width)
+        ...
+        frame_cache.release()
+    '''
+
+    def __init__(self, max_memory = 256 * 1024 * 1024, cache_path = None, max_cache_size = None):
+        self.max_memory = max_memory
+        self.cache_path = frame_cache_path if cache_path is None else cache_path
+        self.max_cache_size = frame_cache_max_size if max_cache_size is None else max_cache_size
+        # Decoded frames in order of use, with the least recently used frame first.
+        self.frames = collections.OrderedDict()
+        self.memory = 0
+        # Open video captures of each video and sidecar files of each video, colour mode and proxy width.
+        self.captures = {}
+        self.sidecars = {}
+        # The lock of the cache only guards the frames, video captures and sidecar files held by the cache. Each video capture has its own lock that is held while frames are decoded, so that frames of different videos are decoded at the same time.
+        self.lock = threading.RLock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def _read_frame(self, video_path, frame_number):
+        # Decode a frame with the open video capture of the video. Only seek when the frame does not follow the previously read frame. The video capture is opened the first time a frame of the video is read.
+        while True:
+            with self.lock:
+                if video_path not in self.captures:
+                    self.captures[video_path] = {'capture' : None, 'video_n_frames' : 0, 'next_frame' : 0, 'lock' : threading.Lock()}
+                capture_info = self.captures[video_path]
+            with capture_info['lock']:
+                if capture_info['next_frame'] is None:
+                    # The video was released while waiting for the lock of the video capture, so open the video again.
+                    continue
+                if capture_info['capture'] is None:
+                    capture_info['capture'] = cv2.VideoCapture(video_path)
+                    capture_info['video_n_frames'] = int(capture_info['capture'].get(cv2.CAP_PROP_FRAME_COUNT))
+                if frame_number > capture_info['video_n_frames']:
+                    frame_number = capture_info['video_n_frames']
+                if frame_number != capture_info['next_frame']:
+                    capture_info['capture'].set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+                success, original_frame = capture_info['capture'].read()
+                capture_info['next_frame'] = frame_number + 1 if success else -1
+            return success, original_frame
+
+    def load_frame(self, video_path, frame_number = 0, convert_to_grayscale = True, proxy_width = None):
+        '''
+        Loads a frame of a video from the cache, or decodes it and adds it to the cache.
+
+        Required Arguments:
+            video_path (str) - Path to the video.
+
+        Optional Arguments:
+            frame_number (int) - Frame number to load. Default = 0.
+            convert_to_grayscale (bool) - Boolean to determine whether or not the frame is converted to grayscale. Default = True.
+            proxy_width (int) - Width of the frame of the proxy video to load. Default = None.
+                ** When proxy_width is None, the frame is loaded at full resolution.
+                ** Frames that are not in the proxy video yet are decoded and downscaled, so that frames always have the size of the proxy video.
+
+        Returns:
+            success (bool) - Boolean that indicates whether or not the frame was loaded.
+            frame (frame width, frame height) or (frame width, frame height, 3) - Copy of the frame. None if the frame was not loaded.
+                ** Same as load_frame_into_memory.
+        '''
+        key = (video_path, frame_number, convert_to_grayscale, proxy_width)
+        sidecar_frames = None
+        with self.lock:
+            # Return a frame that was decoded before.
+            if key in self.frames:
+                self.frames.move_to_end(key)
+                return True, self.frames[key].copy()
+            # Find frames that have been written into the sidecar file.
+            sidecar = self.sidecars.get((video_path, convert_to_grayscale, proxy_width))
+            if sidecar is not None and 0 <= frame_number < sidecar['n_frames']:
+                sidecar_frames = sidecar['frames']
+        # Read, decode and convert the frame outside of the lock of the cache.
+        if sidecar_frames is not None:
+            return True, np.array(sidecar_frames[frame_number])
+        success, original_frame = self._read_frame(video_path, frame_number)
+        if not success or original_frame is None:
+            return False, None
+        if convert_to_grayscale:
+            frame = cv2.cvtColor(original_frame, cv2.COLOR_BGR2GRAY)
+        else:
+            frame = original_frame
+        if proxy_width is not None:
+            frame = cv2.resize(frame, get_proxy_frame_size((frame.shape[1], frame.shape[0]), proxy_width), interpolation = cv2.INTER_AREA)
+        with self.lock:
+            # Another thread may have added the same frame to the cache in the meantime.
+            if key in self.frames:
+                self.frames.move_to_end(key)
+                return True, frame.copy()
+            # Add the frame to the cache and remove the least recently used frames.
+            self.frames[key] = frame
+            self.memory += frame.nbytes
+            while self.memory > self.max_memory and len(self.frames) > 1:
+                _, removed_frame = self.frames.popitem(last = False)
+                self.memory -= removed_frame.nbytes
+            return True, frame.copy()
+
+    def _open_sidecar(self, sidecar_file, video_n_frames):
+        # Memory-map a complete sidecar file. Returns None if the sidecar file is missing, unreadable or does not have a frame for every frame of the video.
+        if not os.path.isfile(sidecar_file):
+            return None
+        try:
+            frames = np.load(sidecar_file, mmap_mode = 'r')
+        except (OSError, ValueError):
+            return None
+        if frames.shape[0] != video_n_frames:
+            return None
+        # Update the modification time of the file so that recently used sidecar files are removed from the cache last.
+        os.utime(sidecar_file)
+        return frames
+
+    def _get_sidecar_files(self, video_path, convert_to_grayscale, proxy_width):
+        # Yield the paths at which the sidecar file of a video is looked for, in order. Proxy videos are kept next to the video, or in the cache folder if the folder of the video cannot be written to. The path in the cache folder is only worked out when it is needed because it reads frames of the video.
+        if proxy_width is not None:
+            yield get_proxy_file(video_path, proxy_width, convert_to_grayscale = convert_to_grayscale)
+        yield get_frame_cache_file(video_path, cache_path = self.cache_path, convert_to_grayscale = convert_to_grayscale, proxy_width = proxy_width)
+
+    def build_sidecar(self, video_path, threaded = True, convert_to_grayscale = True, proxy_width = None):
+        '''
+        Decodes every frame of a video into a memory-mapped raw sidecar file.
+
+        Steps:
+            If a complete sidecar file for the video is found, it is memory-mapped and used straight away.
+            Otherwise, the space needed for the sidecar file is checked. For full resolution sidecar files, the least recently used sidecar files are removed from the cache folder to make room.
+            The frames are decoded in order, downscaled if a proxy width is given, and written into a temporary sidecar file. Frames are read from the sidecar file as soon as they have been written.
+            Once every frame has been written, the temporary file is renamed so that it can be used again the next time the video is opened.
+
+        Required Arguments:
+            video_path (str) - Path to the video.
+
+        Optional Arguments:
+            threaded (bool) - Boolean to determine whether or not the sidecar file is built in a separate thread. Default = True.
+            convert_to_grayscale (bool) - Boolean to determine whether or not frames are converted to grayscale. Default = True.
+            proxy_width (int) - Width of the frames of a proxy video. Default = None.
+                ** When proxy_width is None, frames are kept at full resolution in the cache folder.
+                ** Proxy videos are saved next to the video with get_proxy_file. A proxy video is rebuilt if the video was modified after the proxy video.
+
+        Returns:
+            success (bool) - Boolean that indicates whether or not the sidecar file is being built or was found.
+        '''
+        sidecar_key = (video_path, convert_to_grayscale, proxy_width)
+        with self.lock:
+            if sidecar_key in self.sidecars:
+                return True
+        video_n_frames = get_total_frame_number_from_video(video_path)
+        frame_width, frame_height = get_proxy_frame_size(get_frame_size_from_video(video_path), proxy_width)
+        frame_shape = (video_n_frames, frame_height, frame_width) if convert_to_grayscale else (video_n_frames, frame_height, frame_width, 3)
+        sidecar_size = int(np.prod(frame_shape))
+        for sidecar_file in self._get_sidecar_files(video_path, convert_to_grayscale, proxy_width):
+            if proxy_width is not None and os.path.isfile(sidecar_file) and os.path.getmtime(sidecar_file) < os.path.getmtime(video_path):
+                continue
+            # Use the sidecar file that was built before.
+            frames = self._open_sidecar(sidecar_file, video_n_frames)
+            if frames is not None:
+                with self.lock:
+                    self.sidecars[sidecar_key] = {'frames' : frames, 'n_frames' : frames.shape[0], 'sidecar_file' : sidecar_file, 'thread' : None, 'stop_event' : threading.Event()}
+                return True
+        if video_n_frames == 0 or (proxy_width is None and sidecar_size > self.max_cache_size):
+            print('Error: the frames of the video do not fit into the frame cache. Frame cache size: {0} bytes. Frames size: {1} bytes.'.format(self.max_cache_size, sidecar_size))
+            return False
+        frames = None
+        for sidecar_file in self._get_sidecar_files(video_path, convert_to_grayscale, proxy_width):
+            sidecar_path = os.path.dirname(sidecar_file)
+            try:
+                os.makedirs(sidecar_path, exist_ok = True)
+                if os.path.abspath(sidecar_path) == os.path.abspath(self.cache_path):
+                    # Make room for the sidecar file.
+                    evict_cache_folder(self.cache_path, max(self.max_cache_size - sidecar_size, 0))
+                if shutil.disk_usage(sidecar_path).free < sidecar_size:
+                    continue
+                frames = np.lib.format.open_memmap('{0}.partial'.format(sidecar_file), mode = 'w+', dtype = np.uint8, shape = frame_shape)
+                break
+            except OSError:
+                continue
+        if frames is None:
+            print('Error: there is not enough disk space to build the frame cache. Frames size: {0} bytes.'.format(sidecar_size))
+            return False
+        sidecar = {'frames' : frames, 'n_frames' : 0, 'sidecar_file' : sidecar_file, 'thread' : None, 'stop_event' : threading.Event()}
+        with self.lock:
+            self.sidecars[sidecar_key] = sidecar
+        if threaded:
+            sidecar['thread'] = threading.Thread(target = self._build_sidecar, args = (video_path, sidecar, convert_to_grayscale), daemon = True)
+            sidecar['thread'].start()
+        else:
+            self._build_sidecar(video_path, sidecar, convert_to_grayscale)
+        return True
+
+    def _build_sidecar(self, video_path, sidecar, convert_to_grayscale):
+        # Decode the frames in order into the sidecar file. The number of frames in the sidecar file is updated after each frame so that the frames can be read while the sidecar file is built.
+        frames = sidecar['frames']
+        with FrameReader(video_path, convert_to_grayscale = convert_to_grayscale) as frame_reader:
+            for frame_number in range(frames.shape[0]):
+                if sidecar['stop_event'].is_set():
+                    return
+                success, frame = frame_reader.read()
+                if success and frame.shape[:2] != frames.shape[1:3]:
+                    frame = cv2.resize(frame, (frames.shape[2], frames.shape[1]), interpolation = cv2.INTER_AREA)
+                if not success or frame.shape != frames.shape[1:]:
+                    # Keep the frames that were decoded for as long as the video stays open, but do not reuse an incomplete sidecar file.
+                    return
+                frames[frame_number] = frame
+                sidecar['n_frames'] = frame_number + 1
+        frames.flush()
+        with self.lock:
+            # Replace the writable sidecar file with a read-only sidecar file once every frame has been written.
+            temporary_file = frames.filename
+            del frames
+            sidecar['frames'] = None
+            sidecar['n_frames'] = 0
+            os.replace(temporary_file, sidecar['sidecar_file'])
+            sidecar['frames'] = np.load(sidecar['sidecar_file'], mmap_mode = 'r')
+            sidecar['n_frames'] = sidecar['frames'].shape[0]
+
+    def get_sidecar(self, video_path, convert_to_grayscale = True, proxy_width = None):
+        # Return the memory-mapped frames of a complete sidecar file. Returns None if the sidecar file is not complete.
+        with self.lock:
+            sidecar = self.sidecars.get((video_path, convert_to_grayscale, proxy_width))
+            if sidecar is None or sidecar['frames'] is None or sidecar['n_frames'] < sidecar['frames'].shape[0]:
+                return None
+            return sidecar['frames']
+
+    def get_sidecar_progress(self, video_path, convert_to_grayscale = True, proxy_width = None):
+        # Return the fraction of the frames of a video that have been written into its sidecar file. Returns None if no sidecar file is used for the video.
+        with self.lock:
+            sidecar = self.sidecars.get((video_path, convert_to_grayscale, proxy_width))
+            if sidecar is None:
+                return None
+            if sidecar['frames'] is None:
+                return 1.0
+            return sidecar['n_frames'] / max(sidecar['frames'].shape[0], 1)
+
+    def release(self, video_path = None):
+        '''
+        Closes the video captures and sidecar files and removes the frames from memory.
+
+        Optional Arguments:
+            video_path (str) - Path to the video to release. Default = None.
+                ** When video_path is None, every video is released.
+                ** A sidecar file that is still being built is removed.
+        '''
+        with self.lock:
+            video_paths = list(set(self.captures) | set([sidecar_key[0] for sidecar_key in self.sidecars])) if video_path is None else [video_path]
+            sidecars = [self.sidecars.pop(sidecar_key) for sidecar_key in list(self.sidecars) if sidecar_key[0] in video_paths]
+            captures = [self.captures.pop(path) for path in video_paths if path in self.captures]
+        # Wait for frames that are being decoded before closing the video captures.
+        for capture_info in captures:
+            with capture_info['lock']:
+                if capture_info['capture'] is not None:
+                    capture_info['capture'].release()
+                capture_info['capture'] = None
+                capture_info['next_frame'] = None
+        # Stop building the sidecar files outside of the lock so that the threads can finish.
+        for sidecar in sidecars:
+            sidecar['stop_event'].set()
+            if sidecar['thread'] is not None and sidecar['thread'].is_alive():
+                sidecar['thread'].join()
+        with self.lock:
+            for sidecar in sidecars:
+                frames = sidecar['frames']
+                sidecar['frames'] = None
+                if frames is not None and frames.filename is not None and frames.filename.endswith('.partial'):
+                    temporary_file = frames.filename
+                    del frames
+                    try:
+                        os.remove(temporary_file)
+                    except OSError:
+                        pass
+            for key in [key for key in self.frames if key[0] in video_paths]:
+                self.memory -= self.frames.pop(key).nbytes
+
+class FrameStackCapture():
+    # Reads frames in order from an array of frames with the same methods as cv2.VideoCapture.
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.frame_number = 0
+
+    def set(self, property_id, value):
+        if property_id == cv2.CAP_PROP_POS_FRAMES:
+            self.frame_number = int(value)
+        return True
+
+    def grab(self):
+        success = self.frame_number < len(self.frames)
+        self.frame_number += success
+        return success
+
+    def read(self):
+        if self.frame_number >= len(self.frames):
+            return False, None
+        frame = np.array(self.frames[self.frame_number])
+        self.frame_number += 1
+        return True, frame
+
+    def release(self):
+        self.frames = None
+
+# Range of playback speeds, as multiples of the fps of the video.
+min_playback_speed = 0.1
+max_playback_speed = 10
+
+class PlaybackEngine():
+    '''
+    Plays a video in real time by reading its frames in order in a separate thread and releasing each frame when it is due.
+
+    Steps:
+        A reader thread opens the video once, seeks to the starting frame and reads the frames in order into a bounded queue.
+        Each frame is due at a time given by a monotonic clock, the number of frames played since the clock started and the playback rate (playback speed x video fps).
+        When the reader thread falls behind the clock, frames are skipped without being retrieved. When the queue is full, the reader thread waits.
+        Each call to get_frame returns the latest frame that is due. Older frames that are due are dropped, so that playback keeps up with the clock when rendering the frames falls behind.
+        The number of frames returned per second is measured and reported as the achieved fps.
+        A single engine can be shared by every part of a program that plays videos. Starting a video stops the video that was playing.
+
+    Optional Arguments:
+        queue_depth (int) - Maximum number of frames that are read ahead. Default = 8.
+        fps_window (float) - Number of seconds over which the achieved fps is measured. Default = 1.
+
+    Usage:
+        playback_engine = PlaybackEngine()
+        playback_engine.start(video_path, starting_frame = 0, playback_speed = 1)
+        # Called by a timer.
+        frame_number, frame = playback_engine.get_frame()
+        ...
+        playback_engine.stop()
+    '''
+
+    def __init__(self, queue_depth = 8, fps_window = 1):
+        self.queue_depth = max(queue_depth, 1)
+        self.fps_window = fps_window
+        self.video_path = None
+        self.video_fps = None
+        self.playback_speed = 1
+        self.loop = True
+        self.convert_to_grayscale = True
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.condition = threading.Condition()
+        self.frame_queue = collections.deque()
+        self.finished = False
+        self.reset_statistics()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def reset_statistics(self):
+        # Reset the counts of frames and the times at which frames were returned.
+        self.n_played_frames = 0
+        self.n_dropped_frames = 0
+        self.n_skipped_frames = 0
+        self.played_frame_times = collections.deque()
+
+    def is_playing(self, video_path = None):
+        # Check whether a video is playing. If a video path is given, check whether that video is playing.
+        playing = self.thread is not None and not self.finished
+        if video_path is not None:
+            playing = playing and self.video_path == video_path
+        return playing
+
+    def get_playback_rate(self):
+        # Return the number of frames per second at which the video is played.
+        return self.playback_speed * self.video_fps
+
+    def set_clock(self, play_index):
+        # Start the clock so that the frame with the play index is due now. The play index counts the frames from the starting frame and keeps counting when the video starts again from the first frame.
+        self.clock_start_time = time.monotonic()
+        self.clock_start_index = play_index
+
+    def get_due_time(self, play_index):
+        # Return the time at which the frame with the play index is due.
+        return self.clock_start_time + (play_index - self.clock_start_index) / self.get_playback_rate()
+
+    def set_playback_speed(self, playback_speed):
+        # Change the playback speed. The clock restarts from the frame after the last frame that was returned so that playback continues from the same frame.
+        with self.condition:
+            self.playback_speed = min(max(playback_speed, min_playback_speed), max_playback_speed)
+            if self.is_playing():
+                self.set_clock(self.last_play_index + 1)
+                self.played_frame_times.clear()
+
+    def start(self, video_path, starting_frame = 0, playback_speed = 1, video_fps = None, loop = True, convert_to_grayscale = True, frames = None):
+        '''
+        Starts playing a video. The video that was playing is stopped.
+
+        Required Arguments:
+            video_path (str) - Path to the video.
+
+        Optional Arguments:
+            starting_frame (int) - Frame number at which to start playing. Default = 0.
+            playback_speed (float) - Playback speed as a multiple of the fps of the video. Default = 1.
+                ** The playback speed is clipped to between min_playback_speed and max_playback_speed.
+            video_fps (float) - FPS of the video. Default = None.
+                ** When video_fps is None, video_fps = the fps of the video.
+            loop (bool) - Boolean to determine whether or not the video starts again from the first frame after the last frame. Default = True.
+            convert_to_grayscale (bool) - Boolean to determine whether or not frames are converted to grayscale. Default = True.
+            frames (N, frame height, frame width) or (N, frame height, frame width, 3) - Frames that are played instead of decoding the video. Default = None.
+                ** Use to play a proxy video from FrameCache.get_sidecar. Skipped frames are not read.
+        '''
+        self.stop()
+        if video_fps is None:
+            video_fps = get_fps_from_video(video_path)
+        if not video_fps or video_fps <= 0:
+            print('Error: the fps of the video could not be found. Video path: {0}.'.format(video_path))
+            return
+        self.video_path = video_path
+        self.video_fps = video_fps
+        self.playback_speed = min(max(playback_speed, min_playback_speed), max_playback_speed)
+        self.loop = loop
+        self.convert_to_grayscale = convert_to_grayscale
+        self.finished = False
+        self.frame_queue.clear()
+        self.reset_statistics()
+        self.last_play_index = -1
+        self.set_clock(0)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target = self._read_frames, args = (video_path, starting_frame, self.stop_event, frames), daemon = True)
+        self.thread.start()
+
+    def _read_frames(self, video_path, starting_frame, stop_event, frames = None):
+        # Read the frames in order from a single video capture, or from the frames that were given. Frames that are already late are skipped without being retrieved.
+        if frames is None:
+            capture = cv2.VideoCapture(video_path)
+            video_n_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        else:
+            capture = FrameStackCapture(frames)
+            video_n_frames = len(frames)
+        frame_number = min(max(starting_frame, 0), max(video_n_frames - 1, 0))
+        if frame_number > 0:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+        play_index = 0
+        try:
+            while not stop_event.is_set():
+                with self.condition:
+                    # Wait until there is space in the queue.
+                    while len(self.frame_queue) >= self.queue_depth and not stop_event.is_set():
+                        self.condition.wait(0.1)
+                    late = time.monotonic() > self.get_due_time(play_index + 1)
+                if stop_event.is_set():
+                    break
+                if late and frame_number + 1 < video_n_frames:
+                    # Skip the frame without retrieving it.
+                    success = capture.grab()
+                    frame = None
+                    self.n_skipped_frames += 1
+                else:
+                    success, frame = capture.read()
+                if not success:
+                    if not self.loop or frame_number == 0:
+                        break
+                    # Start again from the first frame.
+                    capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    frame_number = 0
+                    continue
+                if frame is not None:
+                    if self.convert_to_grayscale and frame.ndim == 3:
+                        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                    with self.condition:
+                        if stop_event.is_set():
+                            break
+                        self.frame_queue.append((frame_number, play_index, frame))
+                frame_number += 1
+                play_index += 1
+        finally:
+            capture.release()
+            with self.condition:
+                # Signal the end of the frames.
+                if not stop_event.is_set():
+                    self.frame_queue.append(None)
+                self.condition.notify_all()
+
+    def get_frame(self):
+        '''
+        Returns the latest frame that is due. Older frames that are due are dropped.
+
+        Returns:
+            frame_number (int) - Frame number of the frame. None if no frame is due.
+            frame (frame width, frame height) or (frame width, frame height, 3) - The frame. None if no frame is due.
+        '''
+        frame_number, frame = None, None
+        with self.condition:
+            now = time.monotonic()
+            while len(self.frame_queue) > 0 and (self.frame_queue[0] is None or self.get_due_time(self.frame_queue[0][1]) <= now):
+                item = self.frame_queue.popleft()
+                if item is None:
+                    self.finished = True
+                    break
+                if frame is not None:
+                    self.n_dropped_frames += 1
+                frame_number, play_index, frame = item
+            self.condition.notify_all()
+            if frame is not None:
+                self.last_play_index = play_index
+                self.n_played_frames += 1
+                self.played_frame_times.append(now)
+                while now - self.played_frame_times[0] > self.fps_window:
+                    self.played_frame_times.popleft()
+        return frame_number, frame
+
+    def get_achieved_fps(self):
+        # Return the number of frames per second that were returned by get_frame over the last fps_window seconds.
+        with self.condition:
+            if len(self.played_frame_times) < 2 or self.played_frame_times[-1] == self.played_frame_times[0]:
+                return 0.0
+            return (len(self.played_frame_times) - 1) / (self.played_frame_times[-1] - self.played_frame_times[0])
+
+    def get_statistics(self):
+        # Return the playback rate, the achieved fps and the numbers of frames that were played, dropped after being read and skipped without being read.
+        return {'playback_rate' : self.get_playback_rate() if self.video_fps else 0.0, 'achieved_fps' : self.get_achieved_fps(), 'n_played_frames' : self.n_played_frames, 'n_dropped_frames' : self.n_dropped_frames, 'n_skipped_frames' : self.n_skipped_frames}
+
+    def stop(self):
+        # Stop the reader thread and release the video.
+        self.stop_event.set()
+        with self.condition:
+            self.condition.notify_all()
+        if self.thread is not None and self.thread.is_alive():
+            self.thread.join()
+        self.thread = None
+        self.frame_queue.clear()
+
+def get_ffmpeg_encoder_command(codec = 'libx264', crf = 23, preset = 'veryfast', ffmpeg_path = 'ffmpeg'):
+    # Return a command that pipes raw BGR frames into FFmpeg. The fields in braces are filled in by TrackedVideoWriter.
+    return [ffmpeg_path, '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', '{width}x{height}', '-r', '{fps}', '-i', '-', '-c:v', codec, '-preset', preset, '-crf', str(crf), '-pix_fmt', 'yuv420p', '{video_path}']
+
+class TrackedVideoWriter():
+    '''
+    Writes tracked frames, annotated with the tracking results, to a video in a separate thread.
+
+    Steps:
+        Each call to write decides whether the frame is written and passes the frame and its tracking results to a queue.
+        When the queue is full, calls to write wait until the writer thread has written a frame.
+        The writer thread annotates the tracking results onto the frame with annotate_tracking_results_onto_frame, crops and resizes the frame, and encodes it.
+        Frames are encoded with cv2.VideoWriter or piped to an external encoder.
+
+    Required Arguments:
+        video_path (str) - Path to the tracked video.
+        video_fps (float) - FPS of the tracked video.
+        frame_size (frame width, frame height) - Size of the frames passed to write.
+        colours (list([B, G, R])) - List of colours that are used for annotating the tracking results.
+
+    Optional Arguments:
+        line_length (int) - The length of the line used for drawing the heading angle. Default = 10.
+        extended_eyes_calculation (bool) - Boolean to determine whether or not the eye angles are drawn. Default = False.
+        eyes_line_length (int) - The length of the lines used for drawing the eye angles. Default = None.
+            ** When eyes_line_length is None, eyes_line_length = line_length.
+        fourcc (int or str) - Four character code of the codec used by cv2.VideoWriter. Default = 0.
+            ** When fourcc is 0, the frames are written uncompressed.
+            ** Use a string such as MJPG or XVID to compress the frames.
+        encoder_command (list) - Command of an external encoder that reads raw BGR frames from its standard input. Default = None.
+            ** The fields {width}, {height}, {fps} and {video_path} in each argument are filled in. See get_ffmpeg_encoder_command.
+            ** When encoder_command is given, fourcc is not used.
+        frame_step (int) - Only every nth frame is written. Default = 1.
+        only_moving_frames (bool) - Boolean to determine whether or not frames are only written when the fish moved. Default = False.
+            ** A frame is written when any tracked point moved by more than movement_threshold pixels since the last written frame, or when the fish was found or lost.
+        movement_threshold (float) - Distance in pixels that a tracked point must move for the fish to have moved. Default = 1.
+        scale (float) - Scale of the written frames relative to the frame size. Default = 1.
+            ** Use 0.5 to write the video at half resolution.
+        crop_radius (int) - Half of the width of a square crop centered on the heading coordinates of the fish. Default = None.
+            ** When crop_radius is None, the whole frame is written.
+            ** When the fish is not tracked, the crop stays where the fish was last tracked.
+        threaded (bool) - Boolean to determine whether or not frames are annotated and encoded in a separate thread. Default = True.
+        queue_depth (int) - Maximum number of frames waiting to be written. Default = 16.
+            ** Frames must not be modified after they have been passed to write.
+        profiler (TrackingProfiler) - Profiler that times annotating and encoding each frame. Default = None.
+    '''
+
+    def __init__(self, video_path, video_fps, frame_size, colours, line_length = 10, extended_eyes_calculation = False, eyes_line_length = None, fourcc = 0, encoder_command = None, frame_step = 1, only_moving_frames = False, movement_threshold = 1, scale = 1, crop_radius = None, threaded = True, queue_depth = 16, profiler = None):
+        self.video_path = video_path
+        self.profiler = profiler
+        self.colours = colours
+        self.line_length = line_length
+        self.extended_eyes_calculation = extended_eyes_calculation
+        self.eyes_line_length = line_length if eyes_line_length is None else eyes_line_length
+        self.frame_step = max(int(frame_step), 1)
+        self.only_moving_frames = only_moving_frames
+        self.movement_threshold = movement_threshold
+        self.scale = scale
+        self.crop_radius = crop_radius
+        self.frame_size = frame_size
+        self.n_frames = 0
+        self.n_written_frames = 0
+        self.last_written_coords = None
+        self.crop_centre = [frame_size[1] / 2, frame_size[0] / 2]
+        self.error = None
+        # Calculate the size of the written frames.
+        output_size = frame_size if crop_radius is None else (2 * crop_radius + 1, 2 * crop_radius + 1)
+        self.output_size = (max(int(round(output_size[0] * scale)), 1), max(int(round(output_size[1] * scale)), 1))
+        self.writer = None
+        self.encoder = None
+        if encoder_command is not None:
+            # Start the external encoder with a pipe to its standard input.
+            encoder_command = [str(argument).format(width = self.output_size[0], height = self.output_size[1], fps = video_fps, video_path = video_path) for argument in encoder_command]
+            self.encoder = subprocess.Popen(encoder_command, stdin = subprocess.PIPE)
+        else:
+            if isinstance(fourcc, str):
+                fourcc = cv2.VideoWriter_fourcc(*fourcc)
+            self.writer = cv2.VideoWriter(video_path, fourcc, video_fps, self.output_size)
+        self.frame_queue = None
+        self.thread = None
+        if threaded:
+            self.frame_queue = queue.Queue(maxsize = max(queue_depth, 1))
+            self.thread = threading.Thread(target = self._write_frames, daemon = True)
+            self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def isOpened(self):
+        if self.encoder is not None:
+            return self.encoder.poll() is None
+        return self.writer.isOpened()
+
+    def check_frame(self, results):
+        # Check whether the next frame should be written.
+        frame_number = self.n_frames
+        self.n_frames += 1
+        if frame_number % self.frame_step != 0:
+            return False
+        if not self.only_moving_frames:
+            return True
+        coords = None
+        if results is not None:
+            coords = np.concatenate([np.ravel(results[0]), np.ravel(results[1]), np.ravel(results[4]), np.ravel(results[7])]).astype(np.float64)
+        # Write the frame when the fish was found or lost, or when any point moved further than the threshold.
+        if self.n_written_frames > 0 and (coords is None) == (self.last_written_coords is None):
+            if coords is None or not np.nanmax(np.abs(coords - self.last_written_coords), initial = 0) > self.movement_threshold:
+                return False
+        self.last_written_coords = coords
+        return True
+
+    def process_frame(self, frame, results):
+        # Annotate, crop, and resize a frame.
+        if frame.ndim == 2:
+            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+        if results is not None:
+            try:
+                frame = annotate_tracking_results_onto_frame(frame, results, self.colours, self.line_length, self.extended_eyes_calculation, self.eyes_line_length)
+            except (ValueError, OverflowError, TypeError):
+                # Frames whose tracking results can not be drawn are written without annotations.
+                pass
+            if self.crop_radius is not None and not np.any(np.isnan(np.asarray(results[4], dtype = np.float64))):
+                self.crop_centre = results[4]
+        if self.crop_radius is not None:
+            # Copy the crop around the fish into a frame of fixed size. Parts of the crop outside of the frame are black.
+            centre_y, centre_x = int(round(self.crop_centre[0])), int(round(self.crop_centre[1]))
+            cropped_frame = np.zeros((2 * self.crop_radius + 1, 2 * self.crop_radius + 1, 3), dtype = np.uint8)
+            top, bottom, left, right = max(centre_y - self.crop_radius, 0), min(centre_y + self.crop_radius + 1, frame.shape[0]), max(centre_x - self.crop_radius, 0), min(centre_x + self.crop_radius + 1, frame.shape[1])
+            if top < bottom and left < right:
+                cropped_frame[top - (centre_y - self.crop_radius):bottom - (centre_y - self.crop_radius), left - (centre_x - self.crop_radius):right - (centre_x - self.crop_radius)] = frame[top:bottom, left:right]
+            frame = cropped_frame
+        if (frame.shape[1], frame.shape[0]) != self.output_size:
+            frame = cv2.resize(frame, self.output_size, interpolation = cv2.INTER_AREA)
+        return frame
+
+    def encode_frame(self, frame):
+        if self.profiler is not None:
+            t = time.perf_counter()
+        if self.encoder is not None:
+            self.encoder.stdin.write(np.ascontiguousarray(frame).tobytes())
+        else:
+            self.writer.write(frame)
+        if self.profiler is not None:
+            self.profiler.add_time('encode', t)
+
+    def annotate_frame(self, frame, results):
+        # Annotate, crop, and resize a frame, and time it when a profiler is provided.
+        if self.profiler is None:
+            return self.process_frame(frame, results)
+        t = time.perf_counter()
+        frame = self.process_frame(frame, results)
+        self.profiler.add_time('annotate', t)
+        return frame
+
+    def _write_frames(self):
+        while True:
+            item = self.frame_queue.get()
+            if item is None:
+                break
+            # Keep taking frames from the queue after an error so that calls to write do not wait forever.
+            if self.error is None:
+                try:
+                    self.encode_frame(self.annotate_frame(*item))
+                except Exception as error:
+                    self.error = error
+
+    def write(self, frame, results = None):
+        '''
+        Writes a frame to the tracked video.
+
+        Required Arguments:
+            frame (frame width, frame height) - Grayscale or BGR frame.
+
+        Optional Arguments:
+            results (list) - Tracking results of the frame, in the format returned by track_tail_in_frame. Default = None.
+                ** When results is None, the frame is written without annotations.
+
+        Returns:
+            frame_written (bool) - Boolean that is True when the frame is written to the video.
+        '''
+        if self.error is not None:
+            raise self.error
+        if not self.check_frame(results):
+            return False
+        self.n_written_frames += 1
+        if self.thread is not None:
+            self.frame_queue.put((frame, results))
+        else:
+            self.encode_frame(self.annotate_frame(frame, results))
+        return True
+
+    def release(self):
+        # Wait for the remaining frames to be written and unload the writer from memory.
+        if self.thread is not None and self.thread.is_alive():
+            self.frame_queue.put(None)
+            self.thread.join()
+        if self.writer is not None:
+            self.writer.release()
+        if self.encoder is not None:
+            # Close the pipe so that the external encoder finishes the video.
+            try:
+                self.encoder.stdin.close()
+            except (OSError, ValueError):
+                pass
+            self.encoder.wait()
+        if self.error is not None:
+            raise self.error
+
+class MotionGate():
+    '''
+    Decides whether a frame changed enough from a reference frame to be tracked again, using integer operations on the frame or on a small part of it.
+
+    Steps:
+        The frame is cropped to a square around the fish, if a radius is provided, and downsampled, if a downsample factor is provided.
+        The absolute difference between the frame and the reference frame is calculated with cv2.absdiff.
+        The number of pixels whose difference is greater than the frame change threshold is counted with cv2.countNonZero.
+        The frame changed if the number of changed pixels is at least min_changed_pixels. Frames that did not change can reuse the tracking results of the reference frame.
+
+    Optional Arguments:
+        frame_change_threshold (int) - Threshold used to compare the absolute difference in pixel values between the frame and the reference frame. Default = 10.
+        min_changed_pixels (int) - Number of pixels that must change for the frame to have changed. Default = 1.
+        downsample_factor (int) - Factor by which the frames are downsampled before they are compared. Default = 1.
+            ** Downsampling averages neighbouring pixels, so small changes are less likely to pass the threshold.
+        roi_radius (int) - Half of the width of a square around the fish that is compared. Default = None.
+            ** The square is centered on the coordinates of the fish passed to update_reference.
+            ** When roi_radius is None, or when the position of the fish is not known, the whole frame is compared.
+        reference (str) - Frame that each frame is compared to. Default = 'tracked'.
+            ** When reference is 'tracked', frames are compared to the last tracked frame, so that slow movements add up until the frame is tracked again.
+            ** When reference is 'previous', frames are compared to the previous frame that was checked.
+        ** When downsample_factor is 1 and roi_radius is None, a frame changed exactly when np.sum(np.abs(frame - reference_frame) > frame_change_threshold) >= min_changed_pixels.
+
+    Usage:
+        motion_gate = MotionGate(frame_change_threshold)
+        if motion_gate.check_frame(frame):
+            ... track the frame ...
+            motion_gate.update_reference(frame, heading_coords)
+        print(motion_gate.get_statistics())
+    '''
 
-def preview_tracking_results(video_path, colours, n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, save_path = None, background_path = None, save_background = False, extended_eyes_calculation = False, eyes_threshold = None, line_length = 0, frame_number = 0, pixel_threshold = 100):
+    def __init__(self, frame_change_threshold = 10, min_changed_pixels = 1, downsample_factor = 1, roi_radius = None, reference = 'tracked'):
+        self.frame_change_threshold = frame_change_threshold
+        self.min_changed_pixels = max(int(min_changed_pixels), 1)
+        self.downsample_factor = max(int(downsample_factor), 1)
+        self.roi_radius = roi_radius
+        self.reference = reference
+        self.reset()
+
+    def reset(self):
+        # Remove the reference frame and reset the statistics.
+        self.reference_frame = None
+        self.reference_coords = None
+        self.prepared_reference_frame = None
+        self.diff_frame = None
+        self.n_checked_frames = 0
+        self.n_skipped_frames = 0
+
+    def has_reference(self):
+        return self.reference_frame is not None
+
+    def prepare_frame(self, frame, center_coords = None):
+        # Crop the frame around the fish and downsample it. Returns a view of the frame when no downsampling is needed.
+        if self.roi_radius is not None and center_coords is not None and not np.any(np.isnan(np.asarray(center_coords, dtype = np.float64))):
+            top, left = [max(int(round(center_coords[i])) - self.roi_radius, 0) for i in range(2)]
+            frame = frame[top:top + 2 * self.roi_radius + 1, left:left + 2 * self.roi_radius + 1]
+        if self.downsample_factor > 1:
+            frame = cv2.resize(frame, (max(frame.shape[1] // self.downsample_factor, 1), max(frame.shape[0] // self.downsample_factor, 1)), interpolation = cv2.INTER_AREA)
+        return frame
+
+    def count_changed_pixels(self, frame):
+        # Count the pixels that changed by more than the frame change threshold since the reference frame. The region around the fish is taken from where the fish was in the reference frame, so that both frames are compared over the same pixels.
+        frame = self.prepare_frame(frame, self.reference_coords)
+        if frame.shape != self.prepared_reference_frame.shape:
+            return frame.size
+        # Reuse the buffer for the difference between frames when the frames have the same size.
+        if self.diff_frame is None or self.diff_frame.shape != frame.shape:
+            self.diff_frame = np.zeros(frame.shape, dtype = np.uint8)
+        cv2.absdiff(frame, self.prepared_reference_frame, dst = self.diff_frame)
+        cv2.threshold(self.diff_frame, self.frame_change_threshold, 255, cv2.THRESH_BINARY, dst = self.diff_frame)
+        return cv2.countNonZero(self.diff_frame)
+
+    def check_frame(self, frame):
+        '''
+        Checks whether a frame changed from the reference frame.
+
+        Required Arguments:
+            frame (frame width, frame height) - Grayscale frame.
+
+        Returns:
+            frame_changed (bool) - Boolean that is True when the frame must be tracked.
+                ** Always True when there is no reference frame.
+        '''
+        self.n_checked_frames += 1
+        frame_changed = self.reference_frame is None or self.count_changed_pixels(frame) >= self.min_changed_pixels
+        if not frame_changed:
+            self.n_skipped_frames += 1
+        if self.reference == 'previous':
+            self.update_reference(frame, self.reference_coords)
+        return frame_changed
+
+    def update_reference(self, frame, center_coords = None):
+        # Set the frame that the next frames are compared to, and the coordinates of the fish in that frame. The reference frame is cropped and downsampled once.
+        self.reference_frame = frame
+        self.reference_coords = center_coords
+        self.prepared_reference_frame = self.prepare_frame(frame, center_coords)
+
+    def get_statistics(self):
+        # Return the number of frames that were checked and skipped.
+        return {'n_checked_frames' : self.n_checked_frames, 'n_skipped_frames' : self.n_skipped_frames, 'skipped_fraction' : self.n_skipped_frames / self.n_checked_frames if self.n_checked_frames > 0 else 0.0}
+
+def preview_tracking_results(video_path, colours, n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, save_path = None, background_path = None, save_background = False, extended_eyes_calculation = False, eyes_threshold = None, line_length = 0, frame_number = 0, pixel_threshold = 100, output_path = None):
     '''
     Previews tracking for a video.
 
@@ -339,10 +1938,13 @@ def preview_tracking_results(video_path, colours, n_tail_points, dist_tail_point
             ** Used to compare the pixel_threshold to the maximum pixel value in the frame.
             ** If the maximum pixel value in the frame is less than pixel_threshold, then skip tracking that frame.
             ** Useful for when the fish is out of the frame. Thus, frames in which the fish is not in it will not be tracked.
+        output_path (str) - Path to save the annotated frame as an image. Default = None.
+            ** When output_path is None, the annotated frame is displayed in a window instead.
 
     Returns:
         preview_tracking_results - A window will display the tracking results annotated on the video frame requested.
             ** Points of interest (i.e. tail points, heading angle, and eye coordinates) are annotated on the frame.
+            ** When output_path is provided, the annotated frame is saved to output_path instead and the results are returned.
     '''
     # Create or load background image.
     if background_path is None:
@@ -373,251 +1975,1099 @@ def preview_tracking_results(video_path, colours, n_tail_points, dist_tail_point
     capture.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
 
     print('Calculating tracking results.')
+    results = None
     # Load a frame into memory.
     success, original_frame = capture.read()
     # Checks if the frame was loaded successfully.
     if success:
-        # Initialize variables for each frame.
-        first_eye_coords = [np.nan, np.nan]
-        second_eye_coords = [np.nan, np.nan]
-        first_eye_angle = np.nan
-        second_eye_angle = np.nan
-        body_coords = [np.nan, np.nan]
-        heading_angle = np.nan
-        swim_bladder_coords = [np.nan, np.nan]
-        tail_point_coords = [[np.nan, np.nan] for m in range(n_tail_points)]
-        tail_points = [[np.nan, np.nan] for m in range(n_tail_points + 1)]
-        # Convert the original frame to grayscale.
-        frame = cv2.cvtColor(original_frame, cv2.COLOR_BGR2GRAY).astype(np.uint8)
-        # Convert the frame into the absolute difference between the frame and the background.
-        frame = cv2.absdiff(frame, background)
-        # Apply a median blur filter to the frame.
-        frame = cv2.medianBlur(frame, 3)
         try:
-            # Check to ensure that the maximum pixel value is greater than a certain value. Useful for determining whether or not the at least one of the eyes is present in the frame.
-            if np.max(frame) > pixel_threshold:
-                # Return the coordinate of the brightest pixel.
-                first_eye_coords = [np.where(frame == np.max(frame))[0][0], np.where(frame == np.max(frame))[1][0]]
-                # Calculate the next brightest pixel that lies on the circle drawn around the first eye coordinates and has a radius equal to the distance between the eyes.
-                second_eye_coords = calculate_next_coords(first_eye_coords, dist_eyes, frame, n_angles = 100, range_angles = 2 * np.pi, tail_calculation = False)
-                # Check whether to to an additional process to calculate eye angles.
-                if extended_eyes_calculation:
-                    # Calculate the angle between the two eyes.
-                    eye_angle = np.arctan2(second_eye_coords[0] - first_eye_coords[0], second_eye_coords[1] - first_eye_coords[1])
-                    # Apply a threshold to the frame.
-                    thresh = cv2.threshold(frame, eyes_threshold, 255, cv2.THRESH_BINARY)[1]
-                    # Find the contours of the binary regions in the thresholded frame.
-                    contours = cv2.findContours(thresh, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)[1]
-                    # Iterate through each contour in the list of contours.
-                    for i in range(len(contours)):
-                        # Check if the first eye coordinate are within the current contour.
-                        if cv2.pointPolygonTest(contours[i], (first_eye_coords[1], first_eye_coords[0]), False) == 1:
-                            # Set the first eye coordinates to the centroid of the binary region and calculate the first eye angle.
-                            M = cv2.moments(contours[i])
-                            first_eye_coords = [int(round(M['m01']/M['m00'])), int(round(M['m10']/M['m00']))]
-                            first_eye_angle = cv2.fitEllipse(contours[i])[2] * np.pi / 180
-                        # Check if the second eye coordinate are within the current contour.
-                        if cv2.pointPolygonTest(contours[i], (second_eye_coords[1], second_eye_coords[0]), False) == 1:
-                            # Set the second eye coordinates to the centroid of the binary region and calculate the second eye angle.
-                            M = cv2.moments(contours[i])
-                            second_eye_coords = [int(round(M['m01']/M['m00'])), int(round(M['m10']/M['m00']))]
-                            second_eye_angle = cv2.fitEllipse(contours[i])[2] * np.pi / 180
-                # Find the midpoint of the line that connects both eyes.
-                heading_coords = [(first_eye_coords[0] + second_eye_coords[0]) / 2, (first_eye_coords[1] + second_eye_coords[1]) / 2]
-                # Find the swim bladder coordinates by finding the next brightest coordinates that lie on a circle around the heading coordinates with a radius equal to the distance between the eyes and the swim bladder.
-                swim_bladder_coords = calculate_next_coords(heading_coords, dist_swim_bladder, frame, n_angles = 100, range_angles = 2 * np.pi, tail_calculation = False)
-                # Find the body coordinates by finding the center of the triangle that connects the eyes and swim bladder.
-                body_coords = [int(round((swim_bladder_coords[0] + first_eye_coords[0] + second_eye_coords[0]) / 3)), int(round((swim_bladder_coords[1] + first_eye_coords[1] + second_eye_coords[1]) / 3))]
-                # Calculate the heading angle as the angle between the body coordinates and the heading coordinates.
-                heading_angle = np.arctan2(heading_coords[0] - body_coords[0], heading_coords[1] - body_coords[1])
-                # Check whether to to an additional process to calculate eye angles.
-                if extended_eyes_calculation:
-                    # Create an array that acts as a contour for the body and contains the swim bladder coordinates and eye coordinates.
-                    body_contour = np.array([np.array([swim_bladder_coords[1], swim_bladder_coords[0]]), np.array([first_eye_coords[1], first_eye_coords[0]]), np.array([second_eye_coords[1], second_eye_coords[0]])])
-                    # Check to see if the point that is created by drawing a line from the first eye coordinates with a length equal to half of the distance between the eyes is within the body contour. Occasionally, the angle of the eye is flipped to face towards the body instead of away. This is to check whether or not the eye angle should be flipped.
-                    if cv2.pointPolygonTest(body_contour, (first_eye_coords[1] + (dist_eyes / 2 * np.cos(first_eye_angle)), first_eye_coords[0] + (dist_eyes / 2 * np.sin(first_eye_angle))), False) == 1:
-                        # Flip the first eye angle.
-                        if first_eye_angle > 0:
-                            first_eye_angle -= np.pi
-                        else:
-                            first_eye_angle += np.pi
-                    # Check to see if the point that is created by drawing a line from the first eye coordinates with a length equal to half of the distance between the eyes is within the body contour. Occasionally, the angle of the eye is flipped to face towards the body instead of away. This is to check whether or not the eye angle should be flipped.
-                    if cv2.pointPolygonTest(body_contour, (second_eye_coords[1] + (dist_eyes / 2 * np.cos(second_eye_angle)), second_eye_coords[0] + (dist_eyes / 2 * np.sin(second_eye_angle))), False) == 1:
-                        # Flip the second eye angle.
-                        if second_eye_angle > 0:
-                            second_eye_angle -= np.pi
-                        else:
-                            second_eye_angle += np.pi
-                # Calculate the initial tail angle as the angle opposite to the heading angle.
-                if heading_angle > 0:
-                    tail_angle = heading_angle - np.pi
-                else:
-                    tail_angle = heading_angle + np.pi
-                # Iterate through the number of tail points.
-                for m in range(n_tail_points):
-                    # Check if this is the first tail point.
-                    if m == 0:
-                        # Calculate the first tail point using the swim bladder as the first set of coordinates.
-                        tail_point_coords[m] = calculate_next_coords(swim_bladder_coords, dist_tail_points, frame, angle = tail_angle)
-                    else:
-                        # Check if this is the second tail point.
-                        if m == 1:
-                            # Calculate the next tail angle as the angle between the first tail point and the swim bladder.
-                            tail_angle = np.arctan2(tail_point_coords[m - 1][0] - swim_bladder_coords[0], tail_point_coords[m - 1][1] - swim_bladder_coords[1])
-                        # Check if the number of tail points calculated is greater than 2.
-                        else:
-                            # Calculate the next tail angle as the angle between the last two tail points.
-                            tail_angle = np.arctan2(tail_point_coords[m - 1][0] - tail_point_coords[m - 2][0], tail_point_coords[m - 1][1] - tail_point_coords[m - 2][1])
-                        # Calculate the next set of tail coordinates.
-                        tail_point_coords[m] = calculate_next_coords(tail_point_coords[m - 1], dist_tail_points, frame, angle = tail_angle)
-            # Check whether to to an additional process to calculate eye angles.
-            if extended_eyes_calculation:
-                # Draw a circle arround the first eye coordinates.
-                original_frame = cv2.circle(original_frame, (first_eye_coords[1], first_eye_coords[0]), 1, colours[-3], -1)
-                # Draw a line representing the first eye angle.
-                original_frame = cv2.line(original_frame, (first_eye_coords[1], first_eye_coords[0]), (int(round(first_eye_coords[1] + (line_length * np.cos(first_eye_angle)))), int(round(first_eye_coords[0] + (line_length * np.sin(first_eye_angle))))), colours[-3], 1)
-                # Draw a circle around the second eye coordinates.
-                original_frame = cv2.circle(original_frame, (second_eye_coords[1], second_eye_coords[0]), 1, colours[-2], - 1)
-                # Draw a line representing the second eye angle.
-                original_frame = cv2.line(original_frame, (second_eye_coords[1], second_eye_coords[0]), (int(round(second_eye_coords[1] + (line_length * np.cos(second_eye_angle)))), int(round(second_eye_coords[0] + (line_length * np.sin(second_eye_angle))))), colours[-2], 1)
+            # Track the frame with the same tracker used for tracking videos.
+            fish_tracker = FishTracker(n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, pixel_threshold = pixel_threshold, extended_eyes_calculation = extended_eyes_calculation, eyes_threshold = eyes_threshold, background = background)
+            results = convert_tracking_record_to_results(fish_tracker.track_frame(original_frame))
+            if results is None:
+                print('The fish could not be tracked in the frame. Previewing the frame without tracking results.')
             else:
-                # Draw a circle arround the first eye coordinates.
-                original_frame = cv2.circle(original_frame, (first_eye_coords[1], first_eye_coords[0]), 1, colours[-2], -1)
-                # Draw a circle arround the second eye coordinates.
-                original_frame = cv2.circle(original_frame, (second_eye_coords[1], second_eye_coords[0]), 1, colours[-2], - 1)
-            # Iterate through each set of tail points.
-            for m in range(n_tail_points):
-                # Check if this is the first tail point
-                if m == 0:
-                    # For the first tail point, draw around the midpoint of the line that connects the swim bladder to the first tail point.
-                    original_frame = cv2.circle(original_frame, (int(round((swim_bladder_coords[1] + tail_point_coords[m][1]) / 2)), int(round((swim_bladder_coords[0] + tail_point_coords[m][0]) / 2))), 1, colours[m], -1)
-                else:
-                    # For all subsequent tail points, draw around the midpoint of the line that connects the previous tail point to the current tail point.
-                    original_frame = cv2.circle(original_frame, (int(round((tail_point_coords[m - 1][1] + tail_point_coords[m][1]) / 2)), int(round((tail_point_coords[m - 1][0] + tail_point_coords[m][0]) / 2))), 1, colours[m], -1)
-            # Draw an arrow for the heading angle.
-            original_frame = cv2.arrowedLine(original_frame, (int(round(heading_coords[1] - (line_length / 2 * np.cos(heading_angle)))), int(round(heading_coords[0] - (line_length / 2 * np.sin(heading_angle))))), (int(round(heading_coords[1] + (line_length * np.cos(heading_angle)))), int(round(heading_coords[0] + (line_length * np.sin(heading_angle))))), colours[-1], 1, tipLength = 0.2)
-            print('Previewing tracking results.')
-            cv2.imshow('Preview Tracked Frame', original_frame)
-            cv2.waitKey(0)
-            cv2.destroyAllWindows()
+                # Annotate the tracking results onto the frame.
+                original_frame = annotate_tracking_results_onto_frame(original_frame, results, colours, line_length, extended_eyes_calculation, line_length)
+            if output_path is not None:
+                # Save the annotated frame instead of displaying it, for computers without a display.
+                cv2.imwrite(output_path, original_frame)
+                print('Saved tracking results preview to {0}.'.format(output_path))
+            else:
+                print('Previewing tracking results.')
+                cv2.imshow('Preview Tracked Frame', original_frame)
+                cv2.waitKey(0)
+                cv2.destroyAllWindows()
         except:
             # Handles any errors that occur throughout tracking.
             print('Error: something went wrong during tracking!')
+            results = None
 
     # Unload the video from memory.
     capture.release()
 
+    if output_path is not None:
+        return results
+
+def calculate_next_coords_in_frames(init_coords, radius, frame_stack, tracked_frames, angle = 0, n_angles = 20, range_angles = np.pi * 2.0 / 3.0, tail_calculation = True):
+    '''
+    Function that calculates the next set of coordinates in each frame of a stack of frames. Gives the same results as calculate_next_coords for each frame.
+
+    Required Arguments:
+        init_coords (N, 2) - Coordinates to use for initializing search of next coordinates in each frame.
+        radius (float) - Radius to use for calculating the distance between the initial coordinates and potential next coordinates.
+        frame_stack (N, frame height, frame width) - Stack of background subtracted frames.
+        tracked_frames (N) - Mask of the frames that are still being tracked.
+
+    Optional Arguments:
+        angle (float or N) - Initial angle, or initial angle of each frame, that will be used when drawing a line between the inital coordinates and the next coordinates. Default = 0.
+            ** Units in radians.
+        n_angles (int) - Number of angles used when searching for initial points. Default = 20.
+        range_angles (float) - The entire range of angles with which to look for the next pixel. Default = 2 / 3 * pi.
+            ** Units in radians.
+        tail_calculation (bool) - Determines which method to use if multiple coordinates are returned. Default = True.
+
+    Returns:
+        next_coords (N, 2) - The next coordinates in each frame.
+        tracked_frames (N) - Mask of the frames that are still being tracked.
+            ** Frames where calculate_next_coords would raise an error, such as when the search leaves the frame, are removed from the mask.
+    '''
+    n_frames, frame_height, frame_width = frame_stack.shape
+    # Replace the coordinates of frames that are no longer being tracked so that they do not cause errors.
+    init_coords = np.where(tracked_frames[:, np.newaxis], init_coords, 0)
+    if np.ndim(angle) > 0:
+        angle = np.where(tracked_frames, angle, 0)
+    # Calculate all potential next coordinates in each frame. The offsets of every frame are calculated at once.
+    next_coords_y, next_coords_x = get_circle_coords(init_coords, radius, angle, n_angles, range_angles)
+    angle = np.broadcast_to(angle, (n_frames,))
+    # Stop tracking frames where all of the potential next coordinates are duplicates.
+    unique_coords = (next_coords_y != np.roll(next_coords_y, 1, axis = 1)) | (next_coords_x != np.roll(next_coords_x, 1, axis = 1))
+    tracked_frames = tracked_frames & np.any(unique_coords, axis = 1)
+    # Stop tracking frames where any of the potential next coordinates lie outside of the frame. Negative coordinates wrap around when indexing the frame.
+    outside_coords = (next_coords_y >= frame_height) | (next_coords_y < -frame_height) | (next_coords_x >= frame_width) | (next_coords_x < -frame_width)
+    tracked_frames = tracked_frames & ~np.any(outside_coords, axis = 1)
+    next_coords_y[outside_coords] = 0
+    next_coords_x[outside_coords] = 0
+    # Get the pixel values at each of the potential next coordinates.
+    frame_index = np.arange(n_frames)
+    pixel_values = frame_stack[frame_index[:, np.newaxis], next_coords_y, next_coords_x]
+    # Get only the coordinates that are the brightest. Negative coordinates are never returned.
+    brightest_coords = (pixel_values == np.max(pixel_values, axis = 1, keepdims = True)) & (next_coords_y >= 0) & (next_coords_x >= 0)
+    tracked_frames = tracked_frames & np.any(brightest_coords, axis = 1)
+    # Calculate the value used to choose between multiple coordinates that have the same, brightest value.
+    if tail_calculation:
+        # Difference between the angle of the next coordinates and the initial coordinates and the previous angle that was given.
+        min_values = np.abs(angle[:, np.newaxis] - np.arctan2(next_coords_y - init_coords[:, 0:1], next_coords_x - init_coords[:, 1:2]))
+    else:
+        # Length between the next coordinates and the initial coordinates.
+        min_values = np.hypot(next_coords_y - init_coords[:, 0:1], next_coords_x - init_coords[:, 1:2])
+    min_values[~brightest_coords] = np.inf
+    # Take the set of coordinates with the minimum value. If more than one set of coordinates remain, take the first one in the same order as they appear in the frame.
+    brightest_coords &= min_values == np.min(min_values, axis = 1, keepdims = True)
+    coords_index = np.where(brightest_coords, next_coords_y * frame_width + next_coords_x, np.iinfo(np.int64).max)
+    index = np.argmin(coords_index, axis = 1)
+    next_coords = np.stack([next_coords_y[frame_index, index], next_coords_x[frame_index, index]], axis = 1)
+    return next_coords, tracked_frames
+
+def calculate_eye_angles_in_frame(frame, first_eye_coords, second_eye_coords, eyes_threshold, window_radius = None):
+    '''
+    Calculates the centroids and angles of the eyes from the binary regions that contain the eye coordinates.
+
+    Steps:
+        A threshold is applied to a window of the frame around both eye coordinates.
+        The binary regions in the window are labelled with cv2.connectedComponentsWithStats, and the regions that contain the eye coordinates are looked up from the labels at the eye coordinates.
+        If a region that contains an eye touches the edge of the window, the window is doubled in size until the region fits or the window covers the whole frame.
+        The outer contour of each region that contains an eye is found from the mask of the region inside the window.
+        The coordinates of each eye are set to the centroid of its contour and the angle of each eye is the angle of the ellipse fitted to its contour with cv2.fitEllipse.
+
+    Required Arguments:
+        frame (frame width, frame height) - Background subtracted, median blurred frame.
+        first_eye_coords ([y, x]) - Coordinates of the first eye.
+        second_eye_coords ([y, x]) - Coordinates of the second eye.
+        eyes_threshold (int) - Threshold used to find the binary regions that contain the eyes.
+
+    Optional Arguments:
+        window_radius (int) - Number of pixels around the eye coordinates that are included in the window. Default = None.
+            ** When window_radius is None, window_radius = the distance between the eye coordinates, or 4 pixels if the eyes are closer.
+
+    Returns:
+        first_eye_coords ([y, x]) - Centroid of the contour that contains the first eye. Unchanged if the first eye coordinates are not inside a contour.
+        second_eye_coords ([y, x]) - Centroid of the contour that contains the second eye. Unchanged if the second eye coordinates are not inside a contour.
+        first_eye_angle (float) - Angle of the ellipse fitted to the contour that contains the first eye, in radians. NaN if the first eye coordinates are not inside a contour.
+        second_eye_angle (float) - Angle of the ellipse fitted to the contour that contains the second eye, in radians. NaN if the second eye coordinates are not inside a contour.
+            ** Raises an error if a contour has fewer than 5 points, since cv2.fitEllipse needs at least 5 points.
+    '''
+    eye_coords = [[int(first_eye_coords[0]), int(first_eye_coords[1])], [int(second_eye_coords[0]), int(second_eye_coords[1])]]
+    frame_height, frame_width = frame.shape[:2]
+    if window_radius is None:
+        window_radius = max(int(np.ceil(np.hypot(eye_coords[0][0] - eye_coords[1][0], eye_coords[0][1] - eye_coords[1][1]))), 4)
+    while True:
+        # Crop a window around both eyes.
+        top, left = max(min(eye_coords[0][0], eye_coords[1][0]) - window_radius, 0), max(min(eye_coords[0][1], eye_coords[1][1]) - window_radius, 0)
+        bottom, right = min(max(eye_coords[0][0], eye_coords[1][0]) + window_radius + 1, frame_height), min(max(eye_coords[0][1], eye_coords[1][1]) + window_radius + 1, frame_width)
+        # Apply a threshold to the window and label the binary regions.
+        thresh = cv2.threshold(frame[top:bottom, left:right], eyes_threshold, 255, cv2.THRESH_BINARY)[1]
+        labels, stats = cv2.connectedComponentsWithStats(thresh, connectivity = 8)[1:3]
+        # Look up the labels of the regions at the eye coordinates. Label 0 is the background.
+        eye_labels = [labels[coords[0] - top, coords[1] - left] if top <= coords[0] < bottom and left <= coords[1] < right else 0 for coords in eye_coords]
+        # Check whether a region that contains an eye is cut off by the edge of the window.
+        window_covers_frame = top == 0 and left == 0 and bottom == frame_height and right == frame_width
+        region_cut_off = False
+        for label in eye_labels:
+            if label > 0:
+                region_left, region_top, region_width, region_height = stats[label, :4]
+                if (region_left == 0 and left > 0) or (region_top == 0 and top > 0) or (region_left + region_width == right - left and right < frame_width) or (region_top + region_height == bottom - top and bottom < frame_height):
+                    region_cut_off = True
+        if not region_cut_off or window_covers_frame:
+            break
+        window_radius *= 2
+    eye_angles = [np.nan, np.nan]
+    for i in range(2):
+        label = eye_labels[i]
+        if label == 0:
+            continue
+        # Find the outer contour of the region. The mask of the region is padded by a pixel so that the contour is traced the same way as in the whole frame, and the contour is offset into the coordinates of the frame.
+        region_left, region_top, region_width, region_height = stats[label, :4]
+        region_mask = np.pad((labels[region_top:region_top + region_height, region_left:region_left + region_width] == label).astype(np.uint8), 1)
+        contour = cv2.findContours(region_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE, offset = (int(left + region_left - 1), int(top + region_top - 1)))[-2][0]
+        # Only use the region if the eye coordinates lie inside its contour.
+        if cv2.pointPolygonTest(contour, (eye_coords[i][1], eye_coords[i][0]), False) != 1:
+            continue
+        # Set the eye coordinates to the centroid of the contour and calculate the angle of the eye from the ellipse fitted to the contour.
+        M = cv2.moments(contour)
+        eye_coords[i] = [int(round(M['m01'] / M['m00'])), int(round(M['m10'] / M['m00']))]
+        eye_angles[i] = cv2.fitEllipse(contour)[2] * np.pi / 180
+    return eye_coords[0], eye_coords[1], eye_angles[0], eye_angles[1]
+
+def correct_eye_angles_in_frame(first_eye_coords, second_eye_coords, first_eye_angle, second_eye_angle, heading_coords, swim_bladder_coords, heading_angle, dist_eyes):
+    # Create an array that acts as a contour for the body and contains the swim bladder coordinates and eye coordinates.
+    body_contour = np.array([np.array([swim_bladder_coords[1], swim_bladder_coords[0]]), np.array([first_eye_coords[1], first_eye_coords[0]]), np.array([int(round(heading_coords[1] + (dist_eyes / 2 * np.cos(heading_angle)))), int(round(heading_coords[0] + (dist_eyes / 2 * np.sin(heading_angle))))]), np.array([second_eye_coords[1], second_eye_coords[0]])])
+    # Check to see if the point that is created by drawing a line from the first eye coordinates with a length equal to half of the distance between the eyes is within the body contour. Occasionally, the angle of the eye is flipped to face towards the body instead of away. This is to check whether or not the eye angle should be flipped.
+    if cv2.pointPolygonTest(body_contour, (first_eye_coords[1] + (dist_eyes / 2 * np.cos(first_eye_angle)), first_eye_coords[0] + (dist_eyes / 2 * np.sin(first_eye_angle))), False) == 1:
+        # Flip the first eye angle.
+        if first_eye_angle > 0:
+            first_eye_angle -= np.pi
+        else:
+            first_eye_angle += np.pi
+    # Check to see if the point that is created by drawing a line from the second eye coordinates with a length equal to half of the distance between the eyes is within the body contour.
+    if cv2.pointPolygonTest(body_contour, (second_eye_coords[1] + (dist_eyes / 2 * np.cos(second_eye_angle)), second_eye_coords[0] + (dist_eyes / 2 * np.sin(second_eye_angle))), False) == 1:
+        # Flip the second eye angle.
+        if second_eye_angle > 0:
+            second_eye_angle -= np.pi
+        else:
+            second_eye_angle += np.pi
+    return first_eye_angle, second_eye_angle
+
+def keep_eye_order_in_tracking_records(tracking_records, prev_eye_angle = None):
+    '''
+    Keeps the order of the eyes the same from one tracked frame to the next.
+
+    Steps:
+        Calculates the angle between the first and second eye in each frame that was tracked successfully.
+        Occasionally, the coordinates of the first and second eye switch from one frame to the next. The eyes are switched back when the angle between the eyes changed by more than pi / 2 since the previous tracked frame.
+        The records are changed in place, one frame after the other, so the results do not depend on how the frames were split into batches, processes, or shards.
+            ** Apply it once to each record. Records tracked with a tracking state are already in order.
+
+    Required Arguments:
+        tracking_records (N) - Structured array of tracking records in frame order. See get_tracking_results_dtype.
+
+    Optional Arguments:
+        prev_eye_angle (float) - Angle between the eyes in the last tracked frame before the records. Default = None.
+            ** When prev_eye_angle is None, the order of the eyes in the first tracked frame is kept.
+
+    Returns:
+        prev_eye_angle (float) - Angle between the eyes in the last tracked frame of the records.
+            ** Pass it to the next call to continue the order of the eyes into the next records.
+
+    Usage:
+        tracking_state.prev_eye_angle = keep_eye_order_in_tracking_records(tracking_records, tracking_state.prev_eye_angle)
+    '''
+    first_eye_coords = tracking_records['first_eye_coords']
+    second_eye_coords = tracking_records['second_eye_coords']
+    for i in np.flatnonzero(tracking_records['success']):
+        eye_angle = np.arctan2(second_eye_coords[i, 0] - first_eye_coords[i, 0], second_eye_coords[i, 1] - first_eye_coords[i, 1])
+        if prev_eye_angle is not None and np.pi / 2 < np.abs(eye_angle - prev_eye_angle) < np.pi * 3 / 2:
+            # Switch the eyes and their angles back.
+            first_eye_coords[i], second_eye_coords[i] = second_eye_coords[i].copy(), first_eye_coords[i].copy()
+            tracking_records['first_eye_angle'][i], tracking_records['second_eye_angle'][i] = tracking_records['second_eye_angle'][i], tracking_records['first_eye_angle'][i]
+            eye_angle = np.arctan2(second_eye_coords[i, 0] - first_eye_coords[i, 0], second_eye_coords[i, 1] - first_eye_coords[i, 1])
+        prev_eye_angle = eye_angle
+    return prev_eye_angle
+
+def track_tail_in_frames(frame_stack, valid_frames, n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, pixel_threshold = 100, extended_eyes_calculation = False, eyes_threshold = None, background = None, median_blur_value = 3, tracking_state = None, profiler = None):
+    '''
+    Tracks the eyes, heading, and tail in each frame of a stack of frames.
+
+    Steps:
+        If a background is provided, the background is subtracted from each frame and a median blur filter is applied.
+        The first eye is the brightest pixel in each frame. Frames whose brightest pixel is below the pixel threshold are not tracked.
+        The second eye, swim bladder, and tail points are found with radial searches that run across all frames at once.
+        If the extended eyes calculation is used, the eye angles are calculated separately for each frame. When a tracking state is provided, the order of the eyes is kept the same from frame to frame. See keep_eye_order_in_tracking_records.
+
+    Required Arguments:
+        frame_stack (N, frame height, frame width) - Contiguous stack of uint8 frames.
+        valid_frames (N) - Mask of the frames that were loaded successfully.
+        n_tail_points (int) - Number of tail points.
+        dist_tail_points (int) - Distance between tail points.
+        dist_eyes (int) - Distance between the eyes.
+        dist_swim_bladder (int) - Distance between the eyes and the swim bladder.
+
+    Optional Arguments:
+        pixel_threshold (int) - Minimum pixel value of the eyes in the background subtracted frame. Default = 100.
+        extended_eyes_calculation (bool) - Boolean to determine whether or not to calculate the eye angles. Default = False.
+        eyes_threshold (int) - Threshold used to find the contours of the eyes. Default = None.
+        background (frame width, frame height) - Background that is subtracted from each frame. Default = None.
+            ** When background is None, the frames are expected to already be background subtracted and median blurred.
+        median_blur_value (int) - Aperture size of the median blur filter applied to background subtracted frames. Default = 3.
+        tracking_state (TrackingState) - State carried over from the frames tracked before the stack. Default = None.
+            ** Used to keep the order of the eyes the same as in the previous frames. When tracking_state is None, the order of the eyes is left as found, so that the records of separately tracked stacks can be put in order afterwards with keep_eye_order_in_tracking_records.
+        profiler (TrackingProfiler) - Profiler that times each search and counts the frames that were tracked, skipped by the pixel threshold, failed with an exception, or lost. Default = None.
+
+    Returns:
+        tracking_records (N) - Structured array with one record of tracking results for each frame.
+            ** See get_tracking_results_dtype for the fields of each record.
+    '''
+    if profiler is not None:
+        t = time.perf_counter()
+    frame_stack = np.asarray(frame_stack)
+    tracked_frames = np.array(valid_frames, dtype = bool)
+    n_frames, frame_height, frame_width = frame_stack.shape
+    tracking_records = create_tracking_records(n_frames, n_tail_points)
+    if n_frames == 0:
+        return tracking_records
+
+    if background is not None:
+        # Subtract the background and apply a median blur filter to the frames.
+        frame_stack = subtract_background_from_frame_stack(frame_stack, background)
+        if profiler is not None:
+            t = profiler.add_time('absdiff', t)
+        if median_blur_value > 0:
+            frame_stack = apply_median_blur_to_frame_stack(frame_stack, tracked_frames, median_blur_value)
+            if profiler is not None:
+                t = profiler.add_time('median_blur', t)
+
+    # Return the coordinates of the brightest pixel in each frame.
+    frame_index = np.arange(n_frames)
+    brightest_index = np.argmax(frame_stack.reshape(n_frames, -1), axis = 1)
+    if profiler is not None:
+        # Keep the frames that were loaded, to count the frames that are skipped by the pixel threshold.
+        loaded_frames = tracked_frames.copy()
+    tracked_frames &= frame_stack.reshape(n_frames, -1)[frame_index, brightest_index] > pixel_threshold
+    first_eye_coords = np.stack([brightest_index // frame_width, brightest_index % frame_width], axis = 1)
+    if profiler is not None:
+        # Keep the frames that passed the pixel threshold and mark the frames that fail with an exception, to count the frames where the fish was lost.
+        thresholded_frames = tracked_frames.copy()
+        exception_frames = np.zeros(n_frames, dtype = bool)
+        t = profiler.add_time('first_eye', t)
+    # Calculate the next brightest pixel that lies on the circle drawn around the first eye coordinates and has a radius equal to the distance between the eyes.
+    second_eye_coords, tracked_frames = calculate_next_coords_in_frames(first_eye_coords, dist_eyes, frame_stack, tracked_frames, n_angles = 100, range_angles = 2 * np.pi, tail_calculation = False)
+    if profiler is not None:
+        t = profiler.add_time('second_eye', t)
+    first_eye_coords = first_eye_coords.astype(np.float64)
+    second_eye_coords = second_eye_coords.astype(np.float64)
+    first_eye_angles = np.full(n_frames, np.nan)
+    second_eye_angles = np.full(n_frames, np.nan)
+    if extended_eyes_calculation:
+        # Keep the coordinates of the eyes from the brightest pixels in case the eye angles can not be calculated.
+        brightest_eye_coords = [first_eye_coords.copy(), second_eye_coords.copy()]
+        for i in np.flatnonzero(tracked_frames):
+            try:
+                # Set the eye coordinates to the centroids of the eyes and calculate the eye angles.
+                first_eye_coords[i], second_eye_coords[i], first_eye_angles[i], second_eye_angles[i] = calculate_eye_angles_in_frame(frame_stack[i], [int(first_eye_coords[i, 0]), int(first_eye_coords[i, 1])], [int(second_eye_coords[i, 0]), int(second_eye_coords[i, 1])], eyes_threshold)
+            except:
+                tracked_frames[i] = False
+                if profiler is not None:
+                    exception_frames[i] = True
+        if profiler is not None:
+            t = profiler.add_time('extended_eyes', t)
+    # Find the midpoint of the line that connects both eyes.
+    heading_coords = (first_eye_coords + second_eye_coords) / 2
+    # Find the swim bladder coordinates by finding the next brightest coordinates that lie on a circle around the heading coordinates with a radius equal to the distance between the eyes and the swim bladder.
+    swim_bladder_coords, tracked_frames = calculate_next_coords_in_frames(heading_coords, dist_swim_bladder, frame_stack, tracked_frames, n_angles = 100, range_angles = 2 * np.pi, tail_calculation = False)
+    # Find the body coordinates by finding the center of the triangle that connects the eyes and swim bladder.
+    body_coords = np.round((swim_bladder_coords + first_eye_coords + second_eye_coords) / 3)
+    # Calculate the heading angle as the angle between the body coordinates and the heading coordinates.
+    heading_angles = np.arctan2(heading_coords[:, 0] - body_coords[:, 0], heading_coords[:, 1] - body_coords[:, 1])
+    if profiler is not None:
+        t = profiler.add_time('swim_bladder', t)
+    if extended_eyes_calculation:
+        for i in np.flatnonzero(tracked_frames):
+            try:
+                # Flip the eye angles that face towards the body.
+                first_eye_angles[i], second_eye_angles[i] = correct_eye_angles_in_frame(first_eye_coords[i].astype(int).tolist(), second_eye_coords[i].astype(int).tolist(), first_eye_angles[i], second_eye_angles[i], heading_coords[i], swim_bladder_coords[i].tolist(), heading_angles[i], dist_eyes)
+                if np.isnan(first_eye_angles[i]) or np.isnan(second_eye_angles[i]):
+                    # Return to the eye coordinates from the brightest pixels.
+                    first_eye_coords[i] = brightest_eye_coords[0][i]
+                    second_eye_coords[i] = brightest_eye_coords[1][i]
+                    first_eye_angles[i], second_eye_angles[i] = [np.nan, np.nan]
+            except:
+                tracked_frames[i] = False
+                if profiler is not None:
+                    exception_frames[i] = True
+        if profiler is not None:
+            t = profiler.add_time('extended_eyes', t)
+    # Iterate through the number of tail points.
+    tail_point_coords = np.full((n_frames, n_tail_points + 1, 2), np.nan)
+    tail_point_coords[:, 0] = swim_bladder_coords
+    for m in range(1, n_tail_points + 1):
+        # Check if this is the first tail point.
+        if m == 1:
+            # Calculate the initial tail angle as the angle opposite to the heading angle.
+            tail_angles = np.where(heading_angles > 0, heading_angles - np.pi, heading_angles + np.pi)
+        else:
+            # Calculate the next tail angle as the angle between the last two tail points.
+            tail_angles = np.arctan2(tail_point_coords[:, m - 1, 0] - tail_point_coords[:, m - 2, 0], tail_point_coords[:, m - 1, 1] - tail_point_coords[:, m - 2, 1])
+        # Calculate the next set of tail coordinates.
+        next_coords, tracked_frames = calculate_next_coords_in_frames(tail_point_coords[:, m - 1], dist_tail_points, frame_stack, tracked_frames, angle = tail_angles)
+        tail_point_coords[:, m] = next_coords
+    if profiler is not None:
+        profiler.add_time('tail', t)
+        # Count the outcome of each frame that was loaded.
+        profiler.count('frames_tracked', np.count_nonzero(tracked_frames))
+        profiler.count('frames_skipped_pixel_threshold', np.count_nonzero(loaded_frames & ~thresholded_frames))
+        profiler.count('frames_failed_exception', np.count_nonzero(exception_frames))
+        profiler.count('frames_lost', np.count_nonzero(thresholded_frames & ~tracked_frames & ~exception_frames))
+
+    # Add the tracking results of the frames that were tracked successfully to the records.
+    tracking_records['success'] = tracked_frames
+    for field, values in zip(tracking_records.dtype.names[1:], [first_eye_coords, second_eye_coords, first_eye_angles, second_eye_angles, heading_coords, body_coords, heading_angles, tail_point_coords]):
+        tracking_records[field][tracked_frames] = values[tracked_frames]
+    if extended_eyes_calculation and tracking_state is not None:
+        # Keep the order of the eyes the same from frame to frame, continuing from the previous frames of the state.
+        tracking_state.prev_eye_angle = keep_eye_order_in_tracking_records(tracking_records, tracking_state.prev_eye_angle)
+    return tracking_records
+
 def track_tail_in_frame(tracking_params):
 
     frame, success, n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, pixel_threshold, extended_eyes_calculation, eyes_threshold = tracking_params
-    first_eye_coords = [np.nan, np.nan]
-    second_eye_coords = [np.nan, np.nan]
-    first_eye_angle = np.nan
-    second_eye_angle = np.nan
-    heading_coords = [np.nan, np.nan]
-    body_coords = [np.nan, np.nan]
-    heading_angle = np.nan
-    tail_point_coords = [[np.nan, np.nan] for m in range(n_tail_points + 1)]
     try:
         if success:
-            if np.max(frame) > pixel_threshold:
-                # Return the coordinate of the brightest pixel.
-                first_eye_coords = [np.where(frame == np.max(frame))[0][0], np.where(frame == np.max(frame))[1][0]]
-                # Calculate the next brightest pixel that lies on the circle drawn around the first eye coordinates and has a radius equal to the distance between the eyes.
-                second_eye_coords = calculate_next_coords(first_eye_coords, dist_eyes, frame, n_angles = 100, range_angles = 2 * np.pi, tail_calculation = False)
-                if extended_eyes_calculation:
-                    # Calculate the angle between the two eyes.
-                    eye_angle = np.arctan2(second_eye_coords[0] - first_eye_coords[0], second_eye_coords[1] - first_eye_coords[1])
-                    # Apply a threshold to the frame.
-                    thresh = cv2.threshold(frame, eyes_threshold, 255, cv2.THRESH_BINARY)[1]
-                    # Find the contours of the binary regions in the thresholded frame.
-                    contours = cv2.findContours(thresh, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)[1]
-                    # Iterate through each contour in the list of contours.
-                    for i in range(len(contours)):
-                        # Check if the first eye coordinate are within the current contour.
-                        if cv2.pointPolygonTest(contours[i], (first_eye_coords[1], first_eye_coords[0]), False) == 1:
-                            # Set the first eye coordinates to the centroid of the binary region and calculate the first eye angle.
-                            M = cv2.moments(contours[i])
-                            first_eye_coords = [int(round(M['m01']/M['m00'])), int(round(M['m10']/M['m00']))]
-                            first_eye_angle = cv2.fitEllipse(contours[i])[2] * np.pi / 180
-                        # Check if the second eye coordinate are within the current contour.
-                        if cv2.pointPolygonTest(contours[i], (second_eye_coords[1], second_eye_coords[0]), False) == 1:
-                            # Set the second eye coordinates to the centroid of the binary region and calculate the second eye angle.
-                            M = cv2.moments(contours[i])
-                            second_eye_coords = [int(round(M['m01']/M['m00'])), int(round(M['m10']/M['m00']))]
-                            second_eye_angle = cv2.fitEllipse(contours[i])[2] * np.pi / 180
-                # Find the midpoint of the line that connects both eyes.
-                heading_coords = [(first_eye_coords[0] + second_eye_coords[0]) / 2, (first_eye_coords[1] + second_eye_coords[1]) / 2]
-                # Find the swim bladder coordinates by finding the next brightest coordinates that lie on a circle around the heading coordinates with a radius equal to the distance between the eyes and the swim bladder.
-                tail_point_coords[0] = calculate_next_coords(heading_coords, dist_swim_bladder, frame, n_angles = 100, range_angles = 2 * np.pi, tail_calculation = False)
-                # Find the body coordinates by finding the center of the triangle that connects the eyes and swim bladder.
-                body_coords = [int(round((tail_point_coords[0][0] + first_eye_coords[0] + second_eye_coords[0]) / 3)), int(round((tail_point_coords[0][1] + first_eye_coords[1] + second_eye_coords[1]) / 3))]
-                # Calculate the heading angle as the angle between the body coordinates and the heading coordinates.
-                heading_angle = np.arctan2(heading_coords[0] - body_coords[0], heading_coords[1] - body_coords[1])
-                # Check whether to to an additional process to calculate eye angles.
-                if extended_eyes_calculation:
-                    # Create an array that acts as a contour for the body and contains the swim bladder coordinates and eye coordinates.
-                    body_contour = np.array([np.array([tail_point_coords[0][1], tail_point_coords[0][0]]), np.array([first_eye_coords[1], first_eye_coords[0]]), np.array([int(round(heading_coords[1] + (dist_eyes / 2 * np.cos(heading_angle)))), int(round(heading_coords[0] + (dist_eyes / 2 * np.sin(heading_angle))))]), np.array([second_eye_coords[1], second_eye_coords[0]])])
-                    # Check to see if the point that is created by drawing a line from the first eye coordinates with a length equal to half of the distance between the eyes is within the body contour. Occasionally, the angle of the eye is flipped to face towards the body instead of away. This is to check whether or not the eye angle should be flipped.
-                    if cv2.pointPolygonTest(body_contour, (first_eye_coords[1] + (dist_eyes / 2 * np.cos(first_eye_angle)), first_eye_coords[0] + (dist_eyes / 2 * np.sin(first_eye_angle))), False) == 1:
-                        # Flip the first eye angle.
-                        if first_eye_angle > 0:
-                            first_eye_angle -= np.pi
-                        else:
-                            first_eye_angle += np.pi
-                    # Check to see if the point that is created by drawing a line from the first eye coordinates with a length equal to half of the distance between the eyes is within the body contour. Occasionally, the angle of the eye is flipped to face towards the body instead of away. This is to check whether or not the eye angle should be flipped.
-                    if cv2.pointPolygonTest(body_contour, (second_eye_coords[1] + (dist_eyes / 2 * np.cos(second_eye_angle)), second_eye_coords[0] + (dist_eyes / 2 * np.sin(second_eye_angle))), False) == 1:
-                        # Flip the second eye angle.
-                        if second_eye_angle > 0:
-                            second_eye_angle -= np.pi
-                        else:
-                            second_eye_angle += np.pi
-                    if np.isnan(first_eye_angle) or np.isnan(second_eye_angle):
-                        # Return the coordinate of the brightest pixel.
-                        first_eye_coords = [np.where(frame == np.max(frame))[0][0], np.where(frame == np.max(frame))[1][0]]
-                        # Calculate the next brightest pixel that lies on the circle drawn around the first eye coordinates and has a radius equal to the distance between the eyes.
-                        second_eye_coords = calculate_next_coords(first_eye_coords, dist_eyes, frame, n_angles = 100, range_angles = 2 * np.pi, tail_calculation = False)
-                        first_eye_angle, second_eye_angle = [np.nan, np.nan]
-                # Iterate through the number of tail points.
-                for m in range(1, n_tail_points + 1):
-                    # Check if this is the first tail point.
-                    if m == 1:
-                        # Calculate the initial tail angle as the angle opposite to the heading angle.
-                        if heading_angle > 0:
-                            tail_angle = heading_angle - np.pi
-                        else:
-                            tail_angle = heading_angle + np.pi
-                    else:
-                        # Calculate the next tail angle as the angle between the last two tail points.
-                        tail_angle = np.arctan2(tail_point_coords[m - 1][0] - tail_point_coords[m - 2][0], tail_point_coords[m - 1][1] - tail_point_coords[m - 2][1])
-                    # Calculate the next set of tail coordinates.
-                    tail_point_coords[m] = calculate_next_coords(tail_point_coords[m - 1], dist_tail_points, frame, angle = tail_angle)
-                tracking_results = np.array([np.array(first_eye_coords), np.array(second_eye_coords), first_eye_angle, second_eye_angle, np.array(heading_coords), np.array(body_coords), heading_angle, np.array(tail_point_coords)])
-                # if not np.isnan(np.hstack(tracking_results).any()):
-                return tracking_results
-                # else:
-                    # return None
-            else:
-                return None
+            # Track the background subtracted, median blurred frame on its own.
+            fish_tracker = FishTracker(n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, pixel_threshold = pixel_threshold, extended_eyes_calculation = extended_eyes_calculation, eyes_threshold = eyes_threshold)
+            return convert_tracking_record_to_results(fish_tracker.track_frame(frame, preprocessed = True))
         else:
             return None
     except:
         return None
 
-def track_tail_in_video_with_multiprocessing(video_path, colours, n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, init_frame_batch_size = 50, init_starting_frame = 0, save_path = None, background_path = None, save_background = False, line_length = 0, video_fps = None, n_frames = None, pixel_threshold = 100, frame_change_threshold = 10):
+def get_tracking_roi(center_coords, roi_radius, frame_height, frame_width):
+    # Return the boundaries [top, bottom, left, right] of a square region of interest centered on a set of coordinates. The region is clipped to the boundaries of the frame. Returns None if the coordinates are not known.
+    if center_coords is None or np.any(np.isnan(center_coords)):
+        return None
+    center_y, center_x = int(round(center_coords[0])), int(round(center_coords[1]))
+    roi = [max(center_y - roi_radius, 0), min(center_y + roi_radius + 1, frame_height), max(center_x - roi_radius, 0), min(center_x + roi_radius + 1, frame_width)]
+    # Keep the top left corner on even coordinates. Coordinates that end in .5 are rounded to the nearest even number, so an even offset rounds the same way inside the region of interest as in the frame.
+    roi[0] -= roi[0] % 2
+    roi[2] -= roi[2] % 2
+    if roi[0] >= roi[1] or roi[2] >= roi[3]:
+        return None
+    return roi
+
+def get_tracking_roi_radius(n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, roi_margin = None):
+    # Return the radius of the region of interest used to track a fish. The radius is equal to the length of the fish measured from the heading coordinates plus a margin that accounts for the movement of the fish between frames and the radius of the searches.
+    if roi_margin is None:
+        roi_margin = 2 * max(dist_tail_points, dist_eyes, dist_swim_bladder)
+    return int(np.ceil(n_tail_points * dist_tail_points + dist_swim_bladder + roi_margin))
 
-    t0 = time.time()
+def track_tail_in_frame_with_roi(frame, background, previous_heading_coords, roi_radius, n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, pixel_threshold = 100, extended_eyes_calculation = False, eyes_threshold = None, median_blur_value = 3, tracking_state = None):
+    '''
+    Tracks the eyes, heading, and tail in a region of interest around the last known position of the fish.
 
-    # Create or load background image.
-    if background_path is None:
-        background = calculate_background(video_path, save_path, save_background = save_background)[0].astype(np.uint8)
+    Steps:
+        A square region of interest is centered on the heading coordinates of the fish in the previous frame.
+        The background is subtracted and a median blur filter is applied inside the region of interest only.
+        The fish is tracked inside the region of interest and the coordinates are offset back into the frame.
+        If the fish was not tracked in the previous frame, cannot be found inside the region of interest, or any tracked point lies too close to the edge of the region of interest, the full frame is tracked instead.
+
+    Required Arguments:
+        frame (frame width, frame height) - Grayscale frame.
+        background (frame width, frame height) - Background that is subtracted from the frame.
+        previous_heading_coords ([y, x]) - Heading coordinates of the fish in the previous frame.
+            ** When previous_heading_coords is None or NaN, the full frame is tracked.
+        roi_radius (int) - Half of the width of the region of interest.
+            ** Use get_tracking_roi_radius to calculate the radius from the size of the fish.
+        n_tail_points (int) - Number of tail points.
+        dist_tail_points (int) - Distance between tail points.
+        dist_eyes (int) - Distance between the eyes.
+        dist_swim_bladder (int) - Distance between the eyes and the swim bladder.
+
+    Optional Arguments:
+        pixel_threshold (int) - Minimum pixel value of the eyes in the background subtracted frame. Default = 100.
+        extended_eyes_calculation (bool) - Boolean to determine whether or not to calculate the eye angles. Default = False.
+        eyes_threshold (int) - Threshold used to find the contours of the eyes. Default = None.
+        median_blur_value (int) - Aperture size of the median blur filter applied to the background subtracted frame. Default = 3.
+        tracking_state (TrackingState) - State carried over from the previous frames. Default = None.
+            ** See track_tail_in_frames.
+
+    Returns:
+        tracking_record - Record of tracking results for the frame.
+            ** See get_tracking_results_dtype for the fields of the record.
+        roi_tracked (bool) - Boolean that is True when the frame was tracked inside the region of interest.
+            ** When the fish is inside the region of interest, the results are identical to tracking the full frame, except when a brighter object lies outside of the region of interest.
+    '''
+    frame_height, frame_width = frame.shape[:2]
+    roi = get_tracking_roi(previous_heading_coords, roi_radius, frame_height, frame_width)
+    if roi is not None:
+        top, bottom, left, right = roi
+        # Extend the region of interest by the radius of the median blur filter so that the filtered pixels inside the region of interest match the filtered frame.
+        blur_radius = median_blur_value // 2
+        padded_roi = [max(top - blur_radius, 0), min(bottom + blur_radius, frame_height), max(left - blur_radius, 0), min(right + blur_radius, frame_width)]
+        roi_frame = cv2.absdiff(frame[padded_roi[0]:padded_roi[1], padded_roi[2]:padded_roi[3]], background[padded_roi[0]:padded_roi[1], padded_roi[2]:padded_roi[3]])
+        if median_blur_value > 0:
+            roi_frame = cv2.medianBlur(roi_frame, median_blur_value)
+        roi_frame = np.ascontiguousarray(roi_frame[top - padded_roi[0]:bottom - padded_roi[0], left - padded_roi[2]:right - padded_roi[2]])
+        # Track a copy of the state so that the state is only changed by the tracking results that are kept.
+        roi_tracking_state = None if tracking_state is None else tracking_state.copy()
+        tracking_record = track_tail_in_frames(roi_frame[np.newaxis], [True], n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, pixel_threshold = pixel_threshold, extended_eyes_calculation = extended_eyes_calculation, eyes_threshold = eyes_threshold, tracking_state = roi_tracking_state)[0]
+        if tracking_record['success']:
+            # Check that every tracked point is far enough from the edges of the region of interest that the searches around it stayed inside the region of interest.
+            search_margin = max(dist_tail_points, dist_eyes, dist_swim_bladder) + 1
+            tracked_coords = np.concatenate([[tracking_record['first_eye_coords'], tracking_record['second_eye_coords'], tracking_record['heading_coords']], tracking_record['tail_point_coords']])
+            if np.all(tracked_coords >= search_margin) and np.all(tracked_coords < np.array([bottom - top, right - left]) - search_margin):
+                # Offset the coordinates from the region of interest into the frame.
+                roi_offset = np.array([top, left], dtype = np.float64)
+                for field in ['first_eye_coords', 'second_eye_coords', 'heading_coords', 'body_coords', 'tail_point_coords']:
+                    tracking_record[field] += roi_offset
+                if tracking_state is not None:
+                    tracking_state.prev_eye_angle = roi_tracking_state.prev_eye_angle
+                return tracking_record, True
+    # Track the full frame when the fish could not be tracked inside the region of interest.
+    tracking_record = track_tail_in_frames(frame[np.newaxis], [True], n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, pixel_threshold = pixel_threshold, extended_eyes_calculation = extended_eyes_calculation, eyes_threshold = eyes_threshold, background = background, median_blur_value = median_blur_value, tracking_state = tracking_state)[0]
+    return tracking_record, False
+
+def convert_tracking_record_to_results(tracking_record):
+    # Convert a record of tracking results into the list of results used for annotating a frame. Coordinates of pixels are converted to integers. Returns None if the frame was not tracked successfully.
+    if not tracking_record['success']:
+        return None
+    return np.array([tracking_record['first_eye_coords'].astype(np.int64), tracking_record['second_eye_coords'].astype(np.int64), tracking_record['first_eye_angle'], tracking_record['second_eye_angle'], tracking_record['heading_coords'], tracking_record['body_coords'].astype(np.int64), tracking_record['heading_angle'], tracking_record['tail_point_coords'].astype(np.int64)], dtype = object)
+
+class TrackingState():
+    '''
+    State that is carried from one frame to the next while a video is tracked by a FishTracker.
+
+    Optional Arguments:
+        motion_gate (MotionGate) - Motion gate that holds the last tracked frame and decides whether a frame changed enough to be tracked again. Default = None.
+            ** When motion_gate is None, every frame is tracked.
+
+    Attributes:
+        prev_eye_angle (float) - Angle between the eyes in the last tracked frame. Used to keep the order of the eyes the same between frames.
+        prev_tracking_record - Record of tracking results of the previous frame. Reused when the frame did not change.
+        motion_gate (MotionGate) - Motion gate that holds the previous frame.
+        n_frames (int) - Number of frames that have been tracked with the state.
+        n_roi_frames (int) - Number of frames that were tracked inside a region of interest.
+    '''
+
+    def __init__(self, motion_gate = None):
+        self.motion_gate = motion_gate
+        self.reset()
+
+    def reset(self):
+        # Forget the previous frames.
+        self.prev_eye_angle = None
+        self.prev_tracking_record = None
+        self.n_frames = 0
+        self.n_roi_frames = 0
+        if self.motion_gate is not None:
+            self.motion_gate.reset()
+
+    def copy(self):
+        # Copy the state without the motion gate.
+        tracking_state = TrackingState()
+        tracking_state.prev_eye_angle = self.prev_eye_angle
+        tracking_state.prev_tracking_record = self.prev_tracking_record
+        tracking_state.n_frames = self.n_frames
+        tracking_state.n_roi_frames = self.n_roi_frames
+        return tracking_state
+
+    def get_previous_heading_coords(self):
+        # Return the heading coordinates of the previous frame, or None if the fish was not tracked in the previous frame.
+        if self.prev_tracking_record is None or not self.prev_tracking_record['success']:
+            return None
+        return self.prev_tracking_record['heading_coords']
+
+class FishTracker():
+    '''
+    Tracks the eyes, heading, and tail of a fish in single frames or stacks of frames. Every way of tracking a video uses a FishTracker, so that they all give the same results.
+
+    Steps:
+        Frames are converted to grayscale, the background is subtracted, and a median blur filter is applied, unless the frames are already preprocessed.
+        Stacks of frames are tracked at once with track_tail_in_frames.
+        Single frames are tracked with a TrackingState that holds the previous frame, the previous eye angle, and the previous tracking results.
+            ** If the state has a motion gate and the frame did not change since the last tracked frame, the previous tracking results are reused.
+            ** If a region of interest radius is provided, the frame is tracked inside a region of interest around the previous heading coordinates with track_tail_in_frame_with_roi.
+
+    Required Arguments:
+        n_tail_points (int) - Number of tail points.
+        dist_tail_points (int) - Distance between tail points.
+        dist_eyes (int) - Distance between the eyes.
+        dist_swim_bladder (int) - Distance between the eyes and the swim bladder.
+
+    Optional Arguments:
+        pixel_threshold (int) - Minimum pixel value of the eyes in the background subtracted frame. Default = 100.
+        extended_eyes_calculation (bool) - Boolean to determine whether or not to calculate the eye angles. Default = False.
+        eyes_threshold (int) - Threshold used to find the binary regions that contain the eyes. Default = None.
+        background (frame width, frame height) - Background that is subtracted from each frame. Default = None.
+            ** When background is None, frames must be background subtracted and median blurred before they are tracked.
+        median_blur_value (int) - Aperture size of the median blur filter applied to background subtracted frames. Default = 3.
+        roi_radius (int) - Half of the width of the region of interest used to track single frames. Default = None.
+            ** When roi_radius is None, the full frame is tracked. See get_tracking_roi_radius.
+            ** Only used for frames that are not preprocessed.
+        profiler (TrackingProfiler) - Profiler that times the stages of tracking and counts the outcome of each frame. Default = None.
+            ** Frames tracked inside a region of interest are timed as a whole and counted as tracked or lost.
+
+    Usage:
+        fish_tracker = FishTracker(n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, background = background)
+        tracking_state = fish_tracker.create_state(frame_change_threshold)
+        for success, frame in frame_reader:
+            tracking_record = fish_tracker.track_frame(frame, tracking_state)
+    '''
+
+    def __init__(self, n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, pixel_threshold = 100, extended_eyes_calculation = False, eyes_threshold = None, background = None, median_blur_value = 3, roi_radius = None, profiler = None):
+        self.n_tail_points = n_tail_points
+        self.dist_tail_points = dist_tail_points
+        self.dist_eyes = dist_eyes
+        self.dist_swim_bladder = dist_swim_bladder
+        self.pixel_threshold = pixel_threshold
+        self.extended_eyes_calculation = extended_eyes_calculation
+        self.eyes_threshold = eyes_threshold
+        self.background = background
+        self.median_blur_value = median_blur_value
+        self.roi_radius = roi_radius
+        self.profiler = profiler
+
+    def get_tracking_params(self):
+        # Return the positional and keyword arguments of track_tail_in_frames.
+        tracking_params = [self.n_tail_points, self.dist_tail_points, self.dist_eyes, self.dist_swim_bladder]
+        tracking_kwargs = {'pixel_threshold' : self.pixel_threshold, 'extended_eyes_calculation' : self.extended_eyes_calculation, 'eyes_threshold' : self.eyes_threshold, 'background' : self.background, 'median_blur_value' : self.median_blur_value}
+        return tracking_params, tracking_kwargs
+
+    def create_state(self, frame_change_threshold = None, motion_gate = None):
+        # Create the state used to track the frames of a video in order. When a frame change threshold or a motion gate is provided, frames that did not change reuse the previous tracking results. With a region of interest, the motion gate created from the frame change threshold compares the region of interest around the fish.
+        if motion_gate is None and frame_change_threshold is not None:
+            motion_gate = MotionGate(frame_change_threshold, roi_radius = self.roi_radius)
+        return TrackingState(motion_gate)
+
+    def preprocess_frame(self, frame):
+        # Convert the frame to grayscale, subtract the background, and apply the median blur filter.
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if self.background is not None:
+            frame = cv2.absdiff(frame, self.background)
+            if self.median_blur_value > 0:
+                frame = cv2.medianBlur(frame, self.median_blur_value)
+        return frame
+
+    def track_frames(self, frame_stack, valid_frames, tracking_state = None, preprocessed = False):
+        '''
+        Tracks a stack of frames.
+
+        Required Arguments:
+            frame_stack (N, frame height, frame width) - Contiguous stack of uint8 grayscale frames.
+            valid_frames (N) - Mask of the frames that were loaded successfully.
+
+        Optional Arguments:
+            tracking_state (TrackingState) - State carried over from the frames tracked before the stack. Default = None.
+                ** The motion gate of the state is not used for stacks of frames.
+            preprocessed (bool) - Boolean that is True when the frames are already background subtracted and median blurred. Default = False.
+
+        Returns:
+            tracking_records (N) - Structured array with one record of tracking results for each frame.
+        '''
+        tracking_params, tracking_kwargs = self.get_tracking_params()
+        if preprocessed:
+            tracking_kwargs['background'] = None
+        tracking_records = track_tail_in_frames(frame_stack, valid_frames, *tracking_params, tracking_state = tracking_state, profiler = self.profiler, **tracking_kwargs)
+        if tracking_state is not None and len(tracking_records) > 0:
+            tracking_state.prev_tracking_record = tracking_records[-1].copy()
+            tracking_state.n_frames += len(tracking_records)
+        return tracking_records
+
+    def track_frame(self, frame, tracking_state = None, preprocessed = False):
+        '''
+        Tracks a single frame.
+
+        Steps:
+            The frame is converted to grayscale. Unless a region of interest is used, the frame is also preprocessed if needed.
+            If the motion gate of the state finds that the frame did not change since the last tracked frame, the previous tracking results are reused. Without a region of interest, the brightest pixel of the frame must also be above the pixel threshold.
+            Otherwise, if the frame is not preprocessed and a region of interest radius is provided, the frame is tracked inside a region of interest around the previous heading coordinates. If not, the full frame is tracked.
+            The motion gate takes the frame as its reference when the frame was tracked successfully, and the state is updated with the tracking results of the frame.
+
+        Required Arguments:
+            frame (frame width, frame height) - Grayscale or BGR frame.
+
+        Optional Arguments:
+            tracking_state (TrackingState) - State carried over from the previous frames. Default = None.
+                ** When tracking_state is None, the frame is tracked on its own.
+            preprocessed (bool) - Boolean that is True when the frame is already background subtracted and median blurred. Default = False.
+                ** With a region of interest, the motion gate compares grayscale frames, since only the region of interest is background subtracted.
+
+        Returns:
+            tracking_record - Record of tracking results for the frame. See get_tracking_results_dtype.
+        '''
+        if tracking_state is None:
+            tracking_state = TrackingState()
+        profiler = self.profiler
+        use_roi = not preprocessed and self.roi_radius is not None and self.background is not None
+        if use_roi:
+            if frame.ndim == 3:
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        elif not preprocessed:
+            frame = self.preprocess_frame(frame)
+        motion_gate = tracking_state.motion_gate
+        if profiler is not None:
+            t = time.perf_counter()
+        # Check whether the frame changed since the last tracked frame. Frames that did not change reuse the previous tracking results. This helps reduce frame to frame noise in the position of the pixels. Without a region of interest, the maximum pixel value must also be greater than the pixel threshold.
+        frame_unchanged = motion_gate is not None and (use_roi or np.max(frame) > self.pixel_threshold) and not motion_gate.check_frame(frame)
+        if profiler is not None and motion_gate is not None:
+            t = profiler.add_time('motion_gate', t)
+        if frame_unchanged:
+            tracking_record = tracking_state.prev_tracking_record.copy()
+            if profiler is not None:
+                profiler.count('frames_skipped_frame_change')
+        elif use_roi:
+            # Track the frame inside a region of interest around the position of the fish in the previous frame.
+            tracking_record, roi_tracked = track_tail_in_frame_with_roi(frame, self.background, tracking_state.get_previous_heading_coords(), self.roi_radius, self.n_tail_points, self.dist_tail_points, self.dist_eyes, self.dist_swim_bladder, pixel_threshold = self.pixel_threshold, extended_eyes_calculation = self.extended_eyes_calculation, eyes_threshold = self.eyes_threshold, median_blur_value = self.median_blur_value, tracking_state = tracking_state)
+            tracking_state.n_roi_frames += roi_tracked
+            if profiler is not None:
+                profiler.add_time('roi_tracking', t)
+                profiler.count('frames_tracked' if tracking_record['success'] else 'frames_lost')
+        else:
+            tracking_params, tracking_kwargs = self.get_tracking_params()
+            tracking_kwargs['background'] = None
+            tracking_record = track_tail_in_frames(frame[np.newaxis], [True], *tracking_params, tracking_state = tracking_state, profiler = profiler, **tracking_kwargs)[0]
+        if motion_gate is not None and not frame_unchanged and tracking_record['success']:
+            # Set the frame that the next frames are compared to.
+            motion_gate.update_reference(frame, tracking_record['heading_coords'])
+        tracking_state.prev_tracking_record = tracking_record
+        tracking_state.n_frames += 1
+        return tracking_record
+
+def get_tracking_results_dtype(n_tail_points):
+    '''
+    Returns the fixed-width record layout used to store the tracking results of a single frame.
+
+    Required Arguments:
+        n_tail_points (int) - Number of tail points.
+
+    Returns:
+        tracking_results_dtype (numpy.dtype) - Structured dtype with one field for each tracked feature.
+            ** The tail point coordinates field contains the swim bladder coordinates followed by the tail point coordinates.
+    '''
+    tracking_results_dtype = np.dtype([ ('success', np.bool_),
+                                        ('first_eye_coords', np.float64, (2,)),
+                                        ('second_eye_coords', np.float64, (2,)),
+                                        ('first_eye_angle', np.float64),
+                                        ('second_eye_angle', np.float64),
+                                        ('heading_coords', np.float64, (2,)),
+                                        ('body_coords', np.float64, (2,)),
+                                        ('heading_angle', np.float64),
+                                        ('tail_point_coords', np.float64, (n_tail_points + 1, 2))
+                                        ])
+    return tracking_results_dtype
+
+def create_tracking_records(n_frames, n_tail_points):
+    # Create an array of records where every tracked feature is NaN and no frame has been tracked successfully.
+    tracking_records = np.zeros(n_frames, dtype = get_tracking_results_dtype(n_tail_points))
+    for field in tracking_records.dtype.names[1:]:
+        tracking_records[field] = np.nan
+    return tracking_records
+
+def convert_tracking_records_to_results(tracking_records):
+    # Convert an array of records into the arrays that make up the results of tracking a video.
+    results =   {   'eye_coord_array' : np.stack([tracking_records['first_eye_coords'], tracking_records['second_eye_coords']], axis = 1),
+                    'eye_angle_array' : np.stack([tracking_records['first_eye_angle'], tracking_records['second_eye_angle']], axis = 1),
+                    'heading_coord_array' : tracking_records['heading_coords'].copy(),
+                    'tail_coord_array' : tracking_records['tail_point_coords'].copy(),
+                    'body_coord_array' : tracking_records['body_coords'].copy(),
+                    'heading_angle_array' : tracking_records['heading_angle'].copy()
+                }
+    return results
+
+# Names of the arrays of tracking results that are saved as separate files.
+tracking_results_array_names = ['eye_coord_array', 'eye_angle_array', 'heading_coord_array', 'tail_coord_array', 'body_coord_array', 'heading_angle_array']
+
+# Names of the arrays that are saved as separate files alongside the tracking results when the tracking is profiled. See TrackingProfiler.
+profiling_array_names = ['frame_time_array']
+
+def save_tracking_results(results, results_path):
+    '''
+    Saves the results of tracking a video in a columnar format.
+
+    Steps:
+        Creates a folder that will contain the results.
+        Saves each array of tracking results as a separate float32 .npy file.
+        Saves the tracking parameters and video attributes to a metadata.json file.
+
+    Required Arguments:
+        results (dict) - Dictionary that contains the tracking results and tracking parameters.
+        results_path (str) - Path to the folder that will contain the results.
+
+    Returns:
+        results_path (str) - Path to the folder that contains the results.
+    '''
+    if not os.path.isdir(results_path):
+        os.makedirs(results_path)
+    metadata = {'format_version' : 1}
+    for key, value in results.items():
+        if key in tracking_results_array_names or key in profiling_array_names:
+            # Save the array as a fixed-dtype file with one row per frame.
+            np.save(os.path.join(results_path, '{0}.npy'.format(key)), np.asarray(value, dtype = np.float32))
+        else:
+            metadata[key] = value
+    # Save the tracking parameters. Numpy values are converted to lists and numbers.
+    with open(os.path.join(results_path, 'metadata.json'), 'w') as f:
+        json.dump(metadata, f, indent = 4, default = lambda value: value.tolist() if hasattr(value, 'tolist') else str(value))
+    return results_path
+
+def load_tracking_results(results_path, mmap_mode = 'r'):
+    '''
+    Loads the results of tracking a video.
+
+    Steps:
+        If the results path is a folder, or a metadata.json file inside of a folder, of columnar results, the tracking parameters are loaded from the metadata.json file and each array of tracking results is memory-mapped.
+        Otherwise, the results path is loaded as a .npy file that contains a dictionary of results.
+
+    Required Arguments:
+        results_path (str) - Path to the folder of results, the metadata.json file inside of the folder, or a .npy file.
+
+    Optional Arguments:
+        mmap_mode (str) - Mode used to memory-map the arrays of tracking results. Default = 'r'.
+            ** Use 'c' to be able to modify the arrays in memory without modifying the files.
+            ** When mmap_mode is None, the arrays are loaded into memory.
+
+    Returns:
+        results (dict) - Dictionary that contains the tracking results and tracking parameters.
+    '''
+    if os.path.basename(results_path) == 'metadata.json':
+        results_path = os.path.dirname(results_path)
+    if os.path.isdir(results_path):
+        with open(os.path.join(results_path, 'metadata.json'), 'r') as f:
+            results = json.load(f)
+        for key in tracking_results_array_names + profiling_array_names:
+            array_path = os.path.join(results_path, '{0}.npy'.format(key))
+            if os.path.exists(array_path):
+                results[key] = np.load(array_path, mmap_mode = mmap_mode)
     else:
-        background = cv2.imread(background_path, cv2.IMREAD_GRAYSCALE).astype(np.uint8)
+        # Load results saved as a dictionary.
+        results = np.load(results_path, allow_pickle = True).item()
+        for key in tracking_results_array_names:
+            if key in results:
+                try:
+                    results[key] = np.asarray(results[key], dtype = np.float64)
+                except ValueError:
+                    pass
+    return results
 
-    video_n_frames = get_total_frame_number_from_video(video_path)
-    starting_frame = init_starting_frame
-    frame_batch_size = init_frame_batch_size
+# State of a worker process in the tracking pool. Set once by the pool initializer.
+_tracking_pool_worker_state = {}
+
+def _initialize_tracking_pool_worker(shared_memory_name, frame_buffer_shape, tracking_params, tracking_kwargs):
+    # Attach to the shared memory block created by the main process and wrap it as an array of frame slots.
+    if shared_memory_name is not None:
+        frame_buffer_memory = shared_memory.SharedMemory(name = shared_memory_name)
+        _tracking_pool_worker_state['shared_memory'] = frame_buffer_memory
+        _tracking_pool_worker_state['frame_buffer'] = np.ndarray(frame_buffer_shape, dtype = np.uint8, buffer = frame_buffer_memory.buf)
+    _tracking_pool_worker_state['fish_tracker'] = FishTracker(*tracking_params, **tracking_kwargs)
+
+def _track_tail_in_shared_frames(slot_params):
+    # Track the range of frames stored in consecutive slots of the shared frame buffer.
+    first_slot, valid_frames = slot_params
+    frame_stack = _tracking_pool_worker_state['frame_buffer'][first_slot:first_slot + len(valid_frames)]
+    return _tracking_pool_worker_state['fish_tracker'].track_frames(frame_stack, valid_frames).tobytes()
+
+def _track_tail_in_frames_to_records(tracking_params):
+    # Track a stack of frames that was sent to the worker directly.
+    frame_stack, valid_frames, tracking_params, tracking_kwargs = tracking_params
+    return FishTracker(*tracking_params, **tracking_kwargs).track_frames(frame_stack, valid_frames).tobytes()
+
+class TrackingPool():
+    '''
+    Long-lived pool of worker processes used to track batches of frames.
+
+    Steps:
+        The worker processes are started once and are reused for every batch of frames.
+        Frames are read into slots of a ring buffer held in shared memory so that workers only receive the index of the first slot and a mask of valid frames.
+        Each worker subtracts the background, applies the median blur filter, and tracks its range of slots with track_tail_in_frames.
+        The tracking results are returned as fixed-width records.
+            ** Each range of slots is tracked without the frames before it. When the extended eyes calculation is used, apply keep_eye_order_in_tracking_records to the collected records in frame order.
+        If shared memory is not available, the frames are sent to the workers directly.
+
+    Required Arguments:
+        frame_shape (frame height, frame width) - Shape of the frames that will be tracked.
+        n_slots (int) - Number of frames that the ring buffer can hold.
+        n_tail_points (int) - Number of tail points.
+        dist_tail_points (int) - Distance between tail points.
+        dist_eyes (int) - Distance between the eyes.
+        dist_swim_bladder (int) - Distance between the eyes and the swim bladder.
+
+    Optional Arguments:
+        pixel_threshold (int) - Minimum pixel value of the eyes in the background subtracted frame. Default = 100.
+        extended_eyes_calculation (bool) - Boolean to determine whether or not to calculate the eye angles. Default = False.
+        eyes_threshold (int) - Threshold used to find the contours of the eyes. Default = None.
+        background (frame width, frame height) - Background that is subtracted from each frame by the workers. Default = None.
+        n_processes (int) - Number of worker processes. Default = None.
+            ** When n_processes is None, the number of worker processes is equal to the number of CPUs.
+
+    Usage:
+        tracking_pool = TrackingPool(frame_shape, n_slots, n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, background = background)
+        frame_stack, valid_frames = frame_reader.read_stack(n_frames, frame_stack = tracking_pool.frame_buffer[0:n_frames])
+        tracking_records = tracking_pool.collect(tracking_pool.submit(0, valid_frames))
+        tracking_pool.close()
+    '''
+
+    def __init__(self, frame_shape, n_slots, n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, pixel_threshold = 100, extended_eyes_calculation = False, eyes_threshold = None, background = None, n_processes = None):
+        if n_processes is None:
+            n_processes = mp.cpu_count()
+        self.n_processes = n_processes
+        self.n_slots = n_slots
+        self.tracking_records_dtype = get_tracking_results_dtype(n_tail_points)
+        self.tracking_params = [n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder]
+        self.tracking_kwargs = {'pixel_threshold' : pixel_threshold, 'extended_eyes_calculation' : extended_eyes_calculation, 'eyes_threshold' : eyes_threshold, 'background' : background}
+        frame_buffer_shape = (n_slots,) + tuple(frame_shape)
+        self.shared_memory = None
+        if shared_memory is not None:
+            # Create the ring buffer of frames in shared memory.
+            self.shared_memory = shared_memory.SharedMemory(create = True, size = int(np.prod(frame_buffer_shape)))
+            self.frame_buffer = np.ndarray(frame_buffer_shape, dtype = np.uint8, buffer = self.shared_memory.buf)
+            self.pool = mp.Pool(n_processes, initializer = _initialize_tracking_pool_worker, initargs = (self.shared_memory.name, frame_buffer_shape, self.tracking_params, self.tracking_kwargs))
+        else:
+            # Keep the ring buffer in the main process and send the frames to the workers with each batch.
+            self.frame_buffer = np.zeros(frame_buffer_shape, dtype = np.uint8)
+            self.pool = mp.Pool(n_processes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(self, first_slot, valid_frames):
+        # Start tracking a batch of frames stored in consecutive slots without waiting for the results. The batch must not wrap around the end of the ring buffer and is split into ranges of slots, one for each task.
+        chunksize = max(1, int(np.ceil(len(valid_frames) / (self.n_processes * 2))))
+        slot_params = [(first_slot + i, list(valid_frames[i:i + chunksize])) for i in range(0, len(valid_frames), chunksize)]
+        if self.shared_memory is not None:
+            return self.pool.map_async(_track_tail_in_shared_frames, slot_params)
+        return self.pool.map_async(_track_tail_in_frames_to_records, [(self.frame_buffer[slot:slot + len(valid)], valid, self.tracking_params, self.tracking_kwargs) for slot, valid in slot_params])
+
+    def collect(self, async_result):
+        # Wait for a batch to finish and join the records returned by the workers.
+        return np.frombuffer(b''.join(async_result.get()), dtype = self.tracking_records_dtype).copy()
+
+    def close(self):
+        # Stop the worker processes and release the shared memory.
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.shared_memory is not None:
+            self.frame_buffer = None
+            self.shared_memory.close()
+            self.shared_memory.unlink()
+            self.shared_memory = None
+
+# Default number of frames in each chunk of tracking results saved to a checkpoint.
+default_checkpoint_frames = 10000
+
+def get_checkpoint_path(video_path, save_path = None):
+    # Return the path of the checkpoint folder of a video. The checkpoint is saved in the save path, or next to the video when the save path is None.
+    if save_path is None:
+        save_path = os.path.dirname(video_path)
+    return os.path.join(save_path, '{0}_checkpoint'.format(os.path.splitext(os.path.basename(video_path))[0]))
+
+def get_tracking_results_frame_bytes(n_tail_points):
+    # Return the number of bytes used by each frame in the arrays of a TrackingResultsAccumulator: the float32 eye coordinates, eye angles, heading coordinates, tail coordinates, body coordinates and heading angle, and the success flag.
+    return np.dtype(np.float32).itemsize * (2 * 2 + 2 + 2 + (n_tail_points + 1) * 2 + 2 + 1) + np.dtype(np.bool_).itemsize
+
+class TrackingResultsAccumulator():
+    '''
+    Collects the tracking results of a video frame by frame into arrays that are allocated once.
+
+    Steps:
+        Allocates a float32 array for each array of tracking results, with one row for each frame. Untracked features are NaN.
+        Writes the tracking record of each frame into the next row of the arrays in place.
+        Returns the collected rows as an array of tracking records for a checkpoint, or as the arrays that make up the results of tracking a video.
+
+    Required Arguments:
+        n_frames (int) - Maximum number of frames that the accumulator holds.
+            ** Use the number of frames of a checkpoint chunk and clear the accumulator after each chunk to keep the memory bounded.
+        n_tail_points (int) - Number of tail points.
+    '''
+
+    def __init__(self, n_frames, n_tail_points):
+        self.n_tail_points = n_tail_points
+        self.max_frames = max(int(n_frames), 0)
+        # Allocate the arrays of tracking results.
+        self.eye_coord_array = np.full((self.max_frames, 2, 2), np.nan, dtype = np.float32)
+        self.eye_angle_array = np.full((self.max_frames, 2), np.nan, dtype = np.float32)
+        self.heading_coord_array = np.full((self.max_frames, 2), np.nan, dtype = np.float32)
+        self.tail_coord_array = np.full((self.max_frames, n_tail_points + 1, 2), np.nan, dtype = np.float32)
+        self.body_coord_array = np.full((self.max_frames, 2), np.nan, dtype = np.float32)
+        self.heading_angle_array = np.full(self.max_frames, np.nan, dtype = np.float32)
+        self.success_array = np.zeros(self.max_frames, dtype = np.bool_)
+        # The number of frames that were added.
+        self.n_frames = 0
+
+    def __len__(self):
+        return self.n_frames
+
+    def is_full(self):
+        # Return whether every row of the arrays is used.
+        return self.n_frames >= self.max_frames
+
+    def add(self, tracking_record):
+        # Write the tracking record of the next frame into the arrays.
+        if self.is_full():
+            print('Error: the tracking results accumulator is full. Maximum number of frames: {0}.'.format(self.max_frames))
+            return
+        n = self.n_frames
+        self.eye_coord_array[n, 0] = tracking_record['first_eye_coords']
+        self.eye_coord_array[n, 1] = tracking_record['second_eye_coords']
+        self.eye_angle_array[n, 0] = tracking_record['first_eye_angle']
+        self.eye_angle_array[n, 1] = tracking_record['second_eye_angle']
+        self.heading_coord_array[n] = tracking_record['heading_coords']
+        self.tail_coord_array[n] = tracking_record['tail_point_coords']
+        self.body_coord_array[n] = tracking_record['body_coords']
+        self.heading_angle_array[n] = tracking_record['heading_angle']
+        self.success_array[n] = tracking_record['success']
+        self.n_frames += 1
+
+    def get_records(self):
+        # Return the frames that were added as an array of tracking records.
+        n = self.n_frames
+        tracking_records = create_tracking_records(n, self.n_tail_points)
+        tracking_records['success'] = self.success_array[:n]
+        tracking_records['first_eye_coords'] = self.eye_coord_array[:n, 0]
+        tracking_records['second_eye_coords'] = self.eye_coord_array[:n, 1]
+        tracking_records['first_eye_angle'] = self.eye_angle_array[:n, 0]
+        tracking_records['second_eye_angle'] = self.eye_angle_array[:n, 1]
+        tracking_records['heading_coords'] = self.heading_coord_array[:n]
+        tracking_records['body_coords'] = self.body_coord_array[:n]
+        tracking_records['heading_angle'] = self.heading_angle_array[:n]
+        tracking_records['tail_point_coords'] = self.tail_coord_array[:n]
+        return tracking_records
+
+    def get_results(self):
+        # Return views of the frames that were added as the arrays that make up the results of tracking a video.
+        return {array_name : getattr(self, array_name)[:self.n_frames] for array_name in tracking_results_array_names}
+
+    def clear(self):
+        # Reset the arrays so that the rows can be used for the next frames.
+        for array_name in tracking_results_array_names:
+            getattr(self, array_name)[:self.n_frames] = np.nan
+        self.success_array[:self.n_frames] = False
+        self.n_frames = 0
+
+class TrackingCheckpoint():
+    '''
+    Saves the tracking results of a video in chunks while the video is tracked, so that tracking can be resumed after a failure.
+
+    Steps:
+        A checkpoint folder is created that contains a checkpoint.json file with the tracking parameters.
+        Each chunk of tracking records is appended to the folder as a separate .npy file named after the range of frames that it covers. Chunks are written to a temporary file first so that a chunk is either complete or missing.
+        When resuming, the chunks of a checkpoint with the same tracking parameters are kept and tracking continues from the frame after the last completed chunk.
+        When tracking is complete, the chunks are consolidated into a single array of records and the checkpoint folder is removed.
+
+    Required Arguments:
+        checkpoint_path (str) - Path to the checkpoint folder.
+        checkpoint_params (dict) - Tracking parameters. A checkpoint is only resumed if its tracking parameters are the same.
+        starting_frame (int) - Frame number of the first tracked frame.
+
+    Optional Arguments:
+        resume (bool) - Boolean to determine whether or not to resume from an existing checkpoint. Default = False.
+            ** When resume is False, an existing checkpoint is removed.
+    '''
 
+    def __init__(self, checkpoint_path, checkpoint_params, starting_frame, resume = False):
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_params = json.loads(json.dumps(checkpoint_params, default = lambda value: value.tolist() if hasattr(value, 'tolist') else str(value)))
+        self.starting_frame = starting_frame
+        self.chunk_files = []
+        if os.path.isdir(checkpoint_path):
+            existing_params = None
+            try:
+                with open(os.path.join(checkpoint_path, 'checkpoint.json'), 'r') as f:
+                    existing_params = json.load(f)
+            except (OSError, ValueError):
+                pass
+            if resume and existing_params == self.checkpoint_params:
+                self.chunk_files = self.get_completed_chunk_files()
+            elif resume:
+                print('Warning: the checkpoint in {0} was created with different tracking parameters. Tracking from the starting frame.'.format(checkpoint_path))
+            if len(self.chunk_files) == 0:
+                self.remove()
+        if not os.path.isdir(checkpoint_path):
+            os.makedirs(checkpoint_path)
+            with open(os.path.join(checkpoint_path, 'checkpoint.json'), 'w') as f:
+                json.dump(self.checkpoint_params, f, indent = 4)
+        # The next frame that needs to be tracked.
+        self.next_frame = self.starting_frame if len(self.chunk_files) == 0 else self.get_chunk_frame_range(self.chunk_files[-1])[1]
+
+    def get_chunk_frame_range(self, chunk_file):
+        # Return the first frame and the frame after the last frame of a chunk from its file name.
+        first_frame, stopping_frame = os.path.splitext(os.path.basename(chunk_file))[0].split('_')[1:3]
+        return int(first_frame), int(stopping_frame)
+
+    def get_completed_chunk_files(self):
+        # Return the chunk files that continue on from each other from the starting frame. Chunks after a gap are removed.
+        chunk_files = sorted([os.path.join(self.checkpoint_path, chunk_file) for chunk_file in os.listdir(self.checkpoint_path) if chunk_file.startswith('chunk_') and chunk_file.endswith('.npy')])
+        completed_chunk_files = []
+        next_frame = self.starting_frame
+        for chunk_file in chunk_files:
+            first_frame, stopping_frame = self.get_chunk_frame_range(chunk_file)
+            if first_frame != next_frame:
+                os.remove(chunk_file)
+                continue
+            completed_chunk_files.append(chunk_file)
+            next_frame = stopping_frame
+        return completed_chunk_files
+
+    def append(self, tracking_records, n_frames = None):
+        '''
+        Appends a chunk of tracking records to the checkpoint.
+
+        Required Arguments:
+            tracking_records (N) - Array of tracking records of the next frames.
+
+        Optional Arguments:
+            n_frames (int) - Number of frames covered by the chunk. Default = None.
+                ** When n_frames is None, n_frames = the number of tracking records.
+                ** Use when frames that could not be read do not have a tracking record.
+        '''
+        if n_frames is None:
+            n_frames = len(tracking_records)
+        if n_frames == 0:
+            return
+        chunk_file = os.path.join(self.checkpoint_path, 'chunk_{0:010d}_{1:010d}.npy'.format(self.next_frame, self.next_frame + n_frames))
+        temporary_file = '{0}.tmp'.format(chunk_file)
+        with open(temporary_file, 'wb') as f:
+            np.save(f, tracking_records)
+        os.replace(temporary_file, chunk_file)
+        self.chunk_files.append(chunk_file)
+        self.next_frame += n_frames
+
+    def consolidate(self):
+        # Concatenate the chunks into a single array of tracking records.
+        chunks = [np.load(chunk_file) for chunk_file in self.chunk_files]
+        if len(chunks) == 0:
+            return None
+        return np.concatenate(chunks)
+
+    def get_prev_eye_angle(self):
+        # Return the angle between the eyes in the last tracked frame of the completed chunks, or None if no frame was tracked. Used to keep the order of the eyes the same when resuming.
+        for chunk_file in self.chunk_files[::-1]:
+            tracking_records = np.load(chunk_file)
+            tracked_index = np.flatnonzero(tracking_records['success'])
+            if len(tracked_index) > 0:
+                first_eye_coords, second_eye_coords = tracking_records['first_eye_coords'][tracked_index[-1]], tracking_records['second_eye_coords'][tracked_index[-1]]
+                return np.arctan2(second_eye_coords[0] - first_eye_coords[0], second_eye_coords[1] - first_eye_coords[1])
+        return None
+
+    def remove(self):
+        # Remove the checkpoint folder.
+        shutil.rmtree(self.checkpoint_path, ignore_errors = True)
+        self.chunk_files = []
+
+def check_tracking_frame_range(video_n_frames, starting_frame, n_frames):
     # Get the total number of frames.
     if n_frames is None:
         n_frames = video_n_frames
@@ -635,151 +3085,375 @@ def track_tail_in_video_with_multiprocessing(video_path, colours, n_tail_points,
         print('The number of frames requested to track plus the number of initial frames to offset exceeds the total number of frames in the video. Keeping the initial frames to offset and tracking the remaining frames.')
         n_frames = video_n_frames - starting_frame
 
-    batch_iterations = int((video_n_frames - starting_frame) / frame_batch_size)
-    if (video_n_frames - starting_frame) % frame_batch_size != 0:
+    return starting_frame, n_frames
+
+def track_tail_in_video_with_multiprocessing(video_path, colours, n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, init_frame_batch_size = 50, init_starting_frame = 0, save_path = None, background_path = None, save_background = False, line_length = 0, video_fps = None, n_frames = None, pixel_threshold = 100, frame_change_threshold = 10, extended_eyes_calculation = False, eyes_threshold = None, n_processes = None, checkpoint_frames = None, resume = False):
+
+    t0 = time.time()
+
+    # Create or load background image.
+    if background_path is None:
+        background = calculate_background(video_path, save_path = save_path, save_background = save_background)[0].astype(np.uint8)
+    else:
+        background = cv2.imread(background_path, cv2.IMREAD_GRAYSCALE).astype(np.uint8)
+
+    video_n_frames = get_total_frame_number_from_video(video_path)
+    starting_frame, n_frames = check_tracking_frame_range(video_n_frames, init_starting_frame, n_frames)
+
+    # Save the tracking results in chunks to a checkpoint if requested, and skip the frames that were tracked before if resuming.
+    checkpoint = None
+    resumed_frames = 0
+    if checkpoint_frames is not None or resume:
+        if checkpoint_frames is None:
+            checkpoint_frames = default_checkpoint_frames
+        checkpoint_params = {'video_path' : os.path.abspath(video_path), 'video_n_frames' : video_n_frames, 'starting_frame' : starting_frame, 'n_frames' : n_frames, 'n_tail_points' : n_tail_points, 'dist_tail_points' : dist_tail_points, 'dist_eyes' : dist_eyes, 'dist_swim_bladder' : dist_swim_bladder, 'pixel_threshold' : pixel_threshold, 'extended_eyes_calculation' : extended_eyes_calculation, 'eyes_threshold' : eyes_threshold, 'background' : hashlib.sha1(np.ascontiguousarray(background)).hexdigest()}
+        checkpoint = TrackingCheckpoint(get_checkpoint_path(video_path, save_path), checkpoint_params, starting_frame, resume = resume)
+        resumed_frames = checkpoint.next_frame - starting_frame
+        if resumed_frames > 0:
+            print('Resuming tracking from frame number: {0}.'.format(checkpoint.next_frame))
+    # The workers track each range of frames without a state, so the order of the eyes is kept the same here, in frame order.
+    prev_eye_angle = None
+    if extended_eyes_calculation and resumed_frames > 0:
+        prev_eye_angle = checkpoint.get_prev_eye_angle()
+    tracked_starting_frame = starting_frame + resumed_frames
+    tracked_n_frames = n_frames - resumed_frames
+    frame_batch_size = max(1, min(init_frame_batch_size, tracked_n_frames))
+
+    batch_iterations = int(tracked_n_frames / frame_batch_size)
+    if tracked_n_frames % frame_batch_size != 0:
         batch_iterations += 1
 
-    # Initialize variables for data.
-    eye_coord_array = np.array([])
-    heading_coord_array = np.array([])
-    body_coord_array = np.array([])
-    heading_angle_array = np.array([])
-    tail_coord_array = np.array([])
+    # Initialize the records that will hold the results of every tracked frame. When checkpointing, the records only hold the frames of the current chunk.
+    if checkpoint is not None:
+        chunk_n_batches = max(int(np.ceil(checkpoint_frames / frame_batch_size)), 1)
+        tracking_records = create_tracking_records(min(chunk_n_batches * frame_batch_size, tracked_n_frames), n_tail_points)
+    else:
+        chunk_n_batches = batch_iterations
+        tracking_records = create_tracking_records(tracked_n_frames, n_tail_points)
+
+    # Open the video once and stream grayscale frames from the starting frame. The workers subtract the background and apply the median blur filter.
+    frame_reader = FrameReader(video_path, starting_frame = tracked_starting_frame, n_frames = tracked_n_frames)
+
+    # Start the worker processes once for the whole video. The ring buffer holds two batches so that the next batch can be decoded while the current batch is tracked.
+    frame_width, frame_height = frame_reader.frame_size
+    tracking_pool = TrackingPool((frame_height, frame_width), 2 * frame_batch_size, n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, pixel_threshold = pixel_threshold, extended_eyes_calculation = extended_eyes_calculation, eyes_threshold = eyes_threshold, background = background, n_processes = n_processes)
+
+    try:
+        first_slot = 0
+        valid_frames = frame_reader.read_stack(frame_batch_size, frame_stack = tracking_pool.frame_buffer[first_slot:first_slot + frame_batch_size])[1]
+        for i in range(batch_iterations):
+            batch_starting_frame = i * frame_batch_size
+            print('Tracking video. Processing frame numbers: {0} - {1} / {2}.'.format(tracked_starting_frame + batch_starting_frame, tracked_starting_frame + batch_starting_frame + len(valid_frames), video_n_frames), end = '\r')
+            async_result = tracking_pool.submit(first_slot, valid_frames)
+            # Decode the next batch into the other half of the ring buffer while the workers track the current batch.
+            if i + 1 < batch_iterations:
+                next_first_slot = ((i + 1) % 2) * frame_batch_size
+                next_frame_batch_size = min(frame_batch_size, tracked_n_frames - batch_starting_frame - frame_batch_size)
+                next_valid_frames = frame_reader.read_stack(next_frame_batch_size, frame_stack = tracking_pool.frame_buffer[next_first_slot:next_first_slot + next_frame_batch_size])[1]
+            chunk_starting_frame = (i % chunk_n_batches) * frame_batch_size
+            tracking_records[chunk_starting_frame:chunk_starting_frame + len(valid_frames)] = tracking_pool.collect(async_result)
+            if extended_eyes_calculation:
+                prev_eye_angle = keep_eye_order_in_tracking_records(tracking_records[chunk_starting_frame:chunk_starting_frame + len(valid_frames)], prev_eye_angle)
+            if checkpoint is not None and ((i + 1) % chunk_n_batches == 0 or i + 1 == batch_iterations):
+                # Append the chunk of tracking records to the checkpoint.
+                checkpoint.append(tracking_records[:chunk_starting_frame + len(valid_frames)])
+            if i + 1 < batch_iterations:
+                first_slot, valid_frames = next_first_slot, next_valid_frames
+    finally:
+        # Stop the worker processes and unload the video from memory.
+        tracking_pool.close()
+        frame_reader.release()
+
+    print('Tracking video. Processing frame numbers: {0} - {1} / {2}.'.format(starting_frame, starting_frame + n_frames, video_n_frames))
+
+    if checkpoint is not None:
+        # Consolidate the chunks of tracking records and remove the checkpoint.
+        tracking_records = checkpoint.consolidate()
+        if tracking_records is None:
+            tracking_records = create_tracking_records(0, n_tail_points)
+        checkpoint.remove()
+
+    results = convert_tracking_records_to_results(tracking_records)
+    results.update({    'video_path' : video_path,
+                        'video_n_frames' : video_n_frames,
+                        'video_fps' : video_fps,
+                        'starting_frame' : starting_frame,
+                        'n_frames' : n_frames,
+                        'dist_tail_points' : dist_tail_points,
+                        'dist_eyes' : dist_eyes,
+                        'dist_swim_bladder' : dist_swim_bladder,
+                        'eyes_threshold' : eyes_threshold,
+                        'pixel_threshold' : pixel_threshold,
+                        'frame_change_threshold' : frame_change_threshold
+                    })
+
+    print('Total processing time: {0} seconds.'.format(time.time() - t0))
+
+    return results
+
+def track_tail_in_video_without_multiprocessing(video_path, colours, n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, init_frame_batch_size = 50, init_starting_frame = 0, save_path = None, background_path = None, save_background = False, line_length = 0, video_fps = None, n_frames = None, pixel_threshold = 100, frame_change_threshold = 10, extended_eyes_calculation = False, eyes_threshold = None):
+
+    t0 = time.time()
+
+    # Create or load background image.
+    if background_path is None:
+        background = calculate_background(video_path, save_path = save_path, save_background = save_background)[0].astype(np.uint8)
+    else:
+        background = cv2.imread(background_path, cv2.IMREAD_GRAYSCALE).astype(np.uint8)
+
+    video_n_frames = get_total_frame_number_from_video(video_path)
+    starting_frame, n_frames = check_tracking_frame_range(video_n_frames, init_starting_frame, n_frames)
+    frame_batch_size = max(1, min(init_frame_batch_size, n_frames))
+
+    batch_iterations = int(n_frames / frame_batch_size)
+    if n_frames % frame_batch_size != 0:
+        batch_iterations += 1
+
+    # Initialize the records that will hold the results of every tracked frame.
+    tracking_records = create_tracking_records(n_frames, n_tail_points)
+
+    # Open the video once and stream grayscale frames from the starting frame.
+    frame_reader = FrameReader(video_path, starting_frame = starting_frame, n_frames = n_frames)
+    # Allocate the stack of frames once and reuse it for every batch.
+    frame_stack = np.zeros((frame_batch_size, frame_reader.frame_size[1], frame_reader.frame_size[0]), dtype = np.uint8)
+    # Create the tracker and the state that is carried from one batch to the next.
+    fish_tracker = FishTracker(n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, pixel_threshold = pixel_threshold, extended_eyes_calculation = extended_eyes_calculation, eyes_threshold = eyes_threshold, background = background)
+    tracking_state = TrackingState()
 
     for i in range(batch_iterations):
-        print('Tracking video. Processing frame numbers: {0} - {1} / {2}.'.format(starting_frame, starting_frame + frame_batch_size, video_n_frames), end = '\r')
-        frame_array = load_frames_into_memory(video_path, starting_frame = starting_frame, frame_batch_size = frame_batch_size)
-        frame_array = subtract_background_from_frames(frame_array, background)
-        frame_array = apply_median_blur_to_frames(frame_array)
-        tracking_params = [[frame, success, n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, pixel_threshold] for success, frame in frame_array]
-        pool = mp.Pool(mp.cpu_count())
-        tracking_results = np.array(pool.map(track_tail_in_frame, tracking_params))
-        pool.close()
-        pool.join()
-
-        eye_coord_array = np.append(eye_coord_array, np.array([tracking_results[:,0], tracking_results[:,1]]))
-        heading_coord_array = np.append(heading_coord_array, tracking_results[:,2])
-        body_coord_array = np.append(body_coord_array, tracking_results[:,3])
-        heading_angle_array = np.append(heading_angle_array, tracking_results[:,4])
-        tail_coord_array = np.append(tail_coord_array, tracking_results[:,5])
-
-        if starting_frame + frame_batch_size != video_n_frames:
-            starting_frame += frame_batch_size
-            if starting_frame + frame_batch_size > video_n_frames:
-                frame_batch_size = video_n_frames - starting_frame
-
-    print('Tracking video. Processing frame numbers: {0} - {1} / {2}.'.format(starting_frame, starting_frame + frame_batch_size, video_n_frames))
-
-    eye_coord_array = eye_coord_array.reshape((2, video_n_frames))
-    starting_frame = init_starting_frame
-    frame_batch_size = init_frame_batch_size
-
-    results =   {   'eye_coord_array' : eye_coord_array,
-                    'heading_coord_array' : heading_coord_array,
-                    'tail_coord_array' : tail_coord_array,
-                    'body_coord_array' : body_coord_array,
-                    'heading_angle_array' : heading_angle_array,
-                    'video_path' : video_path,
-                    'video_n_frames' : video_n_frames,
-                    'video_fps' : video_fps,
-                    'dist_tail_points' : dist_tail_points,
-                    'dist_eyes' : dist_eyes,
-                    'dist_swim_bladder' : dist_swim_bladder,
-                    'pixel_threshold' : pixel_threshold,
-                    'frame_change_threshold' : frame_change_threshold
-                }
+        batch_starting_frame = i * frame_batch_size
+        batch_frame_stack, valid_frames = frame_reader.read_stack(min(frame_batch_size, n_frames - batch_starting_frame), frame_stack = frame_stack)
+        print('Tracking video. Processing frame numbers: {0} - {1} / {2}.'.format(starting_frame + batch_starting_frame, starting_frame + batch_starting_frame + len(valid_frames), video_n_frames), end = '\r')
+        # Subtract the background, apply the median blur filter, and track the batch of frames.
+        tracking_records[batch_starting_frame:batch_starting_frame + len(valid_frames)] = fish_tracker.track_frames(batch_frame_stack[:len(valid_frames)], valid_frames, tracking_state)
+
+    print('Tracking video. Processing frame numbers: {0} - {1} / {2}.'.format(starting_frame, starting_frame + n_frames, video_n_frames))
+
+    # Unload the video from memory.
+    frame_reader.release()
+
+    results = convert_tracking_records_to_results(tracking_records)
+    results.update({    'video_path' : video_path,
+                        'video_n_frames' : video_n_frames,
+                        'video_fps' : video_fps,
+                        'starting_frame' : starting_frame,
+                        'n_frames' : n_frames,
+                        'dist_tail_points' : dist_tail_points,
+                        'dist_eyes' : dist_eyes,
+                        'dist_swim_bladder' : dist_swim_bladder,
+                        'eyes_threshold' : eyes_threshold,
+                        'pixel_threshold' : pixel_threshold,
+                        'frame_change_threshold' : frame_change_threshold
+                    })
 
     print('Total processing time: {0} seconds.'.format(time.time() - t0))
 
     return results
 
-def track_tail_in_video_without_multiprocessing(video_path, colours, n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, init_frame_batch_size = 50, init_starting_frame = 0, save_path = None, background_path = None, save_background = False, line_length = 0, video_fps = None, n_frames = None, pixel_threshold = 100, frame_change_threshold = 10):
+def track_tail_in_video_with_roi(video_path, colours, n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, init_starting_frame = 0, save_path = None, background_path = None, save_background = False, line_length = 0, video_fps = None, n_frames = None, pixel_threshold = 100, frame_change_threshold = 10, extended_eyes_calculation = False, eyes_threshold = None, roi_margin = None):
 
     t0 = time.time()
 
     # Create or load background image.
     if background_path is None:
-        background = calculate_background(video_path, save_path, save_background = save_background)[0].astype(np.uint8)
+        background = calculate_background(video_path, save_path = save_path, save_background = save_background)[0].astype(np.uint8)
     else:
         background = cv2.imread(background_path, cv2.IMREAD_GRAYSCALE).astype(np.uint8)
 
     video_n_frames = get_total_frame_number_from_video(video_path)
-    starting_frame = init_starting_frame
-    frame_batch_size = init_frame_batch_size
+    starting_frame, n_frames = check_tracking_frame_range(video_n_frames, init_starting_frame, n_frames)
+
+    # Initialize the records that will hold the results of every tracked frame.
+    tracking_records = create_tracking_records(n_frames, n_tail_points)
+
+    # Calculate the size of the region of interest around the fish.
+    roi_radius = get_tracking_roi_radius(n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, roi_margin = roi_margin)
+    # Create the tracker and the state that holds the position of the fish in the previous frame. The motion gate compares the square around the fish to the last tracked frame, so that frames where the fish did not move reuse the previous tracking results.
+    fish_tracker = FishTracker(n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, pixel_threshold = pixel_threshold, extended_eyes_calculation = extended_eyes_calculation, eyes_threshold = eyes_threshold, background = background, roi_radius = roi_radius)
+    motion_gate = MotionGate(frame_change_threshold, roi_radius = roi_radius)
+    tracking_state = fish_tracker.create_state(motion_gate = motion_gate)
+
+    # Open the video once and stream grayscale frames from the starting frame. The background is subtracted inside the region of interest only.
+    frame_reader = FrameReader(video_path, starting_frame = starting_frame, n_frames = n_frames)
+
+    for i in range(n_frames):
+        success, frame = frame_reader.read()
+        if i % 100 == 0:
+            print('Tracking video. Processing frame number: {0} / {1}.'.format(starting_frame + i + 1, video_n_frames), end = '\r')
+        # The region of interest of each frame is centered on the position of the fish in the previous frame. The full frame is searched when the fish is lost.
+        if not success or frame.shape != background.shape:
+            tracking_state.prev_tracking_record = tracking_records[i].copy()
+            continue
+        try:
+            tracking_records[i] = fish_tracker.track_frame(frame, tracking_state)
+        except:
+            tracking_records[i]['success'] = False
+            tracking_state.prev_tracking_record = tracking_records[i].copy()
 
-    # Get the total number of frames.
-    if n_frames is None:
-        n_frames = video_n_frames
+    print('Tracking video. Processing frame number: {0} / {1}.'.format(starting_frame + n_frames, video_n_frames))
+    print('Frames tracked inside the region of interest: {0} / {1}.'.format(tracking_state.n_roi_frames, n_frames))
+    motion_gate_statistics = motion_gate.get_statistics()
+    print('Frames that did not change and reused the previous results: {0} / {1}.'.format(motion_gate_statistics['n_skipped_frames'], motion_gate_statistics['n_checked_frames']))
 
-    if n_frames > video_n_frames:
-        print('The number of frames requested to track exceeds the total number of frames in the video.')
-        n_frames = video_n_frames
+    # Unload the video from memory.
+    frame_reader.release()
+
+    results = convert_tracking_records_to_results(tracking_records)
+    results.update({    'video_path' : video_path,
+                        'video_n_frames' : video_n_frames,
+                        'video_fps' : video_fps,
+                        'starting_frame' : starting_frame,
+                        'n_frames' : n_frames,
+                        'dist_tail_points' : dist_tail_points,
+                        'dist_eyes' : dist_eyes,
+                        'dist_swim_bladder' : dist_swim_bladder,
+                        'eyes_threshold' : eyes_threshold,
+                        'pixel_threshold' : pixel_threshold,
+                        'frame_change_threshold' : frame_change_threshold,
+                        'motion_gate_statistics' : motion_gate_statistics,
+                        'roi_radius' : roi_radius
+                    })
 
-    if starting_frame >= video_n_frames:
-        print('Starting frame number provided exceeds the total number of frames in the video. Setting the starting frame number to 0.')
-        starting_frame = 0
-        n_frames = video_n_frames
+    print('Total processing time: {0} seconds.'.format(time.time() - t0))
 
-    if starting_frame + n_frames > video_n_frames:
-        print('The number of frames requested to track plus the number of initial frames to offset exceeds the total number of frames in the video. Keeping the initial frames to offset and tracking the remaining frames.')
-        n_frames = video_n_frames - starting_frame
+    return results
 
-    batch_iterations = int((video_n_frames - starting_frame) / frame_batch_size)
-    if (video_n_frames - starting_frame) % frame_batch_size != 0:
-        batch_iterations += 1
+def get_tracking_frame_ranges(starting_frame, n_frames, n_shards):
+    # Split the frames to track into contiguous ranges of nearly equal length. Returns a list of [starting frame, number of frames] pairs in frame order.
+    n_shards = max(min(n_shards, n_frames), 1)
+    shard_bounds = np.linspace(0, n_frames, n_shards + 1).astype(int)
+    return [[int(starting_frame + shard_bounds[i]), int(shard_bounds[i + 1] - shard_bounds[i])] for i in range(n_shards)]
+
+def _track_tail_in_frame_range(shard_params):
+    # Open the video, seek once to the first frame of the range, and track every frame in the range. The tracking records are written to a partial results file as they are tracked so that the worker only keeps one batch of frames in memory.
+    video_path, shard_starting_frame, shard_n_frames, frame_batch_size, partial_results_path, tracking_params, tracking_kwargs = shard_params
+    n_tail_points = tracking_params[0]
+    partial_records = np.lib.format.open_memmap(partial_results_path, mode = 'w+', dtype = get_tracking_results_dtype(n_tail_points), shape = (shard_n_frames,))
+    partial_records[:] = create_tracking_records(shard_n_frames, n_tail_points)
+    # The order of the eyes is kept the same across the shards by the main process once the shards are stitched together, so the batches are tracked without a state.
+    fish_tracker = FishTracker(*tracking_params, **tracking_kwargs)
+    with FrameReader(video_path, starting_frame = shard_starting_frame, n_frames = shard_n_frames) as frame_reader:
+        # Allocate the stack of frames once and reuse it for every batch.
+        frame_stack = np.zeros((min(frame_batch_size, max(shard_n_frames, 1)), frame_reader.frame_size[1], frame_reader.frame_size[0]), dtype = np.uint8)
+        for batch_starting_frame in range(0, shard_n_frames, frame_batch_size):
+            batch_frame_stack, valid_frames = frame_reader.read_stack(min(frame_batch_size, shard_n_frames - batch_starting_frame), frame_stack = frame_stack)
+            partial_records[batch_starting_frame:batch_starting_frame + len(valid_frames)] = fish_tracker.track_frames(batch_frame_stack[:len(valid_frames)], valid_frames)
+    partial_records.flush()
+    del partial_records
+    return partial_results_path
+
+def track_tail_in_video_with_sharding(video_path, colours, n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, init_frame_batch_size = 50, init_starting_frame = 0, save_path = None, background_path = None, save_background = False, line_length = 0, video_fps = None, n_frames = None, pixel_threshold = 100, frame_change_threshold = 10, extended_eyes_calculation = False, eyes_threshold = None, n_processes = None, n_shards = None):
+    '''
+    Tracks a video by splitting it into contiguous ranges of frames that are decoded and tracked in separate processes.
 
-    # Initialize variables for data.
-    eye_coord_array = np.array([])
-    heading_coord_array = np.array([])
-    body_coord_array = np.array([])
-    heading_angle_array = np.array([])
-    tail_coord_array = np.array([])
+    Steps:
+        The frames to track are split into contiguous ranges of frames, called shards.
+        Each worker process opens its own video capture, seeks once to the first frame of its shard, then decodes and tracks every frame in the shard.
+        Each worker writes the tracking records of its shard to a partial results file.
+        The main process stitches the partial results together in frame order, keeps the order of the eyes the same across shards, and removes the partial results files.
 
-    for i in range(batch_iterations):
-        print('Tracking video. Processing frame numbers: {0} - {1} / {2}.'.format(starting_frame, starting_frame + frame_batch_size, video_n_frames), end = '\r')
-        frame_array = load_frames_into_memory(video_path, starting_frame = starting_frame, frame_batch_size = frame_batch_size)
-        frame_array = subtract_background_from_frames(frame_array, background)
-        frame_array = apply_median_blur_to_frames(frame_array)
-        tracking_params = [[frame, success, n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, pixel_threshold] for success, frame in frame_array]
-        tracking_results = np.array([track_tail_in_frame(i) for i in tracking_params])
-
-        eye_coord_array = np.append(eye_coord_array, np.array([tracking_results[:,0], tracking_results[:,1]]))
-        heading_coord_array = np.append(heading_coord_array, tracking_results[:,2])
-        body_coord_array = np.append(body_coord_array, tracking_results[:,3])
-        heading_angle_array = np.append(heading_angle_array, tracking_results[:,4])
-        tail_coord_array = np.append(tail_coord_array, tracking_results[:,5])
-
-        if starting_frame + frame_batch_size != video_n_frames:
-            starting_frame += frame_batch_size
-            if starting_frame + frame_batch_size > video_n_frames:
-                frame_batch_size = video_n_frames - starting_frame
-
-    print('Tracking video. Processing frame numbers: {0} - {1} / {2}.'.format(starting_frame, starting_frame + frame_batch_size, video_n_frames))
-
-    eye_coord_array = eye_coord_array.reshape((2, video_n_frames))
-    starting_frame = init_starting_frame
-    frame_batch_size = init_frame_batch_size
-
-    results =   {   'eye_coord_array' : eye_coord_array,
-                    'heading_coord_array' : heading_coord_array,
-                    'tail_coord_array' : tail_coord_array,
-                    'body_coord_array' : body_coord_array,
-                    'heading_angle_array' : heading_angle_array,
-                    'video_path' : video_path,
-                    'video_n_frames' : video_n_frames,
-                    'video_fps' : video_fps,
-                    'dist_tail_points' : dist_tail_points,
-                    'dist_eyes' : dist_eyes,
-                    'dist_swim_bladder' : dist_swim_bladder,
-                    'pixel_threshold' : pixel_threshold,
-                    'frame_change_threshold' : frame_change_threshold
-                }
+    Required Arguments:
+        video_path (str) - Path to the video.
+        colours (list([B, G, R])) - List of colours used for annotating.
+        n_tail_points (int) - Number of tail points.
+        dist_tail_points (int) - Distance between tail points.
+        dist_eyes (int) - Distance between the eyes.
+        dist_swim_bladder (int) - Distance between the eyes and the swim bladder.
+
+    Optional Arguments:
+        init_frame_batch_size (int) - Number of frames that each worker decodes and tracks at a time. Default = 50.
+        init_starting_frame (int) - Frame number at which to start tracking. Default = 0.
+        save_path (str) - Folder where the background and the partial results are saved. Default = None.
+            ** When save_path is None, the partial results are saved in the folder that contains the video.
+        n_frames (int) - Number of frames to track. Default = None.
+            ** When n_frames is None, every frame after the starting frame is tracked.
+        n_processes (int) - Number of worker processes. Default = None.
+            ** When n_processes is None, n_processes = the number of CPUs.
+        n_shards (int) - Number of ranges of frames the video is split into. Default = None.
+            ** When n_shards is None, n_shards = n_processes.
+        ** The other optional arguments are the same as track_tail_in_video_with_multiprocessing.
+        ** Seeking relies on the codec seeking to the exact frame requested. This is the case for the codecs used to record the videos, such as MJPG and FFV1, but may not be the case for codecs with long groups of pictures.
+
+    Returns:
+        results (dict) - Dictionary that contains the tracking results and tracking parameters. Same as track_tail_in_video_with_multiprocessing.
+    '''
+    t0 = time.time()
+
+    # Create or load background image.
+    if background_path is None:
+        background = calculate_background(video_path, save_path = save_path, save_background = save_background)[0].astype(np.uint8)
+    else:
+        background = cv2.imread(background_path, cv2.IMREAD_GRAYSCALE).astype(np.uint8)
+
+    video_n_frames = get_total_frame_number_from_video(video_path)
+    starting_frame, n_frames = check_tracking_frame_range(video_n_frames, init_starting_frame, n_frames)
+    frame_batch_size = max(1, init_frame_batch_size)
+
+    if n_processes is None:
+        n_processes = mp.cpu_count()
+    if n_shards is None:
+        n_shards = n_processes
+    frame_ranges = get_tracking_frame_ranges(starting_frame, n_frames, n_shards)
+    n_processes = max(min(n_processes, len(frame_ranges)), 1)
+
+    # Create the folder that will contain the partial results of each shard.
+    if save_path is None:
+        save_path = os.path.dirname(os.path.abspath(video_path))
+    shard_folder = os.path.join(save_path, '{0}_shards'.format(os.path.splitext(os.path.basename(video_path))[0]))
+    if not os.path.isdir(shard_folder):
+        os.makedirs(shard_folder)
+
+    tracking_params = [n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder]
+    tracking_kwargs = {'pixel_threshold' : pixel_threshold, 'extended_eyes_calculation' : extended_eyes_calculation, 'eyes_threshold' : eyes_threshold, 'background' : background}
+    shard_params = [[video_path, shard_starting_frame, shard_n_frames, frame_batch_size, os.path.join(shard_folder, 'shard_{0:010d}_{1:010d}.npy'.format(shard_starting_frame, shard_starting_frame + shard_n_frames)), tracking_params, tracking_kwargs] for shard_starting_frame, shard_n_frames in frame_ranges]
+
+    # Initialize the records that will hold the results of every tracked frame.
+    tracking_records = create_tracking_records(n_frames, n_tail_points)
+    prev_eye_angle = None
+
+    try:
+        pool = mp.Pool(n_processes)
+        try:
+            # Track the shards in parallel. Results are returned in frame order, so each partial result is stitched into place as soon as the shards before it are done.
+            for i, partial_results_path in enumerate(pool.imap(_track_tail_in_frame_range, shard_params)):
+                shard_starting_frame, shard_n_frames = frame_ranges[i]
+                print('Tracking video. Processing frame numbers: {0} - {1} / {2}.'.format(starting_frame, shard_starting_frame + shard_n_frames, video_n_frames), end = '\r')
+                partial_records = np.load(partial_results_path, mmap_mode = 'r')
+                tracking_records[shard_starting_frame - starting_frame:shard_starting_frame - starting_frame + shard_n_frames] = partial_records
+                del partial_records
+                if extended_eyes_calculation:
+                    # Each shard is tracked without a state, so keep the order of the eyes the same in frame order once the shards before it are stitched.
+                    prev_eye_angle = keep_eye_order_in_tracking_records(tracking_records[shard_starting_frame - starting_frame:shard_starting_frame - starting_frame + shard_n_frames], prev_eye_angle)
+                os.remove(partial_results_path)
+        finally:
+            # Stop the worker processes.
+            pool.close()
+            pool.join()
+    finally:
+        # Remove the folder of partial results.
+        shutil.rmtree(shard_folder, ignore_errors = True)
+
+    print('Tracking video. Processing frame numbers: {0} - {1} / {2}.'.format(starting_frame, starting_frame + n_frames, video_n_frames))
+
+    results = convert_tracking_records_to_results(tracking_records)
+    results.update({    'video_path' : video_path,
+                        'video_n_frames' : video_n_frames,
+                        'video_fps' : video_fps,
+                        'starting_frame' : starting_frame,
+                        'n_frames' : n_frames,
+                        'dist_tail_points' : dist_tail_points,
+                        'dist_eyes' : dist_eyes,
+                        'dist_swim_bladder' : dist_swim_bladder,
+                        'eyes_threshold' : eyes_threshold,
+                        'pixel_threshold' : pixel_threshold,
+                        'frame_change_threshold' : frame_change_threshold
+                    })
 
     print('Total processing time: {0} seconds.'.format(time.time() - t0))
 
     return results
 
-def track_video(video_path, colours, n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, save_video = True, n_frames = None, starting_frame = 0, save_path = None, background_path = None, save_background = True, extended_eyes_calculation = False,  eyes_threshold = None, line_length = 0, video_fps = None, pixel_threshold = 100, frame_change_threshold = 10):
+def track_video(video_path, colours, n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, save_video = True, n_frames = None, starting_frame = 0, save_path = None, background_path = None, save_background = True, extended_eyes_calculation = False,  eyes_threshold = None, line_length = 0, video_fps = None, pixel_threshold = 100, frame_change_threshold = 10, pipelined = True, decode_queue_depth = 16, write_queue_depth = 16, video_fourcc = 0, video_encoder_command = None, video_frame_step = 1, video_only_moving_frames = False, video_scale = 1, video_crop_radius = None, checkpoint_frames = None, resume = False, motion_gate = None, progress_callback = None, profiler = None):
     '''
     Tracks a video.
 
@@ -818,14 +3492,47 @@ def track_video(video_path, colours, n_tail_points, dist_tail_points, dist_eyes,
             ** Used to determined whether or not the previous data points should be used or whether new points should be calculated.
             ** The larger the frame_change_threshold, the less likely it is that new data points are going to be calculated.
             ** Useful for reducing frame to frame noise in position of coordinates.
+        motion_gate (MotionGate) - Motion gate used to decide whether each frame changed enough to be tracked again. Default = None.
+            ** When motion_gate is None, a MotionGate that compares the whole frame to the last tracked frame with frame_change_threshold is used.
+            ** Use a MotionGate with a downsample_factor or roi_radius to make the comparison cheaper on large frames.
+            ** The number of frames that were skipped is saved in the results as motion_gate_statistics.
+        pipelined (bool) - Boolean to determine whether or not the video is decoded and the tracked video is encoded in separate threads while tracking. Default = True.
+            ** When pipelined is True, the total processing time approaches the time of the slowest of decoding, tracking, and encoding instead of their sum.
+            ** When pipelined is False, each frame is read, tracked, and written in turn.
+        decode_queue_depth (int) - Maximum number of frames that are decoded ahead of tracking. Default = 16.
+            ** Only used if pipelined is True.
+        write_queue_depth (int) - Maximum number of tracked frames waiting to be encoded. Default = 16.
+            ** Only used if pipelined is True. Tracking waits for the writer when the queue is full.
+        video_fourcc (int or str) - Four character code of the codec used to write the tracked video. Default = 0.
+            ** When video_fourcc is 0, the tracked video is uncompressed. Use a string such as MJPG or XVID to compress the tracked video.
+        video_encoder_command (list) - Command of an external encoder that the tracked frames are piped to. Default = None.
+            ** See get_ffmpeg_encoder_command. The tracked video is saved as an mp4 file.
+        video_frame_step (int) - Only every nth frame is written to the tracked video. Default = 1.
+        video_only_moving_frames (bool) - Boolean to determine whether or not frames are only written to the tracked video when the fish moved. Default = False.
+        video_scale (float) - Scale of the tracked video relative to the original video. Default = 1.
+            ** Use 0.5 to save the tracked video at half resolution.
+        video_crop_radius (int) - Half of the width of a square crop around the fish that is saved in the tracked video. Default = None.
+            ** When video_crop_radius is None, the whole frame is saved.
+        checkpoint_frames (int) - Number of frames in each chunk of tracking results that is saved to a checkpoint while tracking. Default = None.
+            ** The checkpoint is saved in a folder named after the video with the suffix _checkpoint in the save path, and removed once the results are saved.
+            ** When checkpoint_frames is None, no checkpoint is saved unless resume is True. Only the tracking results of the current chunk are kept in memory while tracking.
+        resume (bool) - Boolean to determine whether or not to resume tracking from the last completed chunk of a checkpoint. Default = False.
+            ** The checkpoint is only used if it was created with the same video and tracking parameters.
+            ** When resuming, the tracked video only contains the frames tracked after resuming and is saved with the suffix _tracked_from_{frame number}.
+        progress_callback (function) - Function that receives the progress after each frame and while the background is calculated. Default = None.
+            ** When progress_callback is None, the progress is printed. See report_progress.
+        profiler (TrackingProfiler) - Profiler that times each stage of the pipeline and counts the outcome of each frame. Default = None.
+            ** When profiler is None, or its enabled attribute is False, nothing is timed.
+            ** At the end of the run, the summary table is printed, the time spent on each frame is saved with the results as frame_time_array, and the summary is saved to tracking_profile.json in the results folder.
 
     Returns:
         tracked_video - Saved in the path location given by the video path.
-            ** Saved in a raw video format.
+            ** Saved in a raw video format unless video_fourcc or video_encoder_command is provided.
             ** Points of interest (i.e. tail points, heading angle, and eye coordinates) are annotated on the video.
         data_file - Saved in the path location given by the video path.
-            ** Saved as a npz file.
-            ** Saved as a dictionary containing arrays of the eye coordinates, heading angle, eye angles, and tail points.
+            ** Saved as a folder named after the video with the suffix _results.
+            ** Contains one float32 .npy file for each array of tracking results (eye coordinates, eye angles, tail points, body coordinates, and heading angle) and a metadata.json file with the tracking parameters.
+            ** Use load_tracking_results to load the data file.
     '''
 
     t0 = time.time()
@@ -839,11 +3546,19 @@ def track_video(video_path, colours, n_tail_points, dist_tail_points, dist_eyes,
     if save_path == None:
         save_path = os.path.dirname(video_path)
 
+    if profiler is not None and not profiler.enabled:
+        profiler = None
+    if profiler is not None:
+        profiler.start()
+        t = time.perf_counter()
+
     # Create or load background image.
     if background_path is None:
-        background = calculate_background(video_path, save_path = save_path, save_background = save_background)[0]
+        background = calculate_background(video_path, save_path = save_path, save_background = save_background, progress_callback = progress_callback)[0]
     else:
         background = cv2.imread(background_path, cv2.IMREAD_GRAYSCALE).astype(np.uint8)
+    if profiler is not None:
+        profiler.add_time('background', t)
 
     video_n_frames = get_total_frame_number_from_video(video_path)
     frame_size = get_frame_size_from_video(video_path)
@@ -869,225 +3584,111 @@ def track_video(video_path, colours, n_tail_points, dist_tail_points, dist_eyes,
         print('The number of frames requested to track plus the number of initial frames to offset exceeds the total number of frames in the video. Keeping the initial frames to offset and tracking the remaining frames.')
         n_frames = video_n_frames - starting_frame
 
-    # Open the video path.
-    capture = cv2.VideoCapture(video_path)
-
-    # Set the frame position to start.
-    capture.set(cv2.CAP_PROP_POS_FRAMES, starting_frame)
+    # Save the tracking results in chunks to a checkpoint if requested, and skip the frames that were tracked before if resuming.
+    checkpoint = None
+    tracked_starting_frame = starting_frame
+    tracked_n_frames = n_frames
+    if checkpoint_frames is not None or resume:
+        if checkpoint_frames is None:
+            checkpoint_frames = default_checkpoint_frames
+        checkpoint_params = {'video_path' : os.path.abspath(video_path), 'video_n_frames' : video_n_frames, 'starting_frame' : starting_frame, 'n_frames' : n_frames, 'n_tail_points' : n_tail_points, 'dist_tail_points' : dist_tail_points, 'dist_eyes' : dist_eyes, 'dist_swim_bladder' : dist_swim_bladder, 'pixel_threshold' : pixel_threshold, 'frame_change_threshold' : frame_change_threshold, 'extended_eyes_calculation' : extended_eyes_calculation, 'eyes_threshold' : eyes_threshold, 'background' : hashlib.sha1(np.ascontiguousarray(background)).hexdigest()}
+        checkpoint = TrackingCheckpoint(get_checkpoint_path(video_path, save_path), checkpoint_params, starting_frame, resume = resume)
+        tracked_starting_frame = checkpoint.next_frame
+        tracked_n_frames = starting_frame + n_frames - tracked_starting_frame
+        if tracked_starting_frame > starting_frame:
+            print('Resuming tracking from frame number: {0}.'.format(tracked_starting_frame))
+
+    if profiler is not None:
+        # Keep the time of every frame in the requested range. Frames that were tracked before resuming are NaN.
+        profiler.frame_time_array = np.full(n_frames, np.nan, dtype = np.float32)
+
+    # Open the video path once and stream background subtracted, median blurred frames from the starting frame.
+    if pipelined:
+        # Decode and preprocess the frames ahead of tracking in a separate thread.
+        frame_reader = FramePrefetcher(video_path, starting_frame = tracked_starting_frame, n_frames = tracked_n_frames, background = background, queue_depth = decode_queue_depth, profiler = profiler)
+    else:
+        frame_reader = FrameReader(video_path, starting_frame = tracked_starting_frame, n_frames = tracked_n_frames, background = background, profiler = profiler)
 
     if save_video:
         # Create a path for the video once it is tracked.
-        save_video_path = "{0}\\{1}_tracked.avi".format(save_path, os.path.basename(video_path)[:-4])
-
-        # Create video writer.
-        writer = cv2.VideoWriter(save_video_path, 0, video_fps, frame_size)
-
-    # Initialize variables for data.
-    eye_coord_array = []
-    eye_angle_array = []
-    tail_coord_array = []
-    body_coord_array = []
-    heading_angle_array = []
-    prev_frame = None
-    prev_eye_angle = None
+        save_video_path = os.path.join(save_path, '{0}_tracked{1}{2}'.format(os.path.splitext(os.path.basename(video_path))[0], '' if tracked_starting_frame == starting_frame else '_from_{0}'.format(tracked_starting_frame), '.avi' if video_encoder_command is None else '.mp4'))
+
+        # Create video writer. When pipelined, the tracked frames are annotated and encoded in a separate thread.
+        writer = TrackedVideoWriter(save_video_path, video_fps, frame_size, colours, line_length = line_length, extended_eyes_calculation = extended_eyes_calculation, fourcc = video_fourcc, encoder_command = video_encoder_command, frame_step = video_frame_step, only_moving_frames = video_only_moving_frames, scale = video_scale, crop_radius = video_crop_radius, threaded = pipelined, queue_depth = write_queue_depth, profiler = profiler)
+
+    # Allocate the arrays for the tracking results. When checkpointing, the arrays only hold one chunk of frames at a time.
+    results_accumulator = TrackingResultsAccumulator(tracked_n_frames if checkpoint is None else min(checkpoint_frames, tracked_n_frames), n_tail_points)
+    checkpoint_starting_frame = 0
+
+    # Create the tracker and the state that is carried from frame to frame. The motion gate of the state decides whether a frame changed since the last tracked frame.
+    if motion_gate is None:
+        motion_gate = MotionGate(frame_change_threshold)
+    fish_tracker = FishTracker(n_tail_points, dist_tail_points, dist_eyes, dist_swim_bladder, pixel_threshold = pixel_threshold, extended_eyes_calculation = extended_eyes_calculation, eyes_threshold = eyes_threshold, background = background, profiler = profiler)
+    tracking_state = fish_tracker.create_state(motion_gate = motion_gate)
+    if extended_eyes_calculation and checkpoint is not None and tracked_starting_frame > starting_frame:
+        # Continue the order of the eyes from the frames that were tracked before resuming.
+        tracking_state.prev_eye_angle = checkpoint.get_prev_eye_angle()
 
     # Iterate through each frame.
-    for n in range(n_frames):
-        print('Tracking video. Processing frame number: {0} / {1}.'.format(n + 1, n_frames), end = '\r')
-        # Load a frame into memory.
-        success, original_frame = capture.read()
+    for n in range(tracked_n_frames):
+        report_progress('Tracking video. Processing frame number: {0} / {1}.'.format(tracked_starting_frame - starting_frame + n + 1, n_frames), tracked_starting_frame - starting_frame + n + 1, n_frames, progress_callback = progress_callback, stage = 'tracking')
+        if profiler is not None:
+            frame_t0 = t = time.perf_counter()
+        # Load the next background subtracted, median blurred frame into memory along with the original frame.
+        success, frame, original_frame = frame_reader.read(return_original_frame = True)
+        if profiler is not None:
+            t = profiler.add_time('read', t)
         # Checks if the frame was loaded successfully.
         if success:
-            # Initialize variables for each frame.
-            first_eye_coords = [np.nan, np.nan]
-            second_eye_coords = [np.nan, np.nan]
-            first_eye_angle = np.nan
-            second_eye_angle = np.nan
-            body_coords = [np.nan, np.nan]
-            heading_angle = np.nan
-            swim_bladder_coords = [np.nan, np.nan]
-            tail_point_coords = [[np.nan, np.nan] for m in range(n_tail_points)]
-            tail_points = [[np.nan, np.nan] for m in range(n_tail_points + 1)]
-            # Convert the original frame to grayscale.
-            frame = cv2.cvtColor(original_frame, cv2.COLOR_BGR2GRAY).astype(np.uint8)
-            # Convert the frame into the absolute difference between the frame and the background.
-            frame = cv2.absdiff(frame, background)
-            # Apply a median blur filter to the frame.
-            frame = cv2.medianBlur(frame, 3)
-            try:
-                # Check to ensure that the maximum pixel value is greater than a certain value. Useful for determining whether or not the at least one of the eyes is present in the frame.
-                if np.max(frame) > pixel_threshold:
-                    # Check to see if it's not the first frame and check if the sum of the absolute difference between the current frame and the previous frame is greater than a certain threshold. This helps reduce frame to frame noise in the position of the pixels.
-                    if prev_frame is not None and np.sum(np.abs(frame.astype(float) - prev_frame.astype(float)) > frame_change_threshold) == 0:
-                        # If the difference between the current frame and the previous frame is less than a certain threshold, then use the values that were previously calculated.
-                        first_eye_coords, second_eye_coords = eye_coord_array[len(eye_coord_array) - 1]
-                        first_eye_angle, second_eye_angle = eye_angle_array[len(eye_angle_array) - 1]
-                        body_coords = body_coord_array[len(body_coord_array) - 1]
-                        heading_angle = heading_angle_array[len(heading_angle_array) - 1]
-                        swim_bladder_coords = tail_coord_array[len(tail_coord_array) - 1][0]
-                        tail_point_coords = tail_coord_array[len(tail_coord_array) - 1][1:]
-                    else:
-                        # Return the coordinate of the brightest pixel.
-                        first_eye_coords = [np.where(frame == np.max(frame))[0][0], np.where(frame == np.max(frame))[1][0]]
-                        # Calculate the next brightest pixel that lies on the circle drawn around the first eye coordinates and has a radius equal to the distance between the eyes.
-                        second_eye_coords = calculate_next_coords(first_eye_coords, dist_eyes, frame, n_angles = 100, range_angles = 2 * np.pi, tail_calculation = False)
-                        # Check whether to to an additional process to calculate eye angles.
-                        if extended_eyes_calculation:
-                            # Calculate the angle between the two eyes.
-                            eye_angle = np.arctan2(second_eye_coords[0] - first_eye_coords[0], second_eye_coords[1] - first_eye_coords[1])
-                            # Check if this is the first frame.
-                            if prev_eye_angle is not None:
-                                # Check if the difference between the current eye angle and previous eye angle is somwehere around pi, meaning the first and second eye coordiantes have reversed. Occasionally, the coordinates of the eyes will switch between one and the other. This method is useful for keeping the positions of the left and right eye the same between frames.
-                                if eye_angle - prev_eye_angle > np.pi / 2 or eye_angle - prev_eye_angle < -np.pi / 2:
-                                    if eye_angle - prev_eye_angle < np.pi * 3 / 2 and eye_angle - prev_eye_angle > -np.pi * 3 / 2:
-                                        # Switch the first and second eye coordinates.
-                                        coords = first_eye_coords
-                                        first_eye_coords = second_eye_coords
-                                        second_eye_coords = coords
-                                        # Calculate the new eye angle.
-                                        eye_angle = np.arctan2(second_eye_coords[0] - first_eye_coords[0], second_eye_coords[1] - first_eye_coords[1])
-                            # Apply a threshold to the frame.
-                            thresh = cv2.threshold(frame, eyes_threshold, 255, cv2.THRESH_BINARY)[1]
-                            # Find the contours of the binary regions in the thresholded frame.
-                            contours = cv2.findContours(thresh, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)[1]
-                            # Iterate through each contour in the list of contours.
-                            for i in range(len(contours)):
-                                # Check if the first eye coordinate are within the current contour.
-                                if cv2.pointPolygonTest(contours[i], (first_eye_coords[1], first_eye_coords[0]), False) == 1:
-                                    # Set the first eye coordinates to the centroid of the binary region and calculate the first eye angle.
-                                    M = cv2.moments(contours[i])
-                                    first_eye_coords = [int(round(M['m01']/M['m00'])), int(round(M['m10']/M['m00']))]
-                                    first_eye_angle = cv2.fitEllipse(contours[i])[2] * np.pi / 180
-                                # Check if the second eye coordinate are within the current contour.
-                                if cv2.pointPolygonTest(contours[i], (second_eye_coords[1], second_eye_coords[0]), False) == 1:
-                                    # Set the second eye coordinates to the centroid of the binary region and calculate the second eye angle.
-                                    M = cv2.moments(contours[i])
-                                    second_eye_coords = [int(round(M['m01']/M['m00'])), int(round(M['m10']/M['m00']))]
-                                    second_eye_angle = cv2.fitEllipse(contours[i])[2] * np.pi / 180
-                        # Find the midpoint of the line that connects both eyes.
-                        heading_coords = [(first_eye_coords[0] + second_eye_coords[0]) / 2, (first_eye_coords[1] + second_eye_coords[1]) / 2]
-                        # Find the swim bladder coordinates by finding the next brightest coordinates that lie on a circle around the heading coordinates with a radius equal to the distance between the eyes and the swim bladder.
-                        swim_bladder_coords = calculate_next_coords(heading_coords, dist_swim_bladder, frame, n_angles = 100, range_angles = 2 * np.pi, tail_calculation = False)
-                        # Find the body coordinates by finding the center of the triangle that connects the eyes and swim bladder.
-                        body_coords = [int(round((swim_bladder_coords[0] + first_eye_coords[0] + second_eye_coords[0]) / 3)), int(round((swim_bladder_coords[1] + first_eye_coords[1] + second_eye_coords[1]) / 3))]
-                        # Calculate the heading angle as the angle between the body coordinates and the heading coordinates.
-                        heading_angle = np.arctan2(heading_coords[0] - body_coords[0], heading_coords[1] - body_coords[1])
-                        # Check whether to to an additional process to calculate eye angles.
-                        if extended_eyes_calculation:
-                            # Create an array that acts as a contour for the body and contains the swim bladder coordinates and eye coordinates.
-                            body_contour = np.array([np.array([swim_bladder_coords[1], swim_bladder_coords[0]]), np.array([first_eye_coords[1], first_eye_coords[0]]), np.array([second_eye_coords[1], second_eye_coords[0]])])
-                            # Check to see if the point that is created by drawing a line from the first eye coordinates with a length equal to half of the distance between the eyes is within the body contour. Occasionally, the angle of the eye is flipped to face towards the body instead of away. This is to check whether or not the eye angle should be flipped.
-                            if cv2.pointPolygonTest(body_contour, (first_eye_coords[1] + (dist_eyes / 2 * np.cos(first_eye_angle)), first_eye_coords[0] + (dist_eyes / 2 * np.sin(first_eye_angle))), False) == 1:
-                                # Flip the first eye angle.
-                                if first_eye_angle > 0:
-                                    first_eye_angle -= np.pi
-                                else:
-                                    first_eye_angle += np.pi
-                            # Check to see if the point that is created by drawing a line from the first eye coordinates with a length equal to half of the distance between the eyes is within the body contour. Occasionally, the angle of the eye is flipped to face towards the body instead of away. This is to check whether or not the eye angle should be flipped.
-                            if cv2.pointPolygonTest(body_contour, (second_eye_coords[1] + (dist_eyes / 2 * np.cos(second_eye_angle)), second_eye_coords[0] + (dist_eyes / 2 * np.sin(second_eye_angle))), False) == 1:
-                                # Flip the second eye angle.
-                                if second_eye_angle > 0:
-                                    second_eye_angle -= np.pi
-                                else:
-                                    second_eye_angle += np.pi
-                        # Calculate the initial tail angle as the angle opposite to the heading angle.
-                        if heading_angle > 0:
-                            tail_angle = heading_angle - np.pi
-                        else:
-                            tail_angle = heading_angle + np.pi
-                        # Iterate through the number of tail points.
-                        for m in range(n_tail_points):
-                            # Check if this is the first tail point.
-                            if m == 0:
-                                # Calculate the first tail point using the swim bladder as the first set of coordinates.
-                                tail_point_coords[m] = calculate_next_coords(swim_bladder_coords, dist_tail_points, frame, angle = tail_angle)
-                            else:
-                                # Check if this is the second tail point.
-                                if m == 1:
-                                    # Calculate the next tail angle as the angle between the first tail point and the swim bladder.
-                                    tail_angle = np.arctan2(tail_point_coords[m - 1][0] - swim_bladder_coords[0], tail_point_coords[m - 1][1] - swim_bladder_coords[1])
-                                # Check if the number of tail points calculated is greater than 2.
-                                else:
-                                    # Calculate the next tail angle as the angle between the last two tail points.
-                                    tail_angle = np.arctan2(tail_point_coords[m - 1][0] - tail_point_coords[m - 2][0], tail_point_coords[m - 1][1] - tail_point_coords[m - 2][1])
-                                # Calculate the next set of tail coordinates.
-                                tail_point_coords[m] = calculate_next_coords(tail_point_coords[m - 1], dist_tail_points, frame, angle = tail_angle)
-                        # Set the previous frame to the current frame.
-                        prev_frame = frame
-                        # Check whether to to an additional process to calculate eye angles.
-                        if extended_eyes_calculation:
-                            # Set the previous eye angle to the current eye angle.
-                            prev_eye_angle = eye_angle
-
-                    if save_video:
-                        # Check whether to to an additional process to calculate eye angles.
-                        if extended_eyes_calculation:
-                            # Draw a circle arround the first eye coordinates.
-                            original_frame = cv2.circle(original_frame, (first_eye_coords[1], first_eye_coords[0]), 1, colours[-3], -1)
-                            # Draw a line representing the first eye angle.
-                            original_frame = cv2.line(original_frame, (first_eye_coords[1], first_eye_coords[0]), (int(round(first_eye_coords[1] + (line_length * np.cos(first_eye_angle)))), int(round(first_eye_coords[0] + (line_length * np.sin(first_eye_angle))))), colours[-3], 1)
-                            # Draw a circle around the second eye coordinates.
-                            original_frame = cv2.circle(original_frame, (second_eye_coords[1], second_eye_coords[0]), 1, colours[-2], - 1)
-                            # Draw a line representing the second eye angle.
-                            original_frame = cv2.line(original_frame, (second_eye_coords[1], second_eye_coords[0]), (int(round(second_eye_coords[1] + (line_length * np.cos(second_eye_angle)))), int(round(second_eye_coords[0] + (line_length * np.sin(second_eye_angle))))), colours[-2], 1)
-                        else:
-                            # Draw a circle arround the first eye coordinates.
-                            original_frame = cv2.circle(original_frame, (first_eye_coords[1], first_eye_coords[0]), 1, colours[-2], -1)
-                            # Draw a circle arround the second eye coordinates.
-                            original_frame = cv2.circle(original_frame, (second_eye_coords[1], second_eye_coords[0]), 1, colours[-2], - 1)
-                        # Iterate through each set of tail points.
-                        for m in range(n_tail_points):
-                            # Check if this is the first tail point
-                            if m == 0:
-                                # For the first tail point, draw around the midpoint of the line that connects the swim bladder to the first tail point.
-                                original_frame = cv2.circle(original_frame, (int(round((swim_bladder_coords[1] + tail_point_coords[m][1]) / 2)), int(round((swim_bladder_coords[0] + tail_point_coords[m][0]) / 2))), 1, colours[m], -1)
-                            else:
-                                # For all subsequent tail points, draw around the midpoint of the line that connects the previous tail point to the current tail point.
-                                original_frame = cv2.circle(original_frame, (int(round((tail_point_coords[m - 1][1] + tail_point_coords[m][1]) / 2)), int(round((tail_point_coords[m - 1][0] + tail_point_coords[m][0]) / 2))), 1, colours[m], -1)
-                        # Draw an arrow for the heading angle.
-                        original_frame = cv2.arrowedLine(original_frame, (int(round(heading_coords[1] - (line_length / 2 * np.cos(heading_angle)))), int(round(heading_coords[0] - (line_length / 2 * np.sin(heading_angle))))), (int(round(heading_coords[1] + (line_length * np.cos(heading_angle)))), int(round(heading_coords[0] + (line_length * np.sin(heading_angle))))), colours[-1], 1, tipLength = 0.2)
-            except:
-                # Handles any errors that occur throughout tracking.
-                first_eye_coords = [np.nan, np.nan]
-                second_eye_coords = [np.nan, np.nan]
-                first_eye_angle = np.nan
-                second_eye_angle = np.nan
-                body_coords = [np.nan, np.nan]
-                heading_angle = np.nan
-                swim_bladder_coords = [np.nan, np.nan]
-                tail_point_coords = [[np.nan, np.nan] for m in range(n_tail_points)]
-                tail_points = [[np.nan, np.nan] for m in range(n_tail_points + 1)]
-            # Iterate through the number of tail points, including the swim bladder coordinates.
-            for m in range(n_tail_points + 1):
-                # Check if this is the first tail point.
-                if m == 0:
-                    # Add the swim bladder to a list that will contain all of the tail points, including the swim bladder.
-                    tail_points[m] = swim_bladder_coords
-                else:
-                    # Add all of the tail points to the list.
-                    tail_points[m] = tail_point_coords[m - 1]
-            # Add all of the important features that were tracked into lists.
-            eye_coord_array.append([first_eye_coords, second_eye_coords])
-            eye_angle_array.append([first_eye_angle, second_eye_angle])
-            tail_coord_array.append(tail_points)
-            body_coord_array.append(body_coords)
-            heading_angle_array.append(heading_angle)
+            # Track the frame. Frames that did not change since the last tracked frame reuse the previous tracking results.
+            tracking_record = fish_tracker.track_frame(frame, tracking_state, preprocessed = True)
+            # Write all of the important features that were tracked into the arrays of tracking results.
+            results_accumulator.add(tracking_record)
+            if profiler is not None:
+                t = profiler.add_time('track', t)
             if save_video:
-                # Write the new frame that contains the annotated frame with tracked points to a new video.
-                writer.write(original_frame)
-
-    print('Tracking video. Processing frame number: {0} / {1}.'.format(n + 1, n_frames))
+                # Write the frame to the tracked video. The writer annotates the tracked points onto the frame.
+                writer.write(original_frame, convert_tracking_record_to_results(tracking_record))
+                if profiler is not None:
+                    t = profiler.add_time('write', t)
+        elif profiler is not None:
+            profiler.count('frames_failed_decode')
+        if profiler is not None:
+            profiler.set_frame_time(tracked_starting_frame - starting_frame + n, t - frame_t0)
+        if checkpoint is not None and ((n + 1) % checkpoint_frames == 0 or n + 1 == tracked_n_frames):
+            if profiler is not None:
+                t = time.perf_counter()
+            # Append the tracking results of the chunk to the checkpoint and release them from memory.
+            checkpoint.append(results_accumulator.get_records(), n_frames = n + 1 - checkpoint_starting_frame)
+            checkpoint_starting_frame = n + 1
+            results_accumulator.clear()
+            if profiler is not None:
+                profiler.add_time('checkpoint', t)
+
+    print('Tracking video. Processing frame number: {0} / {1}.'.format(n_frames, n_frames))
+    motion_gate_statistics = motion_gate.get_statistics()
+    print('Frames that did not change and reused the previous results: {0} / {1}.'.format(motion_gate_statistics['n_skipped_frames'], motion_gate_statistics['n_checked_frames']))
     # Unload the video and writer from memory.
-    capture.release()
+    frame_reader.release()
     if save_video:
         writer.release()
 
+    if checkpoint is not None:
+        # Consolidate the chunks of tracking results from the checkpoint.
+        tracking_records = checkpoint.consolidate()
+        if tracking_records is None:
+            tracking_records = create_tracking_records(0, n_tail_points)
+        tracking_results = convert_tracking_records_to_results(tracking_records)
+    else:
+        tracking_results = results_accumulator.get_results()
+
     # Create a dictionary that contains all of the results.
-    results =   {   'eye_coord_array' : eye_coord_array,
-                    'eye_angle_array' : eye_angle_array,
-                    'tail_coord_array' : tail_coord_array,
-                    'body_coord_array' : body_coord_array,
-                    'heading_angle_array' : heading_angle_array,
+    results =   {   'eye_coord_array' : tracking_results['eye_coord_array'],
+                    'eye_angle_array' : tracking_results['eye_angle_array'],
+                    'heading_coord_array' : tracking_results['heading_coord_array'],
+                    'tail_coord_array' : tracking_results['tail_coord_array'],
+                    'body_coord_array' : tracking_results['body_coord_array'],
+                    'heading_angle_array' : tracking_results['heading_angle_array'],
                     'video_path' : video_path,
                     'video_n_frames' : video_n_frames,
                     'video_fps' : video_fps,
@@ -1097,13 +3698,315 @@ def track_video(video_path, colours, n_tail_points, dist_tail_points, dist_eyes,
                     'eyes_threshold' : eyes_threshold,
                     'pixel_threshold' : pixel_threshold,
                     'frame_change_threshold' : frame_change_threshold,
+                    'motion_gate_statistics' : motion_gate_statistics,
                     'colours' : colours
                 }
+    if profiler is not None:
+        # Save the time spent on each frame alongside the results.
+        results['frame_time_array'] = profiler.frame_time_array
+        t = time.perf_counter()
+
+    # Create a path to the folder that will contain all of the results from tracking.
+    results_path = os.path.join(save_path, '{0}_results'.format(os.path.splitext(os.path.basename(video_path))[0]))
+
+    # Save the results in a columnar format.
+    save_tracking_results(results, results_path)
+
+    if checkpoint is not None:
+        # Remove the checkpoint once the results are saved.
+        checkpoint.remove()
+
+    if profiler is not None:
+        profiler.add_time('save_results', t)
+        profiler.stop()
+        # Print the summary table and save the summary and frame times to a JSON trace in the results folder.
+        print(profiler.format_summary())
+        profiler.save_trace(os.path.join(results_path, 'tracking_profile.json'))
 
-    # Create a path that will contain all of the results from tracking.
-    data_path = "{0}\\{1}_results.npy".format(save_path, os.path.basename(video_path)[:-4])
+    print('Total processing time: {0} seconds.'.format(time.time() - t0))
+
+# Colours used for annotating the tracked videos when no colours are provided.
+default_colours = [ (0, 0, 255),     (0, 127, 255),  (0, 255, 255),  (0, 255, 127),  (0, 255, 0),
+                    (255, 255, 0),  (255, 0, 0),    (255, 0, 127),  (147, 20, 255), (139, 139, 0),
+                    (49, 191, 114)
+                    ]
+
+# File extensions of the videos found when a folder of videos is tracked.
+video_extensions = ['.avi', '.mp4', '.mov', '.mkv']
+
+# Pattern of the names of the tracked videos written by track_video, {name of video}_tracked or {name of video}_tracked_from_{frame number}, without the file extension.
+tracked_video_name_pattern = re.compile(r'_tracked(_from_\d+)?$')
+
+def is_tracked_video(video_path):
+    # Return whether a video is a tracked video written by track_video, judged by its file name.
+    return tracked_video_name_pattern.search(os.path.splitext(os.path.basename(video_path))[0]) is not None
+
+def load_tracking_parameters(parameters_path):
+    # Load a dictionary of tracking parameters from a JSON file, a TOML file, or a file saved with np.save, like the tracking_parameters.npy file saved by the GUI. The format is chosen by the file extension.
+    extension = os.path.splitext(parameters_path)[1].lower()
+    if extension == '.json':
+        with open(parameters_path, 'r') as f:
+            return json.load(f)
+    if extension == '.toml':
+        try:
+            import tomllib
+        except ImportError:
+            try:
+                import tomli as tomllib
+            except ImportError:
+                print('Error: loading TOML files requires Python 3.11 or the tomli package.')
+                return
+        with open(parameters_path, 'rb') as f:
+            return tomllib.load(f)
+    return np.load(parameters_path, allow_pickle = True).item()
+
+def save_tracking_parameters(tracking_parameters, parameters_path):
+    # Save a dictionary of tracking parameters to a JSON file, or to a file with np.save if the extension is not .json. Arrays, such as colours, are saved as lists in JSON files.
+    if os.path.splitext(parameters_path)[1].lower() == '.json':
+        with open(parameters_path, 'w') as f:
+            json.dump(tracking_parameters, f, indent = 4, default = lambda value: value.tolist() if hasattr(value, 'tolist') else str(value))
+    else:
+        np.save(parameters_path, tracking_parameters)
+
+def get_track_video_arguments(tracking_parameters):
+    # Return the tracking parameters that are arguments of track_video. The video path, colours, and save path are passed to track_video separately.
+    track_video_arguments = inspect.signature(track_video).parameters
+    return {key : value for key, value in tracking_parameters.items() if key in track_video_arguments and key not in ['video_path', 'colours', 'save_path']}
 
-    # Save the results to a npz file.
-    np.save(data_path, results)
+def find_videos(video_paths):
+    '''
+    Returns the paths to the videos in a folder, the paths that match a glob pattern, or a list of either.
 
+    Required Arguments:
+        video_paths (str or list) - Path to a folder, a glob pattern such as D:\\2018-09-06\\*.avi, a path to a video, or a list of any of these.
+            ** Videos in a folder are found by their file extension. See video_extensions.
+            ** Tracked videos written by track_video, whose names end with _tracked or _tracked_from_{frame number}, are left out of folders and glob patterns, since they are saved next to the videos when no save path is given. A tracked video is only returned when its path is given directly.
+
+    Returns:
+        video_paths (list) - Sorted list of paths to the videos, without duplicates.
+    '''
+    if isinstance(video_paths, str):
+        video_paths = [video_paths]
+    found_video_paths = []
+    for video_path in video_paths:
+        if os.path.isdir(video_path):
+            found_video_paths += [os.path.join(video_path, file_name) for file_name in os.listdir(video_path) if os.path.splitext(file_name)[1].lower() in video_extensions and not is_tracked_video(file_name)]
+        elif os.path.isfile(video_path):
+            found_video_paths.append(video_path)
+        else:
+            found_video_paths += [path for path in glob.glob(video_path) if os.path.isfile(path) and not is_tracked_video(path)]
+    return sorted(set(found_video_paths))
+
+def get_available_memory():
+    # Return the amount of memory in bytes that is available to start new processes without swapping. Returns None if it can not be determined.
+    try:
+        # Linux reports the memory that can be used without swapping in /proc/meminfo.
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        pass
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        return None
+
+def estimate_tracking_memory(video_path, decode_queue_depth = 16, write_queue_depth = 16, save_video = True, checkpoint_frames = None, n_frames = None, n_tail_points = 7):
+    # Estimate the peak memory in bytes used by a process that tracks a video with track_video. The estimate includes the memory used by the libraries, the frames in the decode and write queues, and the results that are kept in memory.
+    frame_width, frame_height = get_frame_size_from_video(video_path)
+    frame_bytes = frame_width * frame_height
+    if n_frames is None:
+        n_frames = get_total_frame_number_from_video(video_path)
+    # Each decoded frame holds a colour frame and a background subtracted frame. Each frame waiting to be written holds a colour frame and an annotated copy.
+    queue_bytes = frame_bytes * 4 * (decode_queue_depth + 2)
+    if save_video:
+        queue_bytes += frame_bytes * 6 * (write_queue_depth + 2)
+    # The arrays of the results accumulator hold every frame, or one chunk of frames when checkpointing. Each chunk is converted into tracking records when it is saved to the checkpoint.
+    record_bytes = get_tracking_results_dtype(n_tail_points).itemsize
+    consolidation_bytes = 0
+    if checkpoint_frames is None:
+        results_bytes = n_frames * get_tracking_results_frame_bytes(n_tail_points)
+    else:
+        results_bytes = min(n_frames, checkpoint_frames) * (get_tracking_results_frame_bytes(n_tail_points) + record_bytes)
+        # Once the video is tracked and the queues are released, the chunks are loaded as tracking records and converted into the arrays of results.
+        consolidation_bytes = n_frames * record_bytes * 2
+    # The libraries use roughly 150 MB.
+    return 150 * 1024 * 1024 + max(frame_bytes * 4 + queue_bytes + results_bytes, consolidation_bytes)
+
+def _track_video_in_batch(batch_params):
+    # Track a single video in a worker process and return a summary of the result. The output of track_video is written to a log file instead of the console so that the progress of different videos does not overlap.
+    video_path, colours, tracking_params, save_path, log_path = batch_params
+    video_summary = {'video_path' : video_path, 'status' : 'running', 'started' : time.strftime('%Y-%m-%d %H:%M:%S'), 'log_path' : log_path}
+    t0 = time.time()
+    try:
+        with open(log_path, 'w') as log_file, contextlib.redirect_stdout(log_file):
+            # Calculate the background in this process. Backgrounds are shared through the background cache.
+            if tracking_params.get('background_path') is None:
+                tracking_params['background_path'] = os.path.join(save_path, '{0}_background.tif'.format(os.path.splitext(os.path.basename(video_path))[0]))
+                background = calculate_background(video_path, n_processes = 1)[0]
+                if background is None:
+                    raise ValueError('The background could not be calculated.')
+                save_background_to_file(background, tracking_params['background_path'])
+            track_video(video_path, colours, save_path = save_path, **tracking_params)
+        # Count the frames in the saved results, since fewer frames than requested are tracked when the video is shorter.
+        results_path = os.path.join(save_path, '{0}_results'.format(os.path.splitext(os.path.basename(video_path))[0]))
+        n_frames = len(load_tracking_results(results_path)['heading_angle_array'])
+        video_summary.update({'status' : 'completed', 'n_frames' : n_frames, 'results_path' : results_path})
+    except Exception:
+        video_summary.update({'status' : 'failed', 'error' : traceback.format_exc()})
+    video_summary['processing_time'] = time.time() - t0
+    if video_summary['status'] == 'completed' and video_summary['processing_time'] > 0:
+        video_summary['frames_per_second'] = video_summary['n_frames'] / video_summary['processing_time']
+    video_summary['finished'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    return video_summary
+
+def track_videos(video_paths, tracking_parameters, colours = None, save_path = None, n_processes = None, memory_fraction = 0.75, manifest_path = None, skip_completed = True, progress_callback = None, **tracking_kwargs):
+    '''
+    Tracks a batch of videos across a pool of processes, with one video per process at a time.
+
+    Steps:
+        The videos are found in a folder, a glob pattern, or a list of paths.
+        The tracking parameters are loaded and the parameters that are not used by track_video are ignored.
+        The memory needed to track each video is estimated. A video is only started when its estimate fits in the memory that is left, so that the computer does not start swapping.
+        Each process opens and tracks its own video with track_video. Backgrounds are shared between processes and runs through the background cache.
+        A manifest with the status, throughput and errors of each video is updated every time a video finishes.
+
+    Required Arguments:
+        video_paths (str or list) - Folder of videos, glob pattern, path to a video, or a list of any of these. See find_videos.
+        tracking_parameters (dict or str) - Dictionary of tracking parameters or a path to a tracking_parameters.npy file saved by the GUI, a JSON file, or a TOML file. See load_tracking_parameters.
+            ** Keys that are arguments of track_video are used. Other keys, such as frame_batch_size, are ignored.
+
+    Optional Arguments:
+        colours (list([B, G, R])) - List of colours used for annotating the tracked videos. Default = None.
+            ** When colours is None, the colours in the tracking parameters or default_colours are used.
+        save_path (str) - Folder where the results of every video are saved. Default = None.
+            ** When save_path is None, the results of each video are saved next to the video.
+        n_processes (int) - Maximum number of videos that are tracked at the same time. Default = None.
+            ** When n_processes is None, n_processes = the number of CPUs.
+        memory_fraction (float) - Fraction of the available memory that the tracking processes may use. Default = 0.75.
+            ** At least one video is always tracked, even if its estimate does not fit.
+        manifest_path (str) - Path to the manifest JSON file. Default = None.
+            ** When manifest_path is None, the manifest is saved as batch_manifest.json in the save path, or in the folder that contains all of the videos.
+        skip_completed (bool) - Boolean to determine whether or not videos that completed in a previous run with the same manifest are skipped. Default = True.
+        progress_callback (function) - Function that receives the progress every time a video finishes. Default = None.
+            ** When progress_callback is None, the progress is printed. See report_progress.
+        tracking_kwargs - Keyword arguments passed to track_video. These replace the values in the tracking parameters.
+
+    Returns:
+        manifest (dict) - Dictionary that contains the tracking parameters and a summary of each video.
+            ** Each summary contains the status (completed, failed, or skipped), processing time, frames per second, path to the results, path to the log file, and the error if the video failed.
+    '''
+    t0 = time.time()
+    video_paths = find_videos(video_paths)
+    if len(video_paths) == 0:
+        print('Error: no videos were found.')
+        return
+    if isinstance(tracking_parameters, str):
+        tracking_parameters = load_tracking_parameters(tracking_parameters)
+        if tracking_parameters is None:
+            return
+    tracking_parameters = dict(tracking_parameters)
+    tracking_parameters.update(tracking_kwargs)
+    if colours is None:
+        colours = tracking_parameters.get('colours', default_colours)
+    # Keep the tracking parameters that are arguments of track_video.
+    tracking_params = get_track_video_arguments(tracking_parameters)
+    # Check the required tracking parameters.
+    for key in ['n_tail_points', 'dist_tail_points', 'dist_eyes', 'dist_swim_bladder']:
+        if key not in tracking_params:
+            print('Error: the tracking parameters must contain {0}.'.format(key))
+            return
+    if manifest_path is None:
+        manifest_folder = save_path if save_path is not None else os.path.commonpath([os.path.dirname(os.path.abspath(video_path)) for video_path in video_paths])
+        manifest_path = os.path.join(manifest_folder, 'batch_manifest.json')
+    if save_path is not None and not os.path.isdir(save_path):
+        os.makedirs(save_path)
+
+    # Load the manifest of a previous run to skip the videos that were completed.
+    previous_videos = {}
+    if skip_completed and os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, 'r') as f:
+                previous_videos = {video_summary['video_path'] : video_summary for video_summary in json.load(f)['videos']}
+        except (OSError, ValueError, KeyError):
+            previous_videos = {}
+    manifest = {'created' : time.strftime('%Y-%m-%d %H:%M:%S'), 'tracking_parameters' : tracking_params, 'colours' : colours, 'videos' : []}
+    video_summaries = {}
+    pending_videos = []
+    for video_path in video_paths:
+        previous_video_summary = previous_videos.get(video_path)
+        if previous_video_summary is not None and previous_video_summary.get('status') in ['completed', 'skipped'] and os.path.isdir(previous_video_summary.get('results_path', '')):
+            video_summaries[video_path] = dict(previous_video_summary, status = 'skipped')
+        else:
+            video_summaries[video_path] = {'video_path' : video_path, 'status' : 'pending'}
+            pending_videos.append(video_path)
+
+    def save_manifest():
+        # Save the manifest to a temporary file first so that the manifest is never partially written.
+        manifest['videos'] = [video_summaries[video_path] for video_path in video_paths]
+        with open('{0}.tmp'.format(manifest_path), 'w') as f:
+            json.dump(manifest, f, indent = 4, default = lambda value: value.tolist() if hasattr(value, 'tolist') else str(value))
+        os.replace('{0}.tmp'.format(manifest_path), manifest_path)
+
+    # Estimate the memory used to track each video and the memory that the processes may use.
+    memory_estimates = {}
+    for video_path in pending_videos:
+        try:
+            memory_estimates[video_path] = estimate_tracking_memory(video_path, decode_queue_depth = tracking_params.get('decode_queue_depth', 16), write_queue_depth = tracking_params.get('write_queue_depth', 16), save_video = tracking_params.get('save_video', True), checkpoint_frames = tracking_params.get('checkpoint_frames'), n_frames = tracking_params.get('n_frames'), n_tail_points = tracking_params['n_tail_points'])
+        except Exception:
+            memory_estimates[video_path] = 0
+    available_memory = get_available_memory()
+    memory_budget = None if available_memory is None else available_memory * memory_fraction
+    if n_processes is None:
+        n_processes = mp.cpu_count()
+    n_processes = max(min(n_processes, len(pending_videos)), 1)
+
+    save_manifest()
+    print('Tracking {0} videos. Skipping {1} videos that were already tracked.'.format(len(pending_videos), len(video_paths) - len(pending_videos)))
+    pool = mp.Pool(n_processes) if len(pending_videos) > 0 else None
+    running_videos = {}
+    try:
+        while len(pending_videos) > 0 or len(running_videos) > 0:
+            # Start the next videos while there are free processes and their memory estimates fit in the memory budget.
+            while len(pending_videos) > 0 and len(running_videos) < n_processes:
+                used_memory = sum([memory_estimates[video_path] for video_path in running_videos])
+                if memory_budget is not None and len(running_videos) > 0 and used_memory + memory_estimates[pending_videos[0]] > memory_budget:
+                    break
+                video_path = pending_videos.pop(0)
+                video_save_path = save_path if save_path is not None else os.path.dirname(os.path.abspath(video_path))
+                log_path = os.path.join(video_save_path, '{0}_tracking.log'.format(os.path.splitext(os.path.basename(video_path))[0]))
+                running_videos[video_path] = pool.apply_async(_track_video_in_batch, [[video_path, colours, dict(tracking_params), video_save_path, log_path]])
+                video_summaries[video_path] = {'video_path' : video_path, 'status' : 'running', 'log_path' : log_path, 'memory_estimate_mb' : memory_estimates[video_path] / (1024 * 1024)}
+                save_manifest()
+            # Wait for a video to finish.
+            finished_videos = [video_path for video_path, async_result in running_videos.items() if async_result.ready()]
+            if len(finished_videos) == 0:
+                time.sleep(0.1)
+                continue
+            for video_path in finished_videos:
+                try:
+                    video_summary = running_videos.pop(video_path).get()
+                except Exception:
+                    video_summary = {'video_path' : video_path, 'status' : 'failed', 'error' : traceback.format_exc()}
+                video_summary['memory_estimate_mb'] = memory_estimates[video_path] / (1024 * 1024)
+                video_summaries[video_path] = video_summary
+                n_finished_videos = len([video_summary for video_summary in video_summaries.values() if video_summary['status'] in ['completed', 'failed', 'skipped']])
+                report_progress('Tracked video: {0}. Status: {1}.'.format(video_path, video_summary['status']), n_finished_videos, len(video_paths), progress_callback = progress_callback, stage = 'batch', end = '\n')
+            save_manifest()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    manifest['processing_time'] = time.time() - t0
+    save_manifest()
+    n_failed = len([video_path for video_path in video_paths if video_summaries[video_path]['status'] == 'failed'])
+    print('Tracked {0} videos. Failed: {1}. Manifest saved to {2}.'.format(len(video_paths), n_failed, manifest_path))
     print('Total processing time: {0} seconds.'.format(time.time() - t0))
+    return manifest